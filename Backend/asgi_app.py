@@ -0,0 +1,419 @@
+# --- ASGI serving mode: async database I/O + bounded inference executor ---
+# Serves /predict, /find_by_body, /cars and /img (plus /healthz, /readyz and /metrics) with Starlette. The routes reuse the
+# helpers from app.py, so validation, the prediction cache, the in-memory snapshots, the micro-batcher and the
+# write-behind logger behave the same as on the Flask path. What changes is where a request waits:
+#   * the SMART QUERY tiers, the /find_by_body query, the /cars fallback and the log INSERT use SQLAlchemy's
+#     async engine (asyncpg for PostgreSQL, aiosqlite for SQLite), so a DB round trip only suspends a coroutine;
+#   * validation + model.predict run in a thread pool of INFERENCE_EXECUTOR_THREADS. When INFERENCE_MAX_PENDING
+#     calls are already queued, new /predict requests get 503 + Retry-After instead of an unbounded backlog.
+# The model, the sync engine (snapshots, log writer) and the snapshots are loaded by app.py's warm-up thread.
+# The other routes (/predict/batch, the stats and admin endpoints) stay on the Flask app.
+#
+# Usage:
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+#   WEB_CONCURRENCY=4 uvicorn asgi_app:app --host 0.0.0.0 --port 5000     # each worker loads its own model
+#   python load_test.py --compare --clients 500                         # vs gunicorn + Flask
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, FileResponse
+from starlette.routing import Route
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import app as api
+import telemetry
+from car_options import option_statements, with_defaults
+from keyset_pages import Walk, page_statements, next_page
+from micro_batcher import QueueFull
+
+logger = logging.getLogger("carify.asgi")
+
+# sync driver scheme -> async driver scheme
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+async_engine = None
+inference_executor = None
+
+
+def async_database_uri(uri):
+    """ DATABASE_URI with its driver swapped for the async one (postgresql://... -> postgresql+asyncpg://...). """
+    scheme, separator, rest = uri.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + separator + rest
+
+
+class Overloaded(Exception):
+    pass
+
+
+class InferenceExecutor:
+    """ Thread pool for CPU work (validation, model.predict) with a cap on calls waiting for a thread. """
+
+    def __init__(self, threads, max_pending):
+        self.threads = threads
+        self.max_pending = max_pending
+        self.pending = 0  # only touched from the event loop thread
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix="inference")
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded()
+        self.pending += 1
+        try:
+            # Run in a copy of this request's context, so the worker thread sees its telemetry trace
+            call = functools.partial(contextvars.copy_context().run, fn, *args)
+            return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _JSONResponse(JSONResponse):
+    """ Same encoding as Flask's jsonify (NaN allowed), compact. """
+
+    def render(self, content):
+        return json.dumps(content, separators=(',', ':')).encode()
+
+
+def _error(message, status_code, headers=None):
+    return _JSONResponse({"error": message}, status_code, headers)
+
+
+def _model_unavailable():
+    if api.model_status["state"] == "failed": return _error("Model not loaded", 500)
+    return _error("Model is still loading, retry shortly", 503, {"Retry-After": "5"})
+
+
+def _similar_by_features(request):
+    return request.query_params.get('similar_by', '').lower() == 'features'
+
+
+def _present_cars(cars, request, sort_by_deal=False):
+    """ Deal scores + image_url -> this API's /img/<hash> thumbnails (see app._present_cars). """
+    return api._present_cars(cars, api.IMG_BASE_URL or str(request.base_url).rstrip('/'), sort_by_deal)
+
+
+# === SCORING (runs in the inference executor) =====================
+
+def _prepare_and_predict(data, by_features, batched):
+    """ Validates one /predict body with the compiled schema, looks it up in the prediction cache and (unless
+    micro-batched or cached) predicts it. Returns a dict with error / cache_key / cached / row / prediction, plus the
+    cache, serving model and validated batch of the request (one model version per request, see app.predict_price). """
+    trace = telemetry.current_trace()
+    cache, serving = api.prediction_cache, api.serving_model
+    with trace.stage("validate"):
+        validated = api.INPUT_SCHEMA.validate([data])
+        if validated.errors[0]: return {"error": validated.errors[0]}
+        model_row = validated.rows()[0]
+
+    result = {"error": None, "cache_key": None, "cached": None, "row": model_row, "prediction": None,
+              "cache": cache, "serving": serving, "validated": validated}
+    if cache is not None:
+        with trace.stage("cache"):
+            result["cache_key"] = cache.make_key(
+                model_row, api.CLEANED_CATEGORICAL_COLS, api.CLEANED_NUMERICAL_COLS, api.PREDICTION_CACHE_ROUND_DIGITS
+            ) + (":features" if by_features else "")
+            result["cached"] = cache.get(result["cache_key"])
+        telemetry.observe_cache_lookup(result["cached"] is not None)
+        if result["cached"] is not None: return result
+
+    if not batched:
+        with trace.stage("inference"):
+            result["prediction"] = float(api._predict_prices(validated, serving)[0])
+    return result
+
+
+# === ASYNC DATABASE ACCESS ========================================
+
+async def _find_similar_cars(target_body, prediction_result, features=None):
+    """ SMART QUERY: in-memory snapshot when loaded, else the same tiers as app.py on the async engine. """
+    if features is not None:
+        similar_cars_list = await inference_executor.run(api._similar_from_memory, target_body, prediction_result, features)
+    else:
+        similar_cars_list = api._similar_from_memory(target_body, prediction_result)
+    if similar_cars_list is not None: return similar_cars_list
+
+    results = []
+    async with async_engine.connect() as conn:
+        for tier, description, statement in api._similar_car_tiers(target_body, prediction_result):
+            results = (await conn.execute(statement)).all()
+            if results: break
+    telemetry.annotate(tier=f"sql_{tier}")
+    return [api._similar_car_dict(c) for c in results]
+
+
+async def _log_prediction(data, prediction_result, model_version):
+    filtered_log_data = api._build_log_entry(data, prediction_result, model_version)
+    if not filtered_log_data: return
+    if api.prediction_log_writer is not None:
+        if not api.prediction_log_writer.submit(filtered_log_data):
+            logger.warning("Prediction log queue full: log row dropped")
+        return
+    try:
+        async with async_engine.begin() as conn:
+            await conn.execute(insert(api.PredictionLog), [filtered_log_data])
+    except Exception as db_error:
+        logger.error("Database logging error: %s", db_error)
+
+
+# === API ENDPOINTS ===============================================
+
+async def healthz(request):
+    return _JSONResponse({"status": "ok", "pid": os.getpid(), "uptime_seconds": round(time.time() - api.PROCESS_STARTED_AT, 1)})
+
+
+async def readyz(request):
+    """ 200 once the model is warm and the async engine answers SELECT 1. """
+    database = {"state": "ready", "pool": async_engine.pool.status()}
+    try:
+        start = time.perf_counter()
+        async with async_engine.connect() as conn: await conn.execute(text("SELECT 1"))
+        database["ping_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    except Exception as e:
+        database.update({"state": "unreachable", "error": str(e)})
+
+    ready = api.model_status["state"] == "ready" and database["state"] == "ready"
+    return _JSONResponse({
+        "ready": ready,
+        "pid": os.getpid(),
+        "model": {**api.model_status, "serving_mode": api.MODEL_SERVING_MODE},
+        "database": database,
+        "executor": {"threads": inference_executor.threads, "pending": inference_executor.pending,
+                     "rejected": inference_executor.rejected},
+    }, 200 if ready else 503)
+
+
+async def predict_price(request):
+    """ /predict: same contract as the Flask route. """
+    if api.model is None: return _model_unavailable()
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data: return _error("No input data", 400)
+
+    try:
+        by_features = _similar_by_features(request)
+        batched = api.micro_batcher is not None
+        trace = telemetry.current_trace()
+        try:
+            prepared = await inference_executor.run(_prepare_and_predict, data, by_features, batched)
+        except Overloaded:
+            return _error("Server busy, retry shortly", 503, {"Retry-After": "1"})
+        if prepared["error"]: return _JSONResponse(prepared["error"], 400)
+
+        cached = prepared["cached"]
+        served_version = prepared["serving"].version  # replaced by the version that scored the row when micro-batched
+        if cached is not None:
+            prediction_result = cached["predicted_price"] if cached["predicted_price"] is not None else float('nan')
+            similar_cars_list = cached["similar_cars"]
+        else:
+            if batched:
+                with trace.stage("inference"):
+                    try:
+                        prediction_result, served_version = await asyncio.wait_for(
+                            asyncio.wrap_future(api.micro_batcher.submit(prepared["row"])), api.MICROBATCH_TIMEOUT)
+                    except (QueueFull, asyncio.TimeoutError):
+                        return _error("Server busy, retry shortly", 503, {"Retry-After": "1"})
+            else:
+                prediction_result = prepared["prediction"]
+
+            similar_cars_list = []
+            similar_cars_ok = True
+            if not pd.isna(prediction_result):
+                try:
+                    with trace.stage("similar_cars"):
+                        similar_cars_list = await _find_similar_cars(data.get('body'), prediction_result, data if by_features else None)
+                except Exception as db_query_error:
+                    similar_cars_ok = False
+                    logger.error("Database query error finding similar cars: %s", db_query_error)
+
+            if prepared["cache_key"] is not None and similar_cars_ok and not pd.isna(prediction_result):
+                prepared["cache"].set(prepared["cache_key"], {"predicted_price": prediction_result, "similar_cars": similar_cars_list})
+
+        if not pd.isna(prediction_result): api._offer_shadow(prepared["validated"], [prediction_result], served_version)
+        with trace.stage("log"):
+            await _log_prediction(data, prediction_result, served_version)
+
+        return _JSONResponse({
+            "predicted_price": prediction_result if not pd.isna(prediction_result) else None,
+            "similar_cars": _present_cars(similar_cars_list, request, request.query_params.get('similar_sort', '').lower() == 'deal')
+        })
+
+    except Exception as e:
+        logger.exception("UNEXPECTED Prediction Error: %s", e)
+        return _error(f"An unexpected error occurred: {str(e)}", 500)
+
+
+async def _find_by_body_page(walk, page_size):
+    """ One keyset page from the database (see app._find_by_body_page). """
+    async with async_engine.connect() as conn:
+        fetched = [(await conn.execute(statement)).all() if statement is not None else []
+                   for statement in page_statements(api.CarInfo, api.FIND_BY_BODY_COLUMNS, walk, page_size)]
+    rows, cursor = next_page(walk, *fetched, page_size, api._keyset_position)
+    return [api._matching_car_dict(c) for c in rows], cursor
+
+
+async def _find_by_body_paginated(request, walk, page_size):
+    trace = telemetry.current_trace()
+    with trace.stage("search") as span:
+        if api._index_ready(api.similar_cars_index):
+            span["tier"] = "index_page"
+            matching_cars_list, cursor = api.similar_cars_index.find_page(walk, page_size)
+        else:
+            span["tier"] = "sql_page"
+            matching_cars_list, cursor = await _find_by_body_page(walk, page_size)
+    return _JSONResponse({"matching_cars": _present_cars(matching_cars_list, request), "next_cursor": cursor})
+
+
+async def find_by_body(request):
+    """ /find_by_body: same contract as the Flask route. """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data: return _error("No input data provided", 400)
+
+    try:
+        walk, page_size, input_error = api._parse_page_options(data)
+        if input_error: return _error(input_error, 400)
+        if walk is not None: return await _find_by_body_paginated(request, walk, page_size)
+
+        target_body, predicted_price, bounds, input_error = api._parse_find_by_body(data)
+        if input_error: return _error(input_error, 400)
+        deals, input_error = api._parse_deal_options(data)
+        if input_error: return _error(input_error, 400)
+
+        by_features = _similar_by_features(request)
+        trace = telemetry.current_trace()
+        with trace.stage("search") as span:
+            if by_features and deals is None:
+                matching_cars_list = await inference_executor.run(
+                    api._find_by_body_from_memory, data, target_body, predicted_price, bounds, True)
+            else:
+                matching_cars_list = api._find_by_body_from_memory(data, target_body, predicted_price, bounds, deals=deals)
+            if matching_cars_list is None: span["tier"] = "not_loaded"
+        if matching_cars_list is not None: return _JSONResponse({"matching_cars": _present_cars(matching_cars_list, request)})
+
+        try:
+            with trace.stage("search") as span:
+                span["tier"] = "sql"
+                if deals is not None:
+                    async with async_engine.connect() as conn:
+                        rows = (await conn.execute(api._find_by_body_statement(target_body, predicted_price, bounds, deals))).all()
+                    matching_cars_list = [api._matching_car_dict(c) for c in rows]
+                else:
+                    matching_cars_list, _ = await _find_by_body_page(Walk.start(target_body, predicted_price, *bounds), 10)
+        except Exception as db_query_error:
+            logger.error("Database query error in /find_by_body: %s", db_query_error)
+            matching_cars_list = []
+        return _JSONResponse({"matching_cars": _present_cars(matching_cars_list, request)})
+
+    except Exception as e:
+        logger.exception("UNEXPECTED Error in /find_by_body: %s", e)
+        return _error(f"An unexpected error occurred: {str(e)}", 500)
+
+
+async def get_cars(request):
+    """ /cars: the in-memory snapshot with ETag / 304, or live DISTINCT queries until it is loaded. """
+    if api._index_ready(api.car_options_cache):
+        snapshot = api.car_options_cache.current()
+        headers = {"ETag": f'"{snapshot.etag}"', "Cache-Control": f"public, max-age={api.CARS_CACHE_MAX_AGE}"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if snapshot.etag in [tag.strip().removeprefix("W/").strip('"') for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        return Response(snapshot.body, media_type="application/json", headers=headers)
+
+    options = {}
+    async with async_engine.connect() as conn:
+        for key, statement in option_statements(api.CarInfo):
+            try:
+                options[key] = (await conn.execute(statement)).scalars().all()
+            except Exception as col_error:
+                await conn.rollback()
+                logger.error("Error fetching %s: %s", key, col_error)
+                options[key] = []
+    return _JSONResponse(with_defaults(options))
+
+
+async def thumbnail_image(request):
+    """ /img/<hash>: WebP thumbnail from the content-addressed store, cached as immutable. """
+    thumb_hash = request.path_params["thumb_hash"]
+    if api.thumbnail_store is None or not api.thumbnail_store.valid_hash(thumb_hash): return _error("Not found", 404)
+    path = api.thumbnail_store.path_for(thumb_hash)
+    if not os.path.isfile(path): return _error("Not found", 404)
+    headers = {"ETag": f'"{thumb_hash}"', "Cache-Control": f"public, max-age={api.IMG_CACHE_MAX_AGE}, immutable"}
+    if thumb_hash in request.headers.get("if-none-match", ""): return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/webp", headers=headers)
+
+
+async def metrics(request):
+    """ Prometheus exposition (see telemetry.py). """
+    body, content_type = telemetry.render_metrics()
+    return Response(body, headers={"Content-Type": content_type})
+
+
+def _traced(endpoint, handler):
+    """ Wraps a route handler in a telemetry request trace labelled with the route template. """
+    @functools.wraps(handler)
+    async def traced(request):
+        trace = telemetry.start_trace(endpoint)
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+            return response
+        finally:
+            telemetry.finish_trace(trace, status)
+    return traced
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    global async_engine, inference_executor
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    api.configure_threads(api.TORCH_THREADS_PER_WORKER or max(1, api._available_cpus() // workers))
+    api.start_warmup()
+    api.model_watcher.start()
+
+    async_engine = create_async_engine(
+        api.ASYNC_DATABASE_URI or async_database_uri(api.DATABASE_URI),
+        pool_pre_ping=True, pool_recycle=300,
+        pool_size=api.ASYNC_DB_POOL_SIZE, max_overflow=api.ASYNC_DB_MAX_OVERFLOW,
+        poolclass=telemetry.pool_class("async"),
+    )
+    telemetry.instrument_engine(async_engine.sync_engine)
+    threads = api.INFERENCE_EXECUTOR_THREADS or max(2, api._available_cpus())
+    inference_executor = InferenceExecutor(threads, api.INFERENCE_MAX_PENDING)
+    logger.info("ASGI worker %d: async engine ready, %d inference thread(s)", os.getpid(), threads)
+    try:
+        yield
+    finally:
+        inference_executor.shutdown()
+        await async_engine.dispose()
+
+
+ROUTES = [
+    ('/healthz', healthz, ['GET']),
+    ('/readyz', readyz, ['GET']),
+    ('/metrics', metrics, ['GET']),
+    ('/predict', predict_price, ['POST']),
+    ('/find_by_body', find_by_body, ['POST']),
+    ('/cars', get_cars, ['GET']),
+    ('/img/{thumb_hash}', thumbnail_image, ['GET']),
+]
+app = Starlette(routes=[Route(path, _traced(path, handler), methods=methods) for path, handler, methods in ROUTES],
+                lifespan=lifespan)
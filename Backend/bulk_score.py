@@ -0,0 +1,254 @@
+# --- Offline bulk scoring: "car data" or a CSV / Parquet dump -> predicted prices ---
+# Scores millions of rows without the HTTP API. It uses the same preprocessing (app.INPUT_SCHEMA, as columns via
+# validate_frame) and the same model (app.load_model + app._predict_prices) as /predict.
+#   * input is streamed in --chunk-rows chunks: pandas' chunked CSV reader, Parquet record batches, or "car data"
+#     through a server-side cursor (stream_results, ordered by ID; on SQLite with --to-db, ID keyset pages instead,
+#     because SQLite cannot write while a read cursor is open);
+#   * chunks are scored by a process pool. The parent loads the model once (1 intra-op thread), and forked workers
+#     share it copy-on-write, as under gunicorn's preload. At most 2 chunks per worker are in flight, so memory
+#     stays flat whatever the input size;
+#   * results are written in input order: a Parquet file (key, predicted_price, error) or a "car data" column
+#     (UPDATE by ID, one executemany per chunk).
+# Column names are matched the way app.py derives its CLEANED_* lists ("Drive Type" -> drive_type). Rows with a
+# non-numeric numeric field get a null price and the validation message in `error`.
+#
+# Usage:
+#   python bulk_score.py --from-db --to-db predicted_price --create-column           # whole inventory, in place
+#   python bulk_score.py --input partner_dump.csv --id-column listing_id --output scored.parquet --workers 4
+#   python bulk_score.py --input cars.parquet --output scored.parquet --chunk-rows 100000
+import time
+import argparse
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, text, inspect
+
+import app as api
+
+DEFAULT_CHUNK_ROWS = 20000
+MODEL_BATCH_ROWS = 4096  # rows per forward pass inside a chunk (bounds activation memory)
+
+
+def clean_column_name(name):
+    """ Same rule as app.py's CLEANED_* lists. """
+    return name.replace(' ', '_').lower()
+
+
+# === SOURCES: iterators of (keys, DataFrame chunk) ================
+
+def iter_csv(path, chunk_rows, id_column=None):
+    offset = 0
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, low_memory=False):
+        keys = chunk[id_column].to_numpy() if id_column else np.arange(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield keys, chunk.rename(columns=clean_column_name)
+
+
+def iter_parquet(path, chunk_rows, id_column=None):
+    import pyarrow.parquet as pq
+    offset = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        chunk = batch.to_pandas()
+        keys = chunk[id_column].to_numpy() if id_column else np.arange(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield keys, chunk.rename(columns=clean_column_name)
+
+
+def _table_columns(car_model):
+    """ "car data" columns the schema needs (by their cleaned names), plus ID. """
+    by_clean_name = {clean_column_name(column.name): column for column in car_model.__table__.columns}
+    return [car_model.ID] + [by_clean_name[col] for col in api.INPUT_SCHEMA.columns if col in by_clean_name]
+
+
+def _frame(rows, columns):
+    chunk = pd.DataFrame.from_records(rows, columns=[column.name for column in columns])
+    return chunk["ID"].to_numpy(), chunk.rename(columns=clean_column_name)
+
+
+def iter_table(engine, car_model, chunk_rows, keyset=False):
+    """ "car data" ordered by ID: one server-side cursor, or keyset pages (WHERE ID > last LIMIT n). """
+    columns = _table_columns(car_model)
+    statement = select(*columns).order_by(car_model.ID)
+    if keyset:
+        last_id = None
+        while True:
+            page = statement if last_id is None else statement.where(car_model.ID > last_id)
+            with engine.connect() as conn: rows = conn.execute(page.limit(chunk_rows)).all()
+            if not rows: return
+            last_id = rows[-1][0]
+            yield _frame(rows, columns)
+    else:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(statement)
+            for rows in result.partitions():
+                yield _frame(rows, columns)
+
+
+# === SCORING (runs in the worker processes) =======================
+
+def _init_worker(threads):
+    api.configure_threads(threads)
+    # Forked workers inherit the parent's model; spawned ones (no fork on this platform) load their own
+    if api.model is None and not api.load_model(): raise RuntimeError(f"Model not loaded: {api.model_status['error']}")
+
+
+def score_chunk(chunk):
+    """ (prices float64 with NaN for rejected rows, error message or None per row) for one chunk. """
+    prices = np.full(len(chunk), np.nan)
+    errors = [None] * len(chunk)
+    for start in range(0, len(chunk), MODEL_BATCH_ROWS):
+        batch = api.INPUT_SCHEMA.validate_frame(chunk.iloc[start:start + MODEL_BATCH_ROWS])
+        if batch.valid_positions:
+            prices[start + np.asarray(batch.valid_positions)] = api._predict_prices(batch)
+        for i, error in enumerate(batch.errors):
+            if error is not None: errors[start + i] = error["error"]
+    return prices, errors
+
+
+# === SINKS ========================================================
+
+class ParquetSink:
+    """ key, predicted_price, error -> one row group per chunk. """
+
+    def __init__(self, path, key_name):
+        self.path = path
+        self.key_name = key_name
+        self._writer = None
+
+    def write(self, keys, prices, errors):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({self.key_name: keys, "predicted_price": pa.array(prices, from_pandas=True),
+                          "error": pa.array(errors, type=pa.string())})
+        if self._writer is None: self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None: self._writer.close()
+
+
+class TableColumnSink:
+    """ UPDATE "car data" SET <column> = price WHERE ID = key, one executemany + commit per chunk. """
+
+    def __init__(self, engine, car_model, column, create=False):
+        self.engine = engine
+        table = car_model.__table__
+        preparer = engine.dialect.identifier_preparer
+        existing = {c["name"] for c in inspect(engine).get_columns(table.name, schema=table.schema)}
+        if column not in existing:
+            if not create: raise ValueError(f"Column {column!r} does not exist in {table.name} (pass --create-column)")
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.quote(column)} DOUBLE PRECISION"))
+            print(f"--- Added column {column} ---")
+        self.statement = text(f"UPDATE {preparer.format_table(table)} SET {preparer.quote(column)} = :price "
+                              f"WHERE {preparer.quote(car_model.ID.name)} = :key")
+
+    def write(self, keys, prices, errors):
+        rows = [{"key": int(key), "price": None if np.isnan(price) else float(price)} for key, price in zip(keys, prices)]
+        with self.engine.begin() as conn: conn.execute(self.statement, rows)
+
+    def close(self):
+        pass
+
+
+# === DRIVER =======================================================
+
+class _InProcess:
+    """ ProcessPoolExecutor stand-in for --workers 0 (score in this process). """
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def run(source, sink, workers, threads_per_worker=1, total=None):
+    """ Scores every chunk of `source` into `sink`, in order, with at most 2 chunks per worker in flight. """
+    if workers > 0:
+        # Load once in the parent, then fork: workers share the weights copy-on-write (1 thread before the fork)
+        api.configure_threads(1)
+        if not api.load_model(): raise SystemExit(f"!!! Model not loaded: {api.model_status['error']} !!!")
+        context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+        pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(threads_per_worker,))
+    else:
+        _init_worker(threads_per_worker)
+        pool = _InProcess()
+
+    stats = {"rows": 0, "scored": 0, "errors": 0, "chunks": 0}
+    start = time.perf_counter()
+
+    def drain_one():
+        keys, future = pending.popleft()
+        prices, errors = future.result()
+        sink.write(keys, prices, errors)
+        rejected = sum(error is not None for error in errors)
+        stats.update(rows=stats["rows"] + len(keys), scored=stats["scored"] + len(keys) - rejected,
+                     errors=stats["errors"] + rejected, chunks=stats["chunks"] + 1)
+        elapsed = time.perf_counter() - start
+        progress = f"{stats['rows']:,}/{total:,}" if total else f"{stats['rows']:,}"
+        print(f"  [{progress}] {stats['errors']:,} rejected, {stats['rows'] / elapsed:,.0f} rows/s")
+
+    pending = collections.deque()
+    with pool:
+        for keys, chunk in source:
+            pending.append((keys, pool.submit(score_chunk, chunk)))
+            while len(pending) > max(workers, 1) * 2: drain_one()
+        while pending: drain_one()
+    sink.close()
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    stats["rows_per_second"] = round(stats["rows"] / stats["seconds"], 1) if stats["seconds"] else None
+    print(f"--- Scored {stats['rows']:,} rows in {stats['seconds']:.1f}s ({stats['rows_per_second']:,} rows/s), "
+          f"{stats['errors']:,} rejected ---")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score "car data" or a CSV/Parquet dump with the serving model')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="CSV or Parquet file (original or cleaned column names)")
+    source.add_argument("--from-db", action="store_true", help='read "car data" from DATABASE_URI')
+    parser.add_argument("--id-column", default=None, help="input column written as the key (default: row number)")
+    sink = parser.add_mutually_exclusive_group(required=True)
+    sink.add_argument("--output", help="Parquet file to write")
+    sink.add_argument("--to-db", metavar="COLUMN", help='write the prices into this "car data" column (with --from-db)')
+    parser.add_argument("--create-column", action="store_true", help="add the --to-db column if it does not exist")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=api._available_cpus(), help="scoring processes (0 = in-process)")
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.to_db and not args.from_db: parser.error("--to-db needs --from-db (rows are matched by ID)")
+
+    total = None
+    if args.from_db:
+        if not api.init_database(): raise SystemExit(1)
+        with api.engine.connect() as conn: total = conn.execute(select(func.count()).select_from(api.CarInfo)).scalar()
+        keyset = args.to_db is not None and api.engine.dialect.name == "sqlite"
+        rows = iter_table(api.engine, api.CarInfo, args.chunk_rows, keyset=keyset)
+        key_name = "ID"
+    elif args.input.endswith((".parquet", ".pq")):
+        import pyarrow.parquet as pq
+        total = pq.ParquetFile(args.input).metadata.num_rows
+        rows = iter_parquet(args.input, args.chunk_rows, args.id_column)
+        key_name = args.id_column or "row"
+    else:
+        rows = iter_csv(args.input, args.chunk_rows, args.id_column)
+        key_name = args.id_column or "row"
+
+    output = (TableColumnSink(api.engine, api.CarInfo, args.to_db, args.create_column) if args.to_db
+              else ParquetSink(args.output, key_name))
+    print(f"--- Scoring with {args.workers} worker process(es), {args.chunk_rows:,} rows per chunk ---")
+    run(rows, output, args.workers, args.threads_per_worker, total)
+
+
+if __name__ == "__main__":
+    main()
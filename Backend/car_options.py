@@ -0,0 +1,237 @@
+# --- Precomputed /cars Dropdown Options ---
+# The eight SELECT DISTINCT ... ORDER BY scans behind /cars run only when the `car_options` summary table is
+# (re)built: at first startup, when the summary is older than `refresh_seconds`, or on POST /admin/cars/refresh.
+# Every worker keeps the options in memory as a ready-to-send JSON body with an ETag, so /cars is a dict lookup
+# and browsers/CDNs revalidate with If-None-Match -> 304. Workers that start later read the (tiny) summary
+# table instead of scanning "car data" again. Rebuilds are serialized across workers with a PostgreSQL advisory
+# lock: a worker that waited for the lock re-reads the summary and keeps it if another worker just rebuilt it.
+#
+# Usage:
+#   python car_options.py --benchmark 2000000                    # synthetic table in SQLite, /cars before/after
+#   python car_options.py --benchmark 2000000 --database-uri postgresql://...
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import tempfile
+
+from sqlalchemy import select, distinct, delete, insert, text, inspect
+from sqlalchemy.exc import IntegrityError
+
+from similar_cars_index import RefreshingIndex
+
+logger = logging.getLogger("carify.car_options")
+
+REBUILD_LOCK_KEY = 0x6361725F6F7074  # pg_advisory_xact_lock key ("car_opt") serializing summary rebuilds
+
+# ("car data" column, /cars key), in response order
+OPTION_COLUMNS = (
+    ("body", "body_types"), ("transmission", "transmissions"), ("fuel", "fuel_types"), ("state", "states"),
+    ("utype", "utypes"), ("Drive Type", "drive_types"), ("owner_type", "owner_types"),
+    ("Steering Type", "steering_types"),
+)
+DEFAULT_OPTIONS = {
+    'drive_types': ['FWD', 'RWD', 'AWD'],
+    'owner_types': ['First', 'Second', 'Third', 'Fourth & Above'],
+    'steering_types': ['Power', 'Electric', 'Manual'],
+    'utypes': ['Used', 'New'],
+    'body_types': ['Sedan', 'SUV', 'Hatchback'],
+    'transmissions': ['Automatic', 'Manual'],
+    'fuel_types': ['Gasoline', 'Diesel', 'Electric'],
+    'states': ['DefaultState']
+}
+
+
+def option_statements(car_model):
+    """ (/cars key, SELECT DISTINCT statement) per dropdown column. """
+    table = car_model.__table__
+    return [(key, select(distinct(table.c[column_name])).where(table.c[column_name] != None).order_by(table.c[column_name]))
+            for column_name, key in OPTION_COLUMNS]
+
+
+def query_options(db, car_model):
+    """ DISTINCT non-null values per dropdown column straight from "car data" (one scan per column). """
+    options = {}
+    for key, statement in option_statements(car_model):
+        try:
+            options[key] = db.execute(statement).scalars().all()
+        except Exception as col_error:
+            db.rollback()
+            logger.error("Error fetching %s: %s", key, col_error)
+            options[key] = []
+    return options
+
+
+def with_defaults(options):
+    """ Fills empty lists with the frontend defaults. """
+    return {key: options.get(key) or DEFAULT_OPTIONS[key] for _, key in OPTION_COLUMNS}
+
+
+class _OptionsSnapshot:
+    """ Serialized /cars body + its ETag. """
+
+    def __init__(self, options, refreshed_at):
+        self.options = with_defaults(options)
+        self.body = json.dumps(self.options, sort_keys=True, separators=(',', ':')).encode()
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+        self.row_count = sum(len(values) for values in self.options.values())
+        self.refreshed_at = refreshed_at
+        self.loaded_at = time.time()
+
+
+class CarOptionsCache(RefreshingIndex):
+    """ /cars options from the car_options summary table, rebuilt from "car data" when older than refresh_seconds. """
+
+    name = "dropdown options"
+    unit = "values"
+
+    def __init__(self, session_factory, car_model, summary_model, refresh_seconds=3600.0):
+        super().__init__(session_factory, car_model, refresh_seconds)
+        self.summary_model = summary_model
+        self.rebuilds = 0
+
+    def _read_summary(self, db):
+        table = self.summary_model.__table__
+        try:
+            rows = db.execute(select(table.c.field, table.c.value, table.c.refreshed_at)
+                              .order_by(table.c.field, table.c.position)).all()
+        except Exception:
+            db.rollback()  # summary table does not exist yet
+            return None, None
+        if not rows: return None, None
+        options = {}
+        for field, value, _ in rows: options.setdefault(field, []).append(value)
+        return options, min(row.refreshed_at for row in rows)
+
+    def _lock(self, db, table):
+        """ Holds the cross-process rebuild lock until the transaction ends: an advisory lock on PostgreSQL, the
+        database write lock on SQLite (an empty DELETE). A collision on any other database is handled in _rebuild. """
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": REBUILD_LOCK_KEY})
+        elif dialect == "sqlite":
+            db.execute(delete(table).where(text("0 = 1")))
+
+    def _rebuild(self, db, max_age=None):
+        """ Recomputes the options from "car data" and replaces the summary rows in one transaction. With max_age,
+        a summary that another worker rebuilt while this one waited for the lock is kept instead. """
+        start = time.perf_counter()
+        table = self.summary_model.__table__
+        try:
+            table.create(db.get_bind(), checkfirst=True)
+        except Exception:
+            if not inspect(db.get_bind()).has_table(table.name): raise  # else another worker just created it
+        self._lock(db, table)
+        if max_age is not None:
+            options, refreshed_at = self._read_summary(db)
+            if options is not None and time.time() - refreshed_at < max_age:
+                db.commit()
+                logger.info("Dropdown options summary was rebuilt by another worker, using it")
+                return options, refreshed_at
+
+        options = query_options(db, self.car_model)
+        refreshed_at = time.time()
+        rows = [{"field": key, "position": i, "value": str(value), "refreshed_at": refreshed_at}
+                for key, values in options.items() for i, value in enumerate(values)]
+        try:
+            db.execute(delete(table))
+            if rows: db.execute(insert(table), rows)
+            db.commit()
+        except IntegrityError:
+            # Another worker replaced the rows concurrently (no advisory lock on this database): serve its summary
+            db.rollback()
+            summary, summary_at = self._read_summary(db)
+            if summary is None: raise
+            logger.info("Dropdown options summary was rebuilt concurrently by another worker, using it")
+            return summary, summary_at
+        self.rebuilds += 1
+        logger.info("Dropdown options summary rebuilt (%d values) in %.2fs", len(rows), time.perf_counter() - start)
+        return options, refreshed_at
+
+    def _build(self, db):
+        options, refreshed_at = self._read_summary(db)
+        if options is None or time.time() - refreshed_at >= self.refresh_seconds:
+            try:
+                options, refreshed_at = self._rebuild(db, self.refresh_seconds)
+            except Exception as e:
+                db.rollback()
+                if options is None: raise
+                logger.warning("Dropdown options rebuild failed, serving the previous summary: %s", e)
+        return _OptionsSnapshot(options, refreshed_at)
+
+    def rebuild(self):
+        """ Admin refresh: rebuild the summary table now and swap in the result. """
+        db = self.session_factory()
+        try:
+            self._rebuild(db)
+        finally:
+            db.close()
+        self.load()
+
+    def current(self):
+        self.maybe_refresh()
+        return self._snapshot
+
+    def _snapshot_stats(self, snapshot):
+        return {"etag": snapshot.etag, "refreshed_at": snapshot.refreshed_at, "rebuilds": self.rebuilds}
+
+
+# === BENCHMARK ====================================================
+
+def _time_requests(client, n, headers=None):
+    timings = []
+    for _ in range(n):
+        start = time.perf_counter()
+        response = client.get('/cars', headers=headers or {})
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return response, timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.95)] * 1000
+
+
+def benchmark(n_rows, database_uri, requests_before=5, requests_after=500):
+    # The app reads its configuration at import: point it at the benchmark database, skip the other snapshots
+    os.environ["DATABASE_URI"] = database_uri
+    os.environ.setdefault("SIMILAR_CARS_INDEX", "0")
+    os.environ.setdefault("CAR_RECOMMENDER", "0")
+    os.environ.setdefault("CAR_OPTIONS_CACHE", "0")  # loaded explicitly below, after seeding
+    import app as api
+    from synthetic_data import seed_table
+
+    if not api.init_database(): raise SystemExit(1)
+
+    seed_table(api.engine, api.CarInfo.__table__, n_rows)
+    client = api.app.test_client()
+
+    api.car_options_cache = None
+    response, p50, p95 = _time_requests(client, requests_before)
+    print(f"  {'live DISTINCT queries':<28}p50 {p50:9.2f} ms | p95 {p95:9.2f} ms | {len(response.data)} bytes")
+
+    cache = CarOptionsCache(api.SessionLocal, api.CarInfo, api.CarOption)
+    start = time.perf_counter()
+    cache.rebuild()
+    print(f"  {'summary rebuild':<28}{(time.perf_counter() - start) * 1000:9.1f} ms")
+    start = time.perf_counter()
+    cache.load()
+    print(f"  {'load from summary table':<28}{(time.perf_counter() - start) * 1000:9.1f} ms")
+
+    api.car_options_cache = cache
+    cached, p50, p95 = _time_requests(client, requests_after)
+    print(f"  {'in-memory + ETag':<28}p50 {p50:9.3f} ms | p95 {p95:9.3f} ms | {len(cached.data)} bytes")
+    not_modified, p50, p95 = _time_requests(client, requests_after, {"If-None-Match": cached.headers["ETag"]})
+    print(f"  {'If-None-Match revalidation':<28}p50 {p50:9.3f} ms | p95 {p95:9.3f} ms | status {not_modified.status_code}")
+    print(f"--- Same options as the live queries: {json.loads(cached.data) == json.loads(response.data)} ---")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /cars with live DISTINCT queries vs precomputed options")
+    parser.add_argument("--benchmark", type=int, default=2000000, metavar="ROWS", help="synthetic listings to seed")
+    parser.add_argument("--database-uri", default=f"sqlite:///{os.path.join(tempfile.gettempdir(), 'car_data_benchmark.db')}")
+    parser.add_argument("--requests", type=int, default=5, help="timed /cars calls on the live-query path")
+    args = parser.parse_args()
+    benchmark(args.benchmark, args.database_uri, args.requests)
+
+
+if __name__ == "__main__":
+    main()
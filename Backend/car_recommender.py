@@ -0,0 +1,297 @@
+# --- Feature-Space Car Recommender ---
+# "Similar cars" by what the car is, not only by body and price: every listing of "car data" becomes a row of a
+# normalized float32 feature matrix (z-scored year, log km, dimensions, kerb weight, engine/gearbox figures and
+# log price, plus one-hot fuel / transmission / drive type / common engine types). Rows are sorted by
+# (body, price), so a body is a contiguous slice and a price window inside it is a searchsorted range; top-k
+# queries are one matrix-vector product over that slice (squared norms precomputed) + argpartition.
+# Fields a query leaves blank are left out of the distance instead of being imputed.
+# Used by /predict and /find_by_body with ?similar_by=features; refreshed like SimilarCarsIndex.
+#
+# Exact brute force is used on purpose: with ~30 dimensions a ball tree has to visit most leaves anyway and
+# cannot honour per-query price windows or dropped dimensions. --benchmark measures both.
+#
+# Usage:
+#   python car_recommender.py --benchmark 10000 100000 1000000
+import re
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from similar_cars_index import RefreshingIndex, INDEX_COLUMNS, similar_car_dict, matching_car_dict
+from migrations import DIMENSION_COLUMNS, parse_measure
+
+# (column in "car data", weight). Request keys are the cleaned names (lowercase, spaces -> underscores).
+NUMERIC_FEATURES = (
+    ("myear", 1.5), ("km", 1.0), ("No of Cylinder", 0.5), ("Length", 0.5), ("Width", 0.5), ("Height", 0.5),
+    ("Wheel Base", 0.5), ("Kerb Weight", 0.75), ("Gear Box", 0.25), ("Seats", 0.5), ("Max Torque At", 0.25),
+)
+LOG_SCALED = ("km",)
+PRICE_WEIGHT = 2.0
+CATEGORICAL_FEATURES = (("fuel", 1.0), ("transmission", 1.0), ("Drive Type", 0.5), ("Engine Type", 0.5))
+MAX_CATEGORIES = 32  # most frequent values one-hot encoded per column; rarer ones only match nothing
+CHUNK_ROWS = 262144  # bounds temporaries of the partial-query path
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def request_key(column):
+    return column.replace(' ', '_').lower()
+
+
+def _to_number(value):
+    """ float(value) for numbers and strings like "3995 mm"; None when missing or unparseable. """
+    if value is None: return None
+    if isinstance(value, (int, float, np.number)):
+        return None if np.isnan(value) else float(value)
+    match = _NUMBER.search(str(value).replace(',', ''))
+    return float(match.group()) if match else None
+
+
+def _numeric_column(series):
+    """ Float array of a numeric or Text column; the regex fallback only runs on values to_numeric rejects. """
+    values = pd.to_numeric(series, errors='coerce').astype(float)
+    if series.dtype == object:
+        retry = values.isna() & series.notna()
+        if retry.any():
+            values[retry] = pd.to_numeric(series[retry].astype(str).str.replace(',', '')
+                                          .str.extract(r"(-?\d+(?:\.\d+)?)", expand=False), errors='coerce')
+    return values.to_numpy()
+
+
+def _category_codes(series):
+    """ (codes, normalized distinct values) of a categorical column; code -1 for missing. """
+    codes, uniques = pd.factorize(series)
+    return codes, [_category(v) for v in uniques]
+
+
+def _category(value):
+    return str(value).strip().lower()
+
+
+class FeatureSpace:
+    """ Column layout, normalization constants and category vocabularies, fitted on one inventory. """
+
+    def __init__(self, frame, numeric=None):
+        numeric = numeric or {}
+        self.stats = {}     # numeric column -> (mean, std, sqrt weight, offset)
+        self.vocab = {}     # categorical column -> ({value: offset}, sqrt weight)
+        width = 0
+        for column, weight in NUMERIC_FEATURES + (("listed_price", PRICE_WEIGHT),):
+            values = self._transform(column, numeric[column] if column in numeric else _numeric_column(frame[column]))
+            mean, std = np.nanmean(values) if np.isfinite(values).any() else 0.0, np.nanstd(values)
+            self.stats[column] = (float(mean), float(std) if std > 0 else 1.0, float(np.sqrt(weight)), width)
+            width += 1
+        for column, weight in CATEGORICAL_FEATURES:
+            codes, uniques = _category_codes(frame[column])
+            counts = pd.Series(np.bincount(codes[codes >= 0], minlength=len(uniques))).groupby(uniques).sum()
+            values = list(counts.sort_values(ascending=False, kind='stable').index[:MAX_CATEGORIES])
+            # A mismatch flips two one-hot entries, so each carries weight/2 to cost `weight` in total
+            self.vocab[column] = ({v: width + i for i, v in enumerate(values)}, float(np.sqrt(weight / 2)))
+            width += len(values)
+        self.width = width
+
+    @staticmethod
+    def _transform(column, values):
+        if column in LOG_SCALED: return np.log1p(np.clip(values, 0, None))
+        if column == "listed_price": return np.log(np.where(values > 0, values, np.nan))
+        return values
+
+    def encode_frame(self, frame, numeric=None):
+        """ float32 matrix [len(frame), width]; missing numerics sit at the mean (0). numeric: pre-parsed columns. """
+        numeric = numeric or {}
+        matrix = np.zeros((len(frame), self.width), dtype=np.float32)
+        for column, (mean, std, scale, offset) in self.stats.items():
+            values = self._transform(column, numeric[column] if column in numeric else _numeric_column(frame[column]))
+            matrix[:, offset] = np.nan_to_num((values - mean) / std * scale, nan=0.0)
+        for column, (lookup, scale) in self.vocab.items():
+            codes, uniques = _category_codes(frame[column])
+            offsets = np.array([lookup.get(v, -1) for v in uniques] + [-1], dtype=np.int64)[codes]  # -1 -> missing
+            hit = offsets >= 0
+            matrix[np.nonzero(hit)[0], offsets[hit].astype(np.int64)] = scale
+        return matrix
+
+    def encode_query(self, features, predicted_price=None):
+        """ (vector, dims) for one request dict keyed by request names; dims is None when every field was given. """
+        vector = np.zeros(self.width, dtype=np.float32)
+        dims = []
+        for column, (mean, std, scale, offset) in self.stats.items():
+            value = predicted_price if column == "listed_price" else _to_number(features.get(request_key(column)))
+            if value is None: continue
+            value = self._transform(column, np.array([value], dtype=float))[0]
+            if not np.isfinite(value): continue
+            vector[offset] = (value - mean) / std * scale
+            dims.append(offset)
+        for column, (lookup, scale) in self.vocab.items():
+            value = features.get(request_key(column))
+            if value is None or str(value).strip() == "": continue
+            offset = lookup.get(_category(value))
+            if offset is not None: vector[offset] = scale
+            dims.extend(lookup.values())
+        return vector, (None if len(dims) == self.width else np.array(sorted(dims)))
+
+
+class _FeatureSnapshot:
+    """ Feature matrix + display rows, sorted by (body, listed_price), with body -> slice bounds. """
+
+    def __init__(self, frame):
+        frame = frame.reset_index(drop=True)
+        prices = _numeric_column(frame["listed_price"])
+        bodies = frame["body"].fillna("").astype(str).to_numpy()
+        order = np.lexsort((prices, bodies))  # NaN prices sort last within their body
+        frame = frame.iloc[order].reset_index(drop=True)
+        self.prices = prices[order]
+        bodies = bodies[order]
+
+        numeric = {column: _numeric_column(frame[column]) for column, _ in NUMERIC_FEATURES}
+        for name, (typed, units) in DIMENSION_COLUMNS.items():
+            # Typed copy (migrations.py) where backfilled; rows imported since the last --backfill parse their Text
+            if typed in frame:
+                frame[typed] = frame[typed].astype(float).fillna(parse_measure(frame[name], units))
+                numeric[name] = frame[typed].to_numpy()
+        numeric["listed_price"] = self.prices
+        self.space = FeatureSpace(frame, numeric)
+        self.matrix = self.space.encode_frame(frame, numeric)
+        self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+
+        starts = np.flatnonzero(np.r_[True, bodies[1:] != bodies[:-1]]) if len(bodies) else np.array([], dtype=int)
+        ends = np.r_[starts[1:], len(bodies)]
+        self.blocks = {bodies[s]: (int(s), int(e)) for s, e in zip(starts, ends)}
+
+        display = frame[list(INDEX_COLUMNS)].astype(object)
+        self.rows = list(display.where(display.notna(), None).itertuples(index=False, name=None))
+        self.row_count = len(frame)
+        self.loaded_at = time.time()
+
+    def memory_bytes(self):
+        return int(self.matrix.nbytes + self.sq_norms.nbytes + self.prices.nbytes)
+
+    def window(self, body, lower=None, upper=None):
+        """ [start, end) of the candidates: a body's block, narrowed to a price window when given. """
+        if body is None: return 0, self.row_count
+        start, end = self.blocks.get(body, (0, 0))
+        if lower is not None: start += int(np.searchsorted(self.prices[start:end], lower, side='left'))
+        if upper is not None: end = start + int(np.searchsorted(self.prices[start:end], upper, side='right'))
+        return start, end
+
+    def nearest(self, vector, dims, start, end, k):
+        """ Row positions of the k nearest rows within [start, end), nearest first. """
+        if end <= start or k <= 0: return np.array([], dtype=np.int64)
+        if dims is None:
+            # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2 (the constant term does not change the order)
+            distances = self.sq_norms[start:end] - 2.0 * (self.matrix[start:end] @ vector)
+        else:
+            distances = np.empty(end - start, dtype=np.float32)
+            query = vector[dims]
+            for chunk in range(start, end, CHUNK_ROWS):
+                stop = min(chunk + CHUNK_ROWS, end)
+                diff = self.matrix[chunk:stop, dims] - query
+                distances[chunk - start:stop - start] = np.einsum('ij,ij->i', diff, diff)
+        k = min(k, end - start)
+        top = np.argpartition(distances, k - 1)[:k] if k < end - start else np.arange(end - start)
+        return start + top[np.argsort(distances[top], kind='stable')]
+
+
+class FeatureSpaceRecommender(RefreshingIndex):
+    """ Top-k nearest listings in feature space, served from a periodically refreshed snapshot. """
+
+    name = "feature-space recommender"
+
+    def _build(self, db):
+        table = self.car_model.__table__
+        columns = list(dict.fromkeys(INDEX_COLUMNS + tuple(c for c, _ in NUMERIC_FEATURES + CATEGORICAL_FEATURES)))
+        # Dimensions: the typed copies (migrations.py), with their Text for rows not backfilled yet
+        columns += [typed for typed, _ in DIMENSION_COLUMNS.values() if typed not in columns]
+        result = db.execute(select(*[table.c[name] for name in columns]).execution_options(yield_per=10000))
+        return _FeatureSnapshot(pd.DataFrame.from_records(list(result), columns=columns))
+
+    def _snapshot_stats(self, snapshot):
+        return {"body_types": len(snapshot.blocks), "dimensions": snapshot.space.width,
+                "memory_bytes": snapshot.memory_bytes()}
+
+    def similar_cars(self, features, predicted_price, target_body=None, limit=10):
+        """ /predict similar_cars: nearest cars of the same body (whole inventory if the body is unknown). """
+        self.maybe_refresh()
+        snapshot = self._snapshot
+        vector, dims = snapshot.space.encode_query(features, predicted_price)
+        start, end = snapshot.window(target_body if target_body in snapshot.blocks else None)
+        return [similar_car_dict(snapshot.rows[i]) for i in snapshot.nearest(vector, dims, start, end, limit)]
+
+    def find_near_price(self, features, target_body, predicted_price, lower_bound, upper_bound, limit=10):
+        """ /find_by_body: cars of one body inside [lower, upper], most similar first. """
+        self.maybe_refresh()
+        snapshot = self._snapshot
+        vector, dims = snapshot.space.encode_query(features, predicted_price)
+        start, end = snapshot.window(target_body, lower_bound, upper_bound)
+        return [matching_car_dict(snapshot.rows[i]) for i in snapshot.nearest(vector, dims, start, end, limit)]
+
+
+# === BENCHMARK ====================================================
+
+def _percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return f"p50 {np.percentile(samples, 50):8.3f} ms | p95 {np.percentile(samples, 95):8.3f} ms"
+
+
+def benchmark(sizes, queries=200, k=10, seed=0):
+    from synthetic_data import synthetic_cars
+    try:
+        from sklearn.neighbors import BallTree
+    except ImportError as e:
+        BallTree = None
+        print(f"--- scikit-learn not available, skipping the ball-tree comparison: {e} ---")
+
+    for n_rows in sizes:
+        frame = synthetic_cars(n_rows, seed=seed)
+        start = time.perf_counter()
+        snapshot = _FeatureSnapshot(frame)
+        build_s = time.perf_counter() - start
+        print(f"--- {n_rows:,} listings: built in {build_s:.2f}s, {snapshot.space.width} dims, "
+              f"matrix {snapshot.memory_bytes() / 2**20:.1f} MB ---")
+
+        rng = np.random.default_rng(seed + 1)
+        probes = frame.iloc[rng.integers(0, n_rows, size=queries)]
+        requests = [{request_key(c): v for c, v in row.items()} for row in probes.to_dict('records')]
+        encoded = [snapshot.space.encode_query(r, r["listed_price"]) for r in requests]
+
+        def run(label, fn):
+            timings = []
+            for i, request in enumerate(requests):
+                t = time.perf_counter(); fn(i, request); timings.append(time.perf_counter() - t)
+            print(f"  {label:<40}{_percentiles(timings)}")
+
+        run("encode query", lambda i, r: snapshot.space.encode_query(r, r["listed_price"]))
+        run("top-k, whole inventory", lambda i, r: snapshot.nearest(encoded[i][0], None, 0, n_rows, k))
+        run("top-k, same body (/predict)",
+            lambda i, r: snapshot.nearest(encoded[i][0], None, *snapshot.window(r["body"]), k))
+        partial = {"myear", "km", "fuel", "transmission"}
+        run("top-k, body + price window + 4 fields", lambda i, r: snapshot.nearest(
+            *snapshot.space.encode_query({f: r[f] for f in partial}, r["listed_price"]),
+            *snapshot.window(r["body"], r["listed_price"] - 500000, r["listed_price"] + 500000), k))
+
+        if BallTree is not None:
+            start = time.perf_counter()
+            tree = BallTree(snapshot.matrix, leaf_size=40)
+            print(f"  {'ball tree build':<40}{(time.perf_counter() - start) * 1000:8.1f} ms")
+            run("ball tree top-k, whole inventory", lambda i, r: tree.query(encoded[i][0][None, :], k=k))
+            # Same neighbours as the brute-force path (distances can tie, so compare the distance lists)
+            i = 0
+            brute = snapshot.nearest(encoded[i][0], None, 0, n_rows, k)
+            brute_d = np.sort(np.linalg.norm(snapshot.matrix[brute] - encoded[i][0], axis=1))
+            tree_d = tree.query(encoded[i][0][None, :], k=k)[0][0]
+            print(f"  {'ball tree vs brute max |d diff|':<40}{np.max(np.abs(brute_d - tree_d)):.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the feature-space recommender on synthetic inventories")
+    parser.add_argument("--benchmark", type=int, nargs="+", default=[10000, 100000, 1000000], metavar="ROWS")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+    benchmark(args.benchmark, args.queries, args.k)
+
+
+if __name__ == "__main__":
+    main()
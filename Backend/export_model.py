@@ -0,0 +1,197 @@
+# --- Export saved_car_model_log_v1 to a self-contained serving artifact ---
+# Writes <model>_export/ with:
+#   model.pt         TorchScript graph: (continuous float32 [N, 11], categorical int64 [N, 9]) -> log-price [N]
+#   model.onnx       same graph as ONNX (only with --onnx)
+#   preprocess.json  category lookup tables, normalization constants, column order, target name
+# app.py serves it with MODEL_SERVING_MODE=exported, without importing pytorch_tabular / Lightning.
+#
+# Usage:
+#   python export_model.py                       # export + parity check
+#   python export_model.py --onnx                # also write model.onnx
+#   python export_model.py --compare             # cold-start time + RSS: checkpoint path vs exported path
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import datetime
+import subprocess
+import numpy as np
+import pandas as pd
+import torch
+
+from inference_engine import (
+    FeatureEncoder, ExportedInferenceEngine, load_tabular_model, sample_frame,
+    PREPROCESS_SPEC_FILE, TORCHSCRIPT_FILE, ONNX_FILE, QUANTIZED_TORCHSCRIPT_FILE, QUANTIZATION_REPORT_FILE,
+)
+
+DEFAULT_MODEL_PATH = os.getenv("MODEL_PATH", "saved_car_model_log_v1")
+
+
+class _TraceableAppendCLSToken(torch.nn.Module):
+    """ AppendCLSToken uses len(x), which tracing freezes to the example batch size; x.size(0) stays dynamic. """
+
+    def __init__(self, add_cls):
+        super().__init__()
+        self.weight = add_cls.weight
+
+    def forward(self, x):
+        return torch.cat([x, self.weight.view(1, 1, -1).expand(x.size(0), 1, -1)], dim=1)
+
+
+class _ExportWrapper(torch.nn.Module):
+    """ Embedding -> backbone -> head of the FT-Transformer as a plain nn.Module: two tensors in, log-price out.
+    The LightningModule itself is not traceable (its trainer property raises outside a Trainer). """
+
+    def __init__(self, network):
+        super().__init__()
+        if network.hparams.target_range is not None:
+            raise ValueError("Export does not support models trained with target_range")
+        self.embedding_layer = copy.deepcopy(network.embedding_layer)
+        self.backbone = copy.deepcopy(network.backbone)
+        self.head = copy.deepcopy(network.head)
+        if hasattr(self.backbone, "add_cls"):
+            self.backbone.add_cls = _TraceableAppendCLSToken(self.backbone.add_cls)
+
+    def forward(self, continuous, categorical):
+        x = self.embedding_layer({"continuous": continuous, "categorical": categorical})
+        return self.head(self.backbone(x))[:, 0]
+
+
+def export(model_path, export_path, with_onnx=False, check_rows=256):
+    print(f"--- Loading model from {model_path}... ---")
+    tabular_model = load_tabular_model(model_path)
+    tabular_model.datamodule.batch_size = check_rows
+    network = tabular_model.model.eval()
+    encoder = FeatureEncoder.from_datamodule(tabular_model.datamodule)
+    target_col = tabular_model.datamodule.config.target[0]
+
+    os.makedirs(export_path, exist_ok=True)
+    # An int8 graph and its gate report belong to the model they were quantized from: re-run quantize_model.py
+    for stale in (QUANTIZED_TORCHSCRIPT_FILE, QUANTIZATION_REPORT_FILE):
+        if os.path.exists(os.path.join(export_path, stale)):
+            os.remove(os.path.join(export_path, stale))
+            print(f"--- Removed stale {stale} ---")
+
+    # Trace on a realistic batch; the graph has no data-dependent control flow, so the batch dimension stays dynamic
+    example_frame = sample_frame(encoder, check_rows)
+    continuous, categorical = encoder.encode_frame(example_frame)
+    example = (torch.from_numpy(continuous), torch.from_numpy(categorical))
+    wrapper = _ExportWrapper(network).eval()
+
+    print("--- Tracing TorchScript graph... ---")
+    with torch.no_grad():
+        traced = torch.jit.trace(wrapper, example, check_trace=False)
+        traced = torch.jit.freeze(traced)
+    traced.save(os.path.join(export_path, TORCHSCRIPT_FILE))
+
+    if with_onnx:
+        print("--- Exporting ONNX graph... ---")
+        torch.onnx.export(
+            wrapper, example, os.path.join(export_path, ONNX_FILE),
+            input_names=["continuous", "categorical"], output_names=["log_price"],
+            dynamic_axes={"continuous": {0: "batch"}, "categorical": {0: "batch"}, "log_price": {0: "batch"}},
+            opset_version=17, dynamo=False,
+        )
+
+    spec = encoder.to_spec()
+    spec.update({
+        "target_col": target_col,
+        "model_name": os.path.basename(os.path.normpath(model_path)),
+        "exported_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "torch_version": torch.__version__,
+    })
+    with open(os.path.join(export_path, PREPROCESS_SPEC_FILE), "w") as f:
+        json.dump(spec, f, indent=1)
+    print(f"--- Exported to {export_path} ---")
+
+    # Parity against TabularModel.predict on the example batch and on a single row (dynamic batch dimension)
+    check_frame = pd.concat([example_frame, sample_frame(encoder, 1, seed=7)], ignore_index=True)
+    expected = tabular_model.predict(check_frame)[f"{target_col}_prediction"].to_numpy()
+    runtimes = ["torchscript"] + (["onnx"] if with_onnx else [])
+    worst = 0.0
+    for runtime in runtimes:
+        try:
+            exported = ExportedInferenceEngine(export_path, runtime=runtime)
+        except ImportError as e:
+            print(f"--- Skipping {runtime} parity check: {e} ---")
+            continue
+        actual = np.concatenate([
+            exported.predict(check_frame.iloc[:-1])[exported.prediction_col].to_numpy(),
+            exported.predict(check_frame.iloc[-1:])[exported.prediction_col].to_numpy(),
+        ])
+        max_diff = float(np.max(np.abs(expected - actual)))
+        worst = max(worst, max_diff)
+        print(f"--- Parity ({runtime}) over {check_rows} + 1 rows: max |diff| = {max_diff:.2e} ---")
+    return worst
+
+
+# === COLD-START / MEMORY COMPARISON ==============================
+
+# Runs in a fresh interpreter (python -c) so only the serving path under test is imported:
+# load it, score one row, report timings + peak RSS as JSON.
+_PROBE_SCRIPT = """
+import sys, json, time, resource
+start = time.perf_counter()
+from inference_engine import FastInferenceEngine, ExportedInferenceEngine, load_tabular_model, sample_frame
+mode, model_path, export_path = sys.argv[1:4]
+if mode == "checkpoint":
+    engine = FastInferenceEngine(load_tabular_model(model_path))
+else:
+    engine = ExportedInferenceEngine(export_path, runtime=mode)
+loaded = time.perf_counter()
+engine.predict(sample_frame(engine.encoder, 1))
+first_prediction = time.perf_counter()
+print(json.dumps({
+    "load_s": round(loaded - start, 3),
+    "first_prediction_s": round(first_prediction - start, 3),
+    "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    "torch_imported": "torch" in sys.modules,
+    "lightning_imported": "pytorch_lightning" in sys.modules,
+}))
+"""
+
+
+def compare(model_path, export_path, modes):
+    print(f"--- Cold start: one fresh interpreter per serving path ---")
+    for mode in modes:
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", _PROBE_SCRIPT, mode, model_path, export_path],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        wall = time.perf_counter() - start
+        lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+        if out.returncode != 0 or not lines:
+            print(f"!!! {mode} probe failed: {out.stderr.strip().splitlines()[-1:]} !!!")
+            continue
+        result = json.loads(lines[-1])
+        print(f"  {mode:<12} process wall {wall:6.2f}s | imports + load {result['load_s']:6.2f}s | "
+              f"first prediction {result['first_prediction_s']:6.2f}s | peak RSS {result['peak_rss_mb']:7.1f} MB | "
+              f"torch: {result['torch_imported']} | lightning: {result['lightning_imported']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the tabular model to TorchScript/ONNX + preprocess.json")
+    parser.add_argument("--model-path", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--export-path", default=None, help="defaults to <model-path>_export")
+    parser.add_argument("--onnx", action="store_true", help="also export model.onnx (needs onnx + onnxruntime to verify)")
+    parser.add_argument("--atol", type=float, default=1e-4, help="max allowed abs difference in log-price")
+    parser.add_argument("--compare", action="store_true", help="only measure cold start + RSS of each serving path")
+    args = parser.parse_args()
+    export_path = args.export_path or f"{os.path.normpath(args.model_path)}_export"
+
+    if args.compare:
+        modes = ["checkpoint", "torchscript"] + (["onnx"] if os.path.exists(os.path.join(export_path, ONNX_FILE)) else [])
+        compare(args.model_path, export_path, modes)
+        return
+
+    max_diff = export(args.model_path, export_path, with_onnx=args.onnx)
+    if max_diff > args.atol:
+        print(f"!!! Exported graph differs from TabularModel.predict by {max_diff:.2e} (atol {args.atol:.0e}) !!!")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# --- Gunicorn configuration: production serving with pre-fork model sharing ---
+# With PRELOAD_MODEL=1 (default) the master imports app.py and runs create_app(preload=True): the model is
+# loaded and warmed and the "car data" snapshots are built ONCE, then the workers are forked and share those
+# pages copy-on-write instead of each holding a copy of the model, torch runtime and snapshots.
+# Every worker then gets cores // workers intra-op threads (TORCH_THREADS_PER_WORKER overrides), so the torch
+# pools of different workers do not fight over the same cores.
+#
+# Usage:
+#   gunicorn -c gunicorn.conf.py                      # WEB_CONCURRENCY workers (default: one per core)
+#   PRELOAD_MODEL=0 gunicorn -c gunicorn.conf.py      # every worker loads its own copy in the background
+#   GUNICORN_THREADS=16 MICRO_BATCHING=1 gunicorn -c gunicorn.conf.py   # threaded workers, coalesced /predict
+#   PROMETHEUS_MULTIPROC_DIR=/tmp/carify-metrics gunicorn -c gunicorn.conf.py   # /metrics summed over all workers
+import os
+import glob
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+preload_app = os.getenv("PRELOAD_MODEL", "1") == "1"
+wsgi_app = "app:create_app(preload=True)" if preload_app else "app:create_app()"
+threads = int(os.getenv("GUNICORN_THREADS", "1"))  # > 1 switches to the gthread worker (needed for micro-batching)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))  # a non-preloaded worker spends seconds loading the model
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork(workers)
+
+
+def on_starting(server):
+    # Multiprocess metrics files of a previous run would be summed into this one
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, "*.db")): os.remove(path)
+
+
+def child_exit(server, worker):
+    import telemetry
+    telemetry.mark_worker_dead(worker.pid)
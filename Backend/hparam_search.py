@@ -0,0 +1,350 @@
+# --- FT-Transformer Hyperparameter Search (accuracy vs serving cost) ---
+# The notebook's architecture (input_embed_dim 32, 4 heads, 2 attention blocks, learning rate 1e-4) was picked by
+# hand. This trains a sample of the configurations in SEARCH_SPACE with train_model.py's DataConfig/FTTransformerConfig
+# setup, on the cached dataset and one shared 80/20 split, and finds the smallest and fastest model within the
+# accuracy target:
+#   trials     a process pool of --workers trials at a time, each pinned to --threads-per-trial torch threads (no
+#              DataLoader workers), so parallel trials do not oversubscribe the cores. Trial 0 is always the
+#              notebook's configuration: the baseline the others are measured against.
+#   pruning    after --grace-epochs, a trial whose best valid_loss is worse than the median of the other trials'
+#              best at the same epoch stops there (median stopping rule; the losses are shared between processes).
+#              Trials that finish still stop on valid_loss patience, as in train_model.py.
+#   serving    every completed trial is then loaded the way app.py loads a model, one at a time with the pool shut
+#              down, and timed at --serving-threads: p50 of a single-row /predict and of a --batch-rows batch.
+#   report     validation RMSE (rupees), latencies and parameter count per trial, the Pareto front of
+#              (RMSE, single-row ms, batch ms), and the recommended model: the front member within the target RMSE
+#              (default: the notebook configuration's) with the lowest single-row latency.
+# Trial models stay in <output>/trials/<trial>/ and the results in <output>/search.json.
+#
+# Usage:
+#   python hparam_search.py --csv "Car data to fed to the model.csv" --trials 24 --threads-per-trial 2
+#   python hparam_search.py --csv cars.csv --target-rmse 90000 --register v3 --promote   # serve the recommendation
+#   python hparam_search.py --self-test                                                  # synthetic CSV, 4 short trials
+import os
+import json
+import time
+import shutil
+import random
+import logging
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import app as api
+import train_model
+from synthetic_data import synthetic_requests
+
+SEARCH_SPACE = {
+    "input_embed_dim": (8, 16, 32, 64),
+    "num_heads": (1, 2, 4, 8),
+    "num_attn_blocks": (1, 2, 3, 4),
+    "learning_rate_scale": (0.5, 1.0, 2.0),  # x train_model.default_learning_rate(batch size)
+}
+BASELINE = {"input_embed_dim": 32, "num_heads": 4, "num_attn_blocks": 2, "learning_rate_scale": 1.0}  # the notebook
+OBJECTIVES = ("val_rmse", "single_row_ms", "batch_ms")  # all minimised
+
+# Set in each pool process by _init_worker
+_worker = {}
+
+
+# === SEARCH SPACE =================================================
+
+def _valid(params):
+    """ Attention heads split the embedding evenly, with at least 4 dimensions each. """
+    return params["input_embed_dim"] % params["num_heads"] == 0 and params["input_embed_dim"] // params["num_heads"] >= 4
+
+
+def sample_trials(n_trials, seed):
+    """ The baseline, then n_trials - 1 other valid configurations drawn without replacement. """
+    grid = [dict(zip(SEARCH_SPACE, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    others = [params for params in grid if _valid(params) and params != BASELINE]
+    random.Random(seed).shuffle(others)
+    return [BASELINE] + others[:max(0, n_trials - 1)]
+
+
+# === PRUNING ======================================================
+
+def should_prune(curve, others, grace_epochs, min_trials):
+    """ Median stopping rule. curve: this trial's valid_loss per epoch; others: the other trials' curves.
+    True when, past grace_epochs, its best loss is worse than the median best of >= min_trials trials at this epoch. """
+    epoch = len(curve)
+    if epoch <= grace_epochs: return False
+    reached = [min(other[:epoch]) for other in others if len(other) >= epoch]
+    if len(reached) < min_trials: return False
+    return min(curve) > float(np.median(reached))
+
+
+def _pruning_callback(trial_id, curves, grace_epochs, min_trials):
+    """ Lightning callback publishing each epoch's valid_loss to `curves` (shared by every trial) and stopping the
+    trial when should_prune says so. """
+    from pytorch_lightning.callbacks import Callback
+
+    class MedianPruner(Callback):
+        pruned_at = None
+
+        def on_validation_end(self, trainer, pl_module):
+            loss = trainer.callback_metrics.get("valid_loss")
+            if trainer.sanity_checking or loss is None: return
+            curve = list(curves.get(trial_id, [])) + [float(loss)]
+            curves[trial_id] = curve
+            others = [other for other_id, other in curves.items() if other_id != trial_id]
+            if should_prune(curve, others, grace_epochs, min_trials):
+                self.pruned_at = len(curve)
+                trainer.should_stop = True
+
+    return MedianPruner()
+
+
+# === TRIALS =======================================================
+
+def _init_worker(train_path, val_path, threads, curves, settings):
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already set in this process
+    for name in ("pytorch_lightning", "lightning", "lightning.pytorch", "pytorch_tabular"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    train_model._allow_checkpoint_globals()
+    _worker.update(train=pd.read_parquet(train_path), val=pd.read_parquet(val_path), curves=curves, settings=settings)
+
+
+def _run_trial(trial_id, params):
+    """ Trains one configuration in a pool process; returns its result (status completed / pruned / failed). """
+    settings, curves = _worker["settings"], _worker["curves"]
+    architecture = {k: v for k, v in params.items() if k != "learning_rate_scale"}
+    learning_rate = train_model.default_learning_rate(settings["batch_size"]) * params["learning_rate_scale"]
+    result = {"trial": trial_id, "params": params, "learning_rate": learning_rate}
+    work_dir = tempfile.mkdtemp(prefix=f"hparam_trial{trial_id}_")
+    start = time.perf_counter()
+    try:
+        tabular_model = train_model.build_model(settings["batch_size"], learning_rate, settings["max_epochs"], 0,
+                                                settings["seed"], work_dir, architecture=architecture, progress_bar="none")
+        datamodule = tabular_model.prepare_dataloader(train=_worker["train"], validation=_worker["val"], seed=settings["seed"])
+        model = tabular_model.prepare_model(datamodule)
+        pruner = _pruning_callback(trial_id, curves, settings["grace_epochs"], settings["min_trials"])
+        tabular_model.train(model, datamodule, callbacks=[pruner])
+        curve = list(curves.get(trial_id, []))
+        result.update(epochs=len(curve), best_valid_loss=round(min(curve), 6) if curve else None,
+                      train_seconds=round(time.perf_counter() - start, 2))
+        if pruner.pruned_at is not None:
+            result["status"] = "pruned"
+            return result
+        result.update(train_model.evaluate(tabular_model, _worker["val"]), status="completed")
+        # The saved callbacks must not reference this search's shared state
+        tabular_model.callbacks = [c for c in tabular_model.callbacks if c is not pruner]
+        train_model._serving_config(tabular_model)
+        result["path"] = os.path.join(settings["trials_dir"], str(trial_id))
+        tabular_model.save_model(result["path"])
+        return result
+    except Exception as e:
+        result.update(status="failed", error=f"{type(e).__name__}: {e}", train_seconds=round(time.perf_counter() - start, 2))
+        return result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# === SERVING COST =================================================
+
+def _p50_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(float(np.median(samples)), 3)
+
+
+def measure_serving(path, threads, batch_rows, repeat):
+    """ Loads a trial's model as app.py does and times single-row and batch scoring. """
+    loaded = api._load_version(f"trial-{os.path.basename(path)}", path)
+    api.configure_threads(threads)
+    single = api.INPUT_SCHEMA.validate(synthetic_requests(1))
+    batch = api.INPUT_SCHEMA.validate(synthetic_requests(batch_rows))
+    for _ in range(3): api._predict_prices(single, loaded); api._predict_prices(batch, loaded)
+    return {
+        "single_row_ms": _p50_ms(lambda: api._predict_prices(single, loaded), repeat),
+        "batch_ms": _p50_ms(lambda: api._predict_prices(batch, loaded), max(3, repeat // 10)),
+        "parameters": int(sum(p.numel() for p in loaded.model.model.parameters())),
+        "engine": loaded.engine_name,
+    }
+
+
+def pareto_front(results, objectives=OBJECTIVES):
+    """ Results no other result beats on every objective (and strictly on one), by val_rmse. """
+    points = [r for r in results if all(r.get(k) is not None for k in objectives)]
+
+    def dominates(a, b):
+        return all(a[k] <= b[k] for k in objectives) and any(a[k] < b[k] for k in objectives)
+
+    return sorted((r for r in points if not any(dominates(other, r) for other in points)), key=lambda r: r["val_rmse"])
+
+
+def recommend(front, target_rmse):
+    """ The front member within target_rmse with the lowest single-row latency (then fewest parameters). """
+    within = [r for r in front if r["val_rmse"] <= target_rmse]
+    return min(within, key=lambda r: (r["single_row_ms"], r["parameters"])) if within else None
+
+
+# === SEARCH =======================================================
+
+def search(csv_path, output, n_trials=16, workers=None, threads_per_trial=1, cache_dir=train_model.DEFAULT_CACHE_DIR,
+           batch_size=1024, max_epochs=30, grace_epochs=3, min_trials=3, seed=42, target_rmse=None,
+           serving_threads=1, batch_rows=256, repeat=50):
+    """ Runs the trials, times the completed ones and writes <output>/search.json; returns the report. """
+    workers = workers or max(1, api._available_cpus() // threads_per_trial)
+    start = time.perf_counter()
+    df, cache_hit = train_model.load_dataset(csv_path, cache_dir, train_model.file_sha256(csv_path))
+    train_df, val_df = train_model.split_dataset(df, seed)
+    trials = sample_trials(n_trials, seed)
+    trials_dir = os.path.join(output, "trials")
+    os.makedirs(trials_dir, exist_ok=True)
+    print(f"--- {len(trials)} trials on {len(df):,} rows ({'cached' if cache_hit else 'parsed'}): "
+          f"{workers} at a time x {threads_per_trial} thread(s) ---")
+
+    data_dir = tempfile.mkdtemp(prefix="hparam_data_")
+    train_path, val_path = os.path.join(data_dir, "train.parquet"), os.path.join(data_dir, "val.parquet")
+    train_df.to_parquet(train_path, index=False)
+    val_df.to_parquet(val_path, index=False)
+    settings = {"batch_size": batch_size, "max_epochs": max_epochs, "seed": seed, "grace_epochs": grace_epochs,
+                "min_trials": min_trials, "trials_dir": trials_dir}
+    results = []
+    try:
+        # spawn: a forked child would inherit the parent's torch thread pools
+        with multiprocessing.get_context("spawn").Manager() as manager:
+            curves = manager.dict()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_worker,
+                                     initargs=(train_path, val_path, threads_per_trial, curves, settings)) as pool:
+                futures = [pool.submit(_run_trial, trial_id, params) for trial_id, params in enumerate(trials)]
+                for future in as_completed(futures):
+                    result = future.result()
+                    results.append(result)
+                    detail = f"RMSE {result['val_rmse']:,.0f}" if result["status"] == "completed" else result.get("error", "")
+                    print(f"--- Trial {result['trial']} {result['status']} after {result.get('epochs')} epoch(s), "
+                          f"{result['train_seconds']:.1f}s {detail} ---")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    search_seconds = round(time.perf_counter() - start, 2)
+
+    results.sort(key=lambda r: r["trial"])
+    for result in results:
+        if result["status"] == "completed":
+            result.update(measure_serving(result["path"], serving_threads, batch_rows, repeat))
+    front = pareto_front(results)
+    baseline = results[0] if results and results[0]["status"] == "completed" else None
+    completed = [r for r in results if r["status"] == "completed"]
+    if target_rmse is None and completed:
+        target_rmse = baseline["val_rmse"] if baseline else min(r["val_rmse"] for r in completed)
+    best = recommend(front, target_rmse) if completed else None
+
+    report = {
+        "source": os.path.abspath(csv_path), "rows": int(len(df)), "search_space": SEARCH_SPACE,
+        "settings": {**settings, "workers": workers, "threads_per_trial": threads_per_trial,
+                     "serving_threads": serving_threads, "batch_rows": batch_rows},
+        "search_seconds": search_seconds, "target_rmse": target_rmse, "objectives": list(OBJECTIVES),
+        "trials": results, "pareto_front": [r["trial"] for r in front],
+        "recommended": best["trial"] if best else None, "finished_at": time.time(),
+    }
+    with open(os.path.join(output, "search.json"), "w") as f: json.dump(report, f, indent=2, default=str)
+    print_report(report)
+    return report
+
+
+def print_report(report):
+    front, best = set(report["pareto_front"]), report["recommended"]
+    print(f"\n=== {len(report['trials'])} trials in {report['search_seconds']:.0f}s "
+          f"(* Pareto front, > recommended; target RMSE {report['target_rmse'] or 0:,.0f}) ===")
+    print(f"  {'':2}{'trial':>5} {'embed':>5} {'heads':>5} {'blocks':>6} {'lr':>9} {'status':>9} {'epochs':>6} "
+          f"{'RMSE':>10} {'MAPE':>6} {'1-row ms':>9} {'batch ms':>9} {'params':>8}")
+    for r in report["trials"]:
+        mark = (">" if r["trial"] == best else " ") + ("*" if r["trial"] in front else " ")
+        p = r["params"]
+        metrics = (f"{r['val_rmse']:>10,.0f} {r['val_mape']:>6.1%} {r['single_row_ms']:>9.2f} {r['batch_ms']:>9.2f} "
+                   f"{r['parameters']:>8,}") if r["status"] == "completed" else ""
+        print(f"  {mark}{r['trial']:>5} {p['input_embed_dim']:>5} {p['num_heads']:>5} {p['num_attn_blocks']:>6} "
+              f"{r['learning_rate']:>9.2e} {r['status']:>9} {r.get('epochs') or 0:>6} {metrics}")
+    if best is None: print("!!! No completed trial is within the target RMSE !!!")
+
+
+def self_test(n_rows=2000):
+    """ Pruning rule and Pareto front checks, then a 4-trial search on a synthetic CSV with 2 pool processes. """
+    assert not should_prune([1.0, 0.9], [[0.5, 0.4]] * 3, grace_epochs=2, min_trials=3)  # within grace
+    assert should_prune([1.0, 0.9, 0.8], [[0.5, 0.4, 0.3]] * 3, grace_epochs=2, min_trials=3)
+    assert not should_prune([1.0, 0.9, 0.8], [[0.5, 0.4, 0.3]] * 2, grace_epochs=2, min_trials=3)  # too few peers
+    assert not should_prune([1.0, 0.9, 0.2], [[0.5, 0.4, 0.3]] * 3, grace_epochs=2, min_trials=3)
+    points = [{"trial": 0, "val_rmse": 1, "single_row_ms": 5, "batch_ms": 9}, {"trial": 1, "val_rmse": 2, "single_row_ms": 1, "batch_ms": 9},
+              {"trial": 2, "val_rmse": 2, "single_row_ms": 5, "batch_ms": 9}]
+    assert [r["trial"] for r in pareto_front(points)] == [0, 1]
+    assert len(sample_trials(200, 0)) == len({json.dumps(p, sort_keys=True) for p in sample_trials(200, 0)})
+    assert all(_valid(p) for p in sample_trials(200, 0)) and sample_trials(5, 0)[0] == BASELINE
+
+    work_dir = tempfile.mkdtemp(prefix="hparam_search_test_")
+    try:
+        csv_path = os.path.join(work_dir, "cars.csv")
+        train_model.write_synthetic_csv(csv_path, n_rows)
+        report = search(csv_path, os.path.join(work_dir, "search"), n_trials=4, workers=2, threads_per_trial=1,
+                        cache_dir=os.path.join(work_dir, "cache"), max_epochs=4, grace_epochs=1, min_trials=2, repeat=10)
+        trials = report["trials"]
+        assert [r["trial"] for r in trials] == [0, 1, 2, 3], trials
+        assert not [r for r in trials if r["status"] == "failed"], [r.get("error") for r in trials]
+        completed = [r for r in trials if r["status"] == "completed"]
+        assert completed and all(r["single_row_ms"] > 0 and r["batch_ms"] > 0 for r in completed), completed
+        front = [r for r in trials if r["trial"] in report["pareto_front"]]
+        assert front and not any(all(o[k] <= r[k] for k in OBJECTIVES) and any(o[k] < r[k] for k in OBJECTIVES)
+                                 for r in front for o in completed), front
+        assert report["recommended"] is None or report["recommended"] in report["pareto_front"]
+        print(f"--- Self-test passed: {len(completed)} completed, "
+              f"{sum(r['status'] == 'pruned' for r in trials)} pruned, front {report['pareto_front']} ---")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hyperparameter search over FT-Transformer configurations")
+    parser.add_argument("--csv", default="Car data to fed to the model.csv")
+    parser.add_argument("--output", default=None, help="default: hparam_search_<timestamp>")
+    parser.add_argument("--cache-dir", default=train_model.DEFAULT_CACHE_DIR)
+    parser.add_argument("--trials", type=int, default=16, help="configurations to train, the notebook's included")
+    parser.add_argument("--workers", type=int, default=None, help="parallel trials (default: cores / threads per trial)")
+    parser.add_argument("--threads-per-trial", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--max-epochs", type=int, default=30)
+    parser.add_argument("--grace-epochs", type=int, default=3, help="epochs before a trial can be pruned")
+    parser.add_argument("--min-trials", type=int, default=3, help="trials that must have reached an epoch to prune at it")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--target-rmse", type=float, default=None, help="accuracy target in rupees (default: the notebook config's)")
+    parser.add_argument("--serving-threads", type=int, default=1, help="torch threads when timing inference")
+    parser.add_argument("--batch-rows", type=int, default=256)
+    parser.add_argument("--register", metavar="VERSION", default=None, help="register the recommended model in model_registry.py")
+    parser.add_argument("--promote", action="store_true", help="with --register: serve the new version")
+    parser.add_argument("--self-test", action="store_true", help="run a 4-trial search on a synthetic CSV")
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        self_test()
+        return
+    output = args.output or f"hparam_search_{time.strftime('%Y%m%d_%H%M%S')}"
+    report = search(args.csv, output, args.trials, args.workers, args.threads_per_trial, args.cache_dir, args.batch_size,
+                    args.max_epochs, args.grace_epochs, args.min_trials, args.seed, args.target_rmse,
+                    args.serving_threads, args.batch_rows)
+    if args.register and report["recommended"] is not None:
+        import model_registry
+        best = report["trials"][report["recommended"]]
+        metrics = {k: best[k] for k in ("val_rmse", "val_mae", "val_mape", "single_row_ms", "batch_ms", "parameters")}
+        manifest = model_registry.register(api.MODEL_REGISTRY_DIR, best["path"], args.register,
+                                           notes=f"hparam_search.py trial {best['trial']}: {best['params']}", metrics=metrics)
+        print(f"--- Registered {manifest['version']} in {api.MODEL_REGISTRY_DIR} ---")
+        if args.promote:
+            model_registry.promote(api.MODEL_REGISTRY_DIR, manifest["version"])
+            print(f"--- {manifest['version']} is now current ---")
+
+
+if __name__ == "__main__":
+    main()
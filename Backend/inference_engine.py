@@ -0,0 +1,295 @@
+# --- Fast Inference Engine for saved_car_model_log_v1 ---
+# Bypasses TabularModel.predict (DataModule copy, pandas encoders, DataLoader) for request-time scoring.
+# The category -> index tables and StandardScaler constants are read ONCE from datamodule.sav, so a
+# request is turned straight into tensors and run through the FT-Transformer under torch.inference_mode().
+#
+# The same encoder + a traced graph also back ExportedInferenceEngine (export_model.py artifacts).
+# torch is imported lazily so the ONNX runtime path never loads it.
+#
+# Parity + latency check against TabularModel.predict:
+#   python inference_engine.py --rows 256 --repeat 50
+import os
+import time
+import hashlib
+import argparse
+import json
+import numpy as np
+import pandas as pd
+
+# pytorch_tabular's OrdinalEncoder maps missing AND unseen categories to this index
+UNKNOWN_CATEGORY_INDEX = 0
+
+# Preprocessing spec written next to exported graphs (see export_model.py)
+PREPROCESS_SPEC_FILE = "preprocess.json"
+TORCHSCRIPT_FILE = "model.pt"
+ONNX_FILE = "model.onnx"
+# Dynamic int8 variant + its accuracy-gate report (see quantize_model.py)
+QUANTIZED_TORCHSCRIPT_FILE = "model_int8.pt"
+QUANTIZATION_REPORT_FILE = "quantization_report.json"
+
+
+def file_sha256(path):
+    """ Hex sha256 of a file: ties quantization_report.json to the model.pt it was measured against. """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureEncoder:
+    """ Category -> index lookups + StandardScaler constants; turns raw feature columns into model tensors. """
+
+    def __init__(self, categorical_cols, continuous_cols, category_lookup, unknown_index=UNKNOWN_CATEGORY_INDEX,
+                 mean=None, scale=None):
+        self.categorical_cols = list(categorical_cols)
+        self.continuous_cols = list(continuous_cols)
+        self.category_lookup = category_lookup
+        self.unknown_index = unknown_index
+        self.normalize = mean is not None
+        if self.normalize:
+            self.mean = np.asarray(mean, dtype=np.float64)
+            self.scale = np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def from_datamodule(cls, datamodule):
+        """ Reads the same tables OrdinalEncoder.transform and StandardScaler.transform use at predict time. """
+        config = datamodule.config
+        if datamodule.do_target_transform:
+            raise ValueError("FeatureEncoder does not support target transforms")
+        if config.continuous_feature_transform is not None:
+            raise ValueError("FeatureEncoder does not support continuous feature transforms")
+
+        encoder = datamodule.categorical_encoder
+        category_lookup = {col: encoder._mapping[col]["value"].to_dict() for col in config.categorical_cols}
+        scaler = datamodule.scaler if config.normalize_continuous_features else None
+        return cls(
+            config.categorical_cols, config.continuous_cols, category_lookup,
+            unknown_index=getattr(encoder, "_imputed", UNKNOWN_CATEGORY_INDEX),
+            mean=scaler.mean_ if scaler is not None else None,
+            scale=scaler.scale_ if scaler is not None else None,
+        )
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(
+            spec["categorical_cols"], spec["continuous_cols"], spec["category_lookup"],
+            unknown_index=spec["unknown_index"], mean=spec.get("mean"), scale=spec.get("scale"),
+        )
+
+    def to_spec(self):
+        """ JSON-serializable form. Only string categories are kept: requests never carry NaN (imputed to "Unknown"). """
+        return {
+            "categorical_cols": self.categorical_cols,
+            "continuous_cols": self.continuous_cols,
+            "category_lookup": {
+                col: {k: int(v) for k, v in lookup.items() if isinstance(k, str)}
+                for col, lookup in self.category_lookup.items()
+            },
+            "unknown_index": int(self.unknown_index),
+            "mean": self.mean.tolist() if self.normalize else None,
+            "scale": self.scale.tolist() if self.normalize else None,
+        }
+
+    def encode_columns(self, columns, n_rows):
+        """ Turns {column name: sequence of values} into (continuous float32, categorical int64) arrays. """
+        categorical = np.empty((n_rows, len(self.categorical_cols)), dtype=np.int64)
+        for j, col in enumerate(self.categorical_cols):
+            lookup, unknown = self.category_lookup[col], self.unknown_index
+            categorical[:, j] = np.fromiter((lookup.get(v, unknown) for v in columns[col]), dtype=np.int64, count=n_rows)
+
+        continuous = np.column_stack([np.asarray(columns[col], dtype=np.float64) for col in self.continuous_cols])
+        if self.normalize:
+            continuous = (continuous - self.mean) / self.scale
+        return continuous.astype(np.float32), categorical
+
+    def encode_records(self, records):
+        """ Encodes a list of cleaned-name dicts (already typed/imputed) without building a DataFrame. """
+        columns = {col: [r[col] for r in records] for col in self.categorical_cols + self.continuous_cols}
+        return self.encode_columns(columns, len(records))
+
+    def encode_frame(self, input_df):
+        """ Encodes a cleaned-name DataFrame (the same frame TabularModel.predict would receive). """
+        columns = {col: input_df[col].to_numpy() for col in self.categorical_cols + self.continuous_cols}
+        return self.encode_columns(columns, len(input_df))
+
+
+class _InferenceEngineBase:
+    """ Shared predict API; subclasses set self.encoder, self.prediction_col and implement forward(). """
+
+    @property
+    def categorical_cols(self):
+        return self.encoder.categorical_cols
+
+    @property
+    def continuous_cols(self):
+        return self.encoder.continuous_cols
+
+    def forward(self, continuous, categorical):
+        raise NotImplementedError
+
+    def predict_records(self, records):
+        return self.forward(*self.encoder.encode_records(records))
+
+    def predict(self, input_df):
+        """ Drop-in for TabularModel.predict: returns a DataFrame with the '<target>_prediction' column. """
+        raw = self.forward(*self.encoder.encode_frame(input_df))
+        return pd.DataFrame({self.prediction_col: raw}, index=input_df.index)
+
+
+class FastInferenceEngine(_InferenceEngineBase):
+    """ Request-time replacement for TabularModel.predict built from an already loaded TabularModel. """
+
+    def __init__(self, tabular_model):
+        datamodule = tabular_model.datamodule
+        self.encoder = FeatureEncoder.from_datamodule(datamodule)
+        self.target_col = datamodule.config.target[0]
+        self.prediction_col = f"{self.target_col}_prediction"
+        self.network = tabular_model.model
+        self.network.eval()
+
+    def forward(self, continuous, categorical):
+        """ Runs the FT-Transformer on encoded arrays. Returns raw (log-price) outputs as a 1-D array. """
+        import torch
+        batch = {"continuous": torch.from_numpy(continuous), "categorical": torch.from_numpy(categorical)}
+        with torch.inference_mode():
+            logits = self.network(batch)["logits"]
+        return logits[:, 0].numpy()
+
+
+class ExportedInferenceEngine(_InferenceEngineBase):
+    """ Serves an export_model.py artifact: TorchScript (or ONNX) graph + preprocess.json, no Lightning needed.
+    runtime: "torchscript" (fp32), "onnx", or "int8" (quantize_model.py output; refused unless its gate passed). """
+
+    def __init__(self, export_path, runtime="torchscript", num_threads=None):
+        with open(os.path.join(export_path, PREPROCESS_SPEC_FILE)) as f:
+            spec = json.load(f)
+        self.encoder = FeatureEncoder.from_spec(spec)
+        self.target_col = spec["target_col"]
+        self.prediction_col = f"{self.target_col}_prediction"
+        self.model_name = spec.get("model_name")
+        self.runtime = runtime
+        self.export_path = export_path
+
+        if runtime == "onnx":
+            self.session = self._onnx_session(num_threads)
+        elif runtime == "int8":
+            report_path = os.path.join(export_path, QUANTIZATION_REPORT_FILE)
+            if not os.path.exists(report_path):
+                raise ValueError(f"No {QUANTIZATION_REPORT_FILE} in {export_path}; run quantize_model.py first")
+            with open(report_path) as f:
+                report = json.load(f)
+            if not report.get("passed"):
+                raise ValueError(f"int8 model failed its accuracy gate: {report.get('reason')}")
+            # A report for an earlier export would otherwise unlock an int8 graph of a different model
+            if report.get("fp32_sha256") != file_sha256(os.path.join(export_path, TORCHSCRIPT_FILE)):
+                raise ValueError(f"{QUANTIZATION_REPORT_FILE} was measured against another {TORCHSCRIPT_FILE}; "
+                                 "re-run quantize_model.py")
+            import torch
+            self.graph = torch.jit.load(os.path.join(export_path, QUANTIZED_TORCHSCRIPT_FILE), map_location="cpu")
+            self.graph.eval()
+        else:
+            import torch
+            self.graph = torch.jit.load(os.path.join(export_path, TORCHSCRIPT_FILE), map_location="cpu")
+            self.graph.eval()
+
+    def _onnx_session(self, num_threads):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if num_threads: options.intra_op_num_threads = num_threads
+        return onnxruntime.InferenceSession(os.path.join(self.export_path, ONNX_FILE), options, providers=["CPUExecutionProvider"])
+
+    def set_num_threads(self, num_threads):
+        """ ONNX Runtime fixes its thread pool per session (and the pool does not survive a fork): rebuild it. """
+        if self.runtime == "onnx": self.session = self._onnx_session(num_threads)
+
+    def forward(self, continuous, categorical):
+        if self.runtime == "onnx":
+            return self.session.run(None, {"continuous": continuous, "categorical": categorical})[0]
+        import torch
+        with torch.inference_mode():
+            return self.graph(torch.from_numpy(continuous), torch.from_numpy(categorical)).numpy()
+
+
+# === PARITY + LATENCY CHECK ======================================
+
+def load_tabular_model(model_path):
+    import torch
+    import typing
+    import collections
+    from omegaconf.base import ContainerMetadata, Metadata
+    from omegaconf.listconfig import ListConfig
+    from omegaconf.nodes import AnyNode
+    from pytorch_tabular import TabularModel
+
+    # Same safe-globals allow-list as app.py
+    try:
+        torch.serialization.add_safe_globals([
+            ContainerMetadata, typing.Any, dict, collections.defaultdict,
+            ListConfig, list, int, AnyNode, Metadata,
+        ])
+    except AttributeError:
+        pass
+    return TabularModel.load_model(model_path)
+
+
+def sample_frame(encoder, n_rows, seed=42):
+    """ Random rows drawn from the known categories (plus an unseen one) and plausible numeric ranges. """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for col in encoder.categorical_cols:
+        known = [k for k in encoder.category_lookup[col] if isinstance(k, str)] + ["Unknown"]
+        data[col] = rng.choice(known, size=n_rows).astype(str)
+    for j, col in enumerate(encoder.continuous_cols):
+        mean, scale = (encoder.mean[j], encoder.scale[j]) if encoder.normalize else (0.0, 1.0)
+        data[col] = np.round(rng.normal(mean, scale, size=n_rows))
+    return pd.DataFrame(data)
+
+
+def time_call(fn, repeat):
+    """ Mean wall time of fn() in milliseconds over `repeat` calls (after one warm-up call). """
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat): fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check FastInferenceEngine parity and latency against TabularModel.predict")
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH", "saved_car_model_log_v1"))
+    parser.add_argument("--rows", type=int, default=256, help="rows in the batch used for the batched comparison")
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per measurement")
+    parser.add_argument("--atol", type=float, default=1e-4, help="max allowed abs difference in log-price")
+    args = parser.parse_args()
+
+    tabular_model = load_tabular_model(args.model_path)
+    tabular_model.datamodule.batch_size = max(args.rows, 1)
+    engine = FastInferenceEngine(tabular_model)
+
+    frame = sample_frame(engine.encoder, args.rows)
+    expected = tabular_model.predict(frame)[engine.prediction_col].to_numpy()
+    actual = engine.predict(frame)[engine.prediction_col].to_numpy()
+    max_diff = float(np.max(np.abs(expected - actual)))
+    print(f"--- Parity over {args.rows} rows: max |diff| = {max_diff:.2e} (atol {args.atol:.0e}) ---")
+
+    single = frame.iloc[:1]
+    single_record = single.to_dict("records")
+    print(f"--- Latency (mean of {args.repeat} calls) ---")
+    timings = [
+        ("TabularModel.predict, 1 row", lambda: tabular_model.predict(single)),
+        ("FastInferenceEngine.predict, 1 row", lambda: engine.predict(single)),
+        ("FastInferenceEngine.predict_records, 1 row", lambda: engine.predict_records(single_record)),
+        (f"TabularModel.predict, {args.rows} rows", lambda: tabular_model.predict(frame)),
+        (f"FastInferenceEngine.predict, {args.rows} rows", lambda: engine.predict(frame)),
+    ]
+    for label, fn in timings:
+        print(f"  {label:<48} {time_call(fn, args.repeat):9.3f} ms")
+
+    if max_diff > args.atol:
+        print("!!! PARITY CHECK FAILED !!!")
+        raise SystemExit(1)
+    print("--- Parity check passed ---")
+
+
+if __name__ == "__main__":
+    main()
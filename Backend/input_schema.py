@@ -0,0 +1,239 @@
+# --- Compiled input schema for the prediction endpoints ---
+# The request fields and their types come from the model's own config.yml (categorical_cols / continuous_cols,
+# or preprocess.json for an exported model). validate() takes one payload or a list of payloads and, one pass per
+# field, coerces them into typed NumPy columns: float64 for numeric fields (missing/blank -> 0) and str for
+# categorical fields (None/blank -> "Unknown"). Errors are reported per row AND per field, so a batch keeps its
+# good rows and the client learns which field of which row was wrong.
+#
+# Usage:
+#   schema = InputSchema.from_model_dir("saved_car_model_log_v1")
+#   batch = schema.validate(payloads)          # payloads: dict or list of dicts
+#   batch.errors[i]                            # None, or {"error": "...", "fields": {field: problem}}
+#   batch.frame()                              # DataFrame of the valid rows, in model column order
+#   batch = schema.validate_frame(chunk)       # columnar variant for bulk scoring (bulk_score.py)
+#
+#   python input_schema.py                     # per-field loop + pandas (previous app.py) vs compiled schema
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+MODEL_CONFIG_FILE = "config.yml"
+PREPROCESS_SPEC_FILE = "preprocess.json"  # written by export_model.py (see inference_engine.py)
+NUMERIC_FILL_VALUE = 0.0
+CATEGORY_FILL_VALUE = "Unknown"
+
+
+def _invalid_numeric_message(invalid):
+    return "Invalid non-numeric input for field(s): " + ", ".join(f"'{k}' (value: '{v}')" for k, v in invalid.items())
+
+
+class ValidatedBatch:
+    """ Typed columns for every payload + per-row errors. Rows with errors are left out of frame()/rows(). """
+
+    def __init__(self, schema, columns, errors):
+        self.schema = schema
+        self.columns = columns
+        self.errors = errors
+        self.valid_positions = [i for i, error in enumerate(errors) if error is None]
+
+    def __len__(self):
+        return len(self.errors)
+
+    def valid_columns(self):
+        if len(self.valid_positions) == len(self.errors): return self.columns
+        positions = np.asarray(self.valid_positions, dtype=np.intp)
+        return {col: values[positions] for col, values in self.columns.items()}
+
+    def frame(self):
+        """ DataFrame of the valid rows with the columns in the order the model was trained with. """
+        return pd.DataFrame(self.valid_columns(), columns=self.schema.columns)
+
+    def rows(self):
+        """ The valid rows as plain {column: value} dicts (cache keys, micro-batcher). """
+        columns = self.valid_columns()
+        n_rows = len(self.valid_positions)
+        return [{col: columns[col][i].item() if col in self.schema.numeric_set else columns[col][i]
+                 for col in self.schema.columns} for i in range(n_rows)]
+
+
+class InputSchema:
+    """ Field names, types and fill values of a model's request payload, compiled once. """
+
+    def __init__(self, categorical_cols, continuous_cols):
+        self.categorical_cols = list(categorical_cols)
+        self.continuous_cols = list(continuous_cols)
+        self.columns = self.categorical_cols + self.continuous_cols
+        self.numeric_set = frozenset(self.continuous_cols)
+
+    @classmethod
+    def from_config(cls, path):
+        """ From a pytorch_tabular config.yml (saved next to the checkpoint). """
+        import yaml
+        with open(path) as f:
+            config = yaml.safe_load(f)
+        return cls(config["categorical_cols"], config["continuous_cols"])
+
+    @classmethod
+    def from_spec(cls, path):
+        """ From the preprocess.json of an exported model. """
+        with open(path) as f:
+            spec = json.load(f)
+        return cls(spec["categorical_cols"], spec["continuous_cols"])
+
+    @classmethod
+    def from_model_dir(cls, model_dir):
+        config_path = os.path.join(model_dir, MODEL_CONFIG_FILE)
+        if os.path.exists(config_path): return cls.from_config(config_path)
+        return cls.from_spec(os.path.join(model_dir, PREPROCESS_SPEC_FILE))
+
+    def blank_payload(self):
+        """ A payload with every field present and empty (imputes to the fill values). """
+        return dict.fromkeys(self.columns)
+
+    def _numeric_column(self, raw):
+        """ float64 column (None/blank -> NaN) + {row: rejected value}. """
+        try:
+            values = np.array(raw, dtype=np.float64)  # numbers, numeric strings and None in one C loop
+            if values.shape == (len(raw),): return values, {}
+        except (ValueError, TypeError):
+            pass
+        values = np.empty(len(raw), dtype=np.float64)
+        invalid = {}
+        for i, value in enumerate(raw):
+            try:
+                values[i] = np.nan if value is None or str(value).strip() == "" else float(value)
+            except (ValueError, TypeError):
+                values[i] = np.nan
+                invalid[i] = value
+        return values, invalid
+
+    @staticmethod
+    def _categorical_column(raw):
+        column = np.empty(len(raw), dtype=object)
+        column[:] = [text if (text := "" if value is None else str(value)).strip() else CATEGORY_FILL_VALUE
+                     for value in raw]
+        return column
+
+    def _column(self, col, raw, invalid):
+        """ Typed, imputed column; rejected numeric values are added to invalid[row][col]. """
+        if col not in self.numeric_set: return self._categorical_column(raw)
+        values, rejected = self._numeric_column(raw)
+        for i, value in rejected.items(): invalid[i][col] = value
+        values[np.isnan(values)] = NUMERIC_FILL_VALUE
+        return values
+
+    def validate_frame(self, frame):
+        """ Columnar validate() for bulk scoring: a DataFrame whose columns already carry the schema names.
+        Missing values (None/NaN) are imputed. A schema column absent from the frame raises ValueError. """
+        absent = [col for col in self.columns if col not in frame.columns]
+        if absent: raise ValueError(f"Input has no column(s): {', '.join(absent)}")
+        invalid = [{} for _ in range(len(frame))]
+        columns = {}
+        for col in self.columns:
+            series = frame[col]
+            raw = series.astype(object).where(series.notna(), None).tolist()
+            columns[col] = self._column(col, raw, invalid)
+        errors = [{"error": _invalid_numeric_message(row_invalid), "fields": {col: "not a number" for col in row_invalid}}
+                  if row_invalid else None for row_invalid in invalid]
+        return ValidatedBatch(self, columns, errors)
+
+    def validate(self, payloads):
+        """ Coerces + imputes one payload (dict) or a list of them. Returns a ValidatedBatch. """
+        if isinstance(payloads, dict): payloads = [payloads]
+        records = [p if isinstance(p, dict) else None for p in payloads]
+        missing = [[] for _ in records]
+        invalid = [{} for _ in records]
+        empty = {}
+
+        columns = {}
+        for col in self.columns:
+            raw = [None if r is None else r.get(col) for r in records]
+            for i, r in enumerate(records):
+                if r is not None and col not in r: missing[i].append(col)
+            columns[col] = self._column(col, raw, invalid)
+
+        errors = []
+        for record, row_missing, row_invalid in zip(records, missing, invalid):
+            if record is None:
+                errors.append({"error": "Input record must be a JSON object", "fields": empty})
+            elif row_missing:
+                errors.append({"error": f"Missing input fields: {', '.join(row_missing)}",
+                               "fields": {**{col: "missing" for col in row_missing},
+                                          **{col: "not a number" for col in row_invalid}}})
+            elif row_invalid:
+                errors.append({"error": _invalid_numeric_message(row_invalid),
+                               "fields": {col: "not a number" for col in row_invalid}})
+            else:
+                errors.append(None)
+        return ValidatedBatch(self, columns, errors)
+
+
+# === MICROBENCHMARK ===============================================
+# The per-request preparation app.py used before the schema: a per-field validation loop, then a DataFrame
+# built from the dicts, imputed column-wise, cast and renamed (kept here only as the benchmark baseline).
+
+def _legacy_prepare(payloads, categorical_cols, continuous_cols):
+    rows = []
+    for data in payloads:
+        row = {}
+        for col in categorical_cols + continuous_cols:
+            value = data[col]
+            if col in continuous_cols:
+                row[col] = np.nan if value is None or str(value).strip() == "" else float(value)
+            else:
+                row[col] = str(value) if value is not None else ""
+        rows.append(row)
+    frame = pd.DataFrame(rows)
+    frame[continuous_cols] = frame[continuous_cols].fillna(0).astype(float)
+    categorical = frame[categorical_cols].fillna("").astype(str)
+    frame[categorical_cols] = categorical.mask(categorical.apply(lambda s: s.str.strip() == ""), CATEGORY_FILL_VALUE)
+    frame = frame.rename(columns={col: col for col in frame.columns})
+    expected = set(categorical_cols + continuous_cols)
+    return frame[[col for col in frame.columns if col in expected]]
+
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def benchmark(model_dir, sizes, repeat):
+    from synthetic_data import synthetic_requests
+
+    schema = InputSchema.from_model_dir(model_dir)
+    print(f"--- Schema from {model_dir}: {len(schema.categorical_cols)} categorical + "
+          f"{len(schema.continuous_cols)} numeric fields ---")
+    print(f"  {'rows':>6}{'legacy ms':>12}{'schema ms':>12}{'+ frame ms':>12}{'speed-up':>10}{'us/row':>9}")
+    for n_rows in sizes:
+        payloads = synthetic_requests(n_rows)
+        payloads[0]["km"] = ""  # exercise the slow (per-value) numeric path as well
+        legacy = _time(lambda: _legacy_prepare(payloads, schema.categorical_cols, schema.continuous_cols), repeat)
+        compiled = _time(lambda: schema.validate(payloads), repeat)
+        with_frame = _time(lambda: schema.validate(payloads).frame(), repeat)
+        print(f"  {n_rows:>6}{legacy:>12.3f}{compiled:>12.3f}{with_frame:>12.3f}{legacy / with_frame:>9.1f}x"
+              f"{with_frame * 1000 / n_rows:>9.1f}")
+
+        expected = _legacy_prepare(payloads, schema.categorical_cols, schema.continuous_cols)[schema.columns]
+        pd.testing.assert_frame_equal(schema.validate(payloads).frame(), expected)
+    print("--- Frames identical to the legacy preparation ---")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of request validation + preprocessing, legacy vs compiled schema")
+    parser.add_argument("--model-dir", default=os.getenv("MODEL_PATH", "saved_car_model_log_v1"))
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 16, 256, 4096])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    benchmark(args.model_dir, args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
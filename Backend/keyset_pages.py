@@ -0,0 +1,207 @@
+# --- Keyset (Seek) Pagination for /find_by_body ---
+# /find_by_body lists the cars of one body nearest to a target price. ORDER BY abs(listed_price - p) makes the
+# database compute and sort every car in the price window, and OFFSET paging would re-read all earlier pages.
+# Instead the search walks outward from the target price in both directions over the (body, listed_price, ID) index
+# (migrations.py):
+#   up    the next rows after the last (listed_price, ID) returned on that side, ascending   (index range scan)
+#   down  the next rows before the last (listed_price, ID) returned on that side, descending (backward range scan)
+# A page reads at most page_size rows from each side and merges them by distance to the target (ties: the cheaper
+# car, then the lower ID above / higher ID below the target, as the in-memory index orders them). The cursor holds
+# the query and the last position consumed on each side as base64url JSON, and the client sends it back unchanged.
+# Any page, at any depth, costs two LIMIT page_size index seeks. SimilarCarsIndex.find_page walks its sorted
+# partitions the same way, so both paths return the same sequence and accept each other's cursors.
+#
+# Usage:
+#   python keyset_pages.py --benchmark                       # SQLite, 1M synthetic cars: plans + latency by depth
+#   python keyset_pages.py --benchmark --rows 2000000 --database-uri postgresql://user:pw@localhost/bench
+import json
+import time
+import base64
+import argparse
+
+from sqlalchemy import select, tuple_
+
+CURSOR_VERSION = 1
+MIGRATION_ID = "0003_car_data_body_price_index_typed"  # migrations.py: the index these seeks run on
+
+
+class Walk:
+    """ Position of a paginated /find_by_body search: the query plus the last (price, ID) consumed on each side. """
+
+    def __init__(self, body, target, lower, upper, up=None, down=None, up_done=False, down_done=False):
+        self.body = body
+        self.target = target
+        self.lower = lower
+        self.upper = upper
+        self.up = up  # None: start at listed_price >= target
+        self.down = down  # None: start at listed_price < target
+        self.up_done = up_done
+        self.down_done = down_done
+
+    @classmethod
+    def start(cls, body, target, lower, upper):
+        return cls(body, float(target), float(lower), float(upper))
+
+    def encode(self):
+        state = {"v": CURSOR_VERSION, "b": self.body, "t": self.target, "l": self.lower, "h": self.upper,
+                 "u": self.up, "d": self.down, "ud": self.up_done, "dd": self.down_done}
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, cursor):
+        """ Walk from a cursor string; ValueError for anything that is not a cursor this version issued. """
+        try:
+            state = json.loads(base64.urlsafe_b64decode(str(cursor) + "=" * (-len(str(cursor)) % 4)))
+            if state["v"] != CURSOR_VERSION: raise ValueError
+            up, down = (tuple(position) if position is not None else None for position in (state["u"], state["d"]))
+            for position in (up, down):
+                if position is not None and (len(position) != 2 or not all(isinstance(v, (int, float)) for v in position)):
+                    raise ValueError
+            return cls(str(state["b"]), float(state["t"]), float(state["l"]), float(state["h"]), up, down,
+                       bool(state["ud"]), bool(state["dd"]))
+        except (ValueError, TypeError, KeyError, AttributeError, json.JSONDecodeError, UnicodeDecodeError):
+            raise ValueError("Invalid 'cursor'") from None
+
+
+def page_statements(car_model, columns, walk, page_size):
+    """ (up, down) SELECTs of one page (None for a side already exhausted); `columns` must include ID and listed_price. """
+    price, car_id = car_model.listed_price, car_model.ID
+    base = select(*columns).where(car_model.body == walk.body)
+    up = down = None
+    if not walk.up_done:
+        after = tuple_(price, car_id) > tuple_(*walk.up) if walk.up is not None else price >= walk.target
+        up = base.where(after, price <= walk.upper).order_by(price, car_id).limit(page_size)
+    if not walk.down_done:
+        before = tuple_(price, car_id) < tuple_(*walk.down) if walk.down is not None else price < walk.target
+        down = base.where(before, price >= walk.lower).order_by(price.desc(), car_id.desc()).limit(page_size)
+    return up, down
+
+
+def next_page(walk, up_rows, down_rows, page_size, position):
+    """ Merges the rows fetched on each side (nearest first) into one page.
+    Returns (rows, cursor of the next page or None when both sides are exhausted); position(row) -> (price, ID). """
+    page, i, j = [], 0, 0
+    while len(page) < page_size and (i < len(up_rows) or j < len(down_rows)):
+        take_down = j < len(down_rows) and (
+            i >= len(up_rows) or walk.target - position(down_rows[j])[0] <= position(up_rows[i])[0] - walk.target)
+        if take_down:
+            page.append(down_rows[j]); j += 1
+        else:
+            page.append(up_rows[i]); i += 1
+    # A side that returned less than a full page and was used up has no rows left
+    following = Walk(walk.body, walk.target, walk.lower, walk.upper,
+                     up=list(position(up_rows[i - 1])) if i else walk.up,
+                     down=list(position(down_rows[j - 1])) if j else walk.down,
+                     up_done=walk.up_done or (len(up_rows) < page_size and i == len(up_rows)),
+                     down_done=walk.down_done or (len(down_rows) < page_size and j == len(down_rows)))
+    return page, None if following.up_done and following.down_done else following.encode()
+
+
+# === BENCHMARK ====================================================
+
+def _explain(conn, statement):
+    compiled = statement.compile(conn, compile_kwargs={"literal_binds": True})
+    if conn.dialect.name == "sqlite":
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")]
+    return [row[0] for row in conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {compiled}")]
+
+
+def _time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return round(samples[len(samples) // 2], 2)
+
+
+def benchmark(database_uri, rows, depths=(1, 10, 100, 1000), page_size=10, repeat=5):
+    """ OFFSET vs keyset, before and after the covering index: query plans and median latency per page depth. """
+    from sqlalchemy import create_engine, func, text
+    from synthetic_data import seed_table
+    import app as api
+    import migrations
+
+    engine = create_engine(database_uri)
+    car = api.CarInfo
+    table = car.__table__
+    seed_table(engine, table, rows)
+    index_name = migrations.BODY_PRICE_INDEX
+    columns = api.FIND_BY_BODY_COLUMNS
+    body, target = "sedan", 750000.0
+    walk = Walk.start(body, target, 0, 10 ** 9)  # whole body: the deepest pages still have rows
+
+    def offset_statement(depth):
+        return (select(*columns).where(car.body == body, car.listed_price >= walk.lower, car.listed_price <= walk.upper)
+                .order_by(func.abs(car.listed_price - target), car.ID).offset((depth - 1) * page_size).limit(page_size))
+
+    def walk_to(conn, depth):
+        """ Keyset cursor of page `depth` (walked once, untimed). """
+        current = walk
+        for _ in range(depth - 1):
+            up, down = page_statements(car, columns, current, page_size)
+            fetched = [conn.execute(s).all() if s is not None else [] for s in (up, down)]
+            _, cursor = next_page(current, *fetched, page_size, lambda r: (r.listed_price, r.ID))
+            current = Walk.decode(cursor)
+        return current
+
+    def keyset_page(conn, at):
+        up, down = page_statements(car, columns, at, page_size)
+        fetched = [conn.execute(s).all() if s is not None else [] for s in (up, down)]
+        return next_page(at, *fetched, page_size, lambda r: (r.listed_price, r.ID))
+
+    def drop_index():
+        migrations.applied(engine)  # creates schema_migrations if needed
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+            conn.execute(migrations.schema_migrations.delete().where(migrations.schema_migrations.c.id == MIGRATION_ID))
+
+    report = {}
+    migrations.upgrade(engine, table, only=MIGRATION_ID)
+    with engine.connect() as conn:
+        count = conn.execute(select(func.count()).select_from(table).where(car.body == body)).scalar()
+        # Cursors depend on the data only: walk once (with the index), then time both phases from the same positions
+        cursors = {depth: walk_to(conn, depth) for depth in depths}
+    print(f"--- {rows:,} cars, {count:,} {body}s, page size {page_size} ---")
+    for phase in ("without index", "with index"):
+        if phase == "with index": migrations.upgrade(engine, table, only=MIGRATION_ID)
+        else: drop_index()
+        with engine.connect() as conn:
+            up, down = page_statements(car, columns, cursors[depths[-1]], page_size)
+            plans = {"offset": _explain(conn, offset_statement(depths[-1])), "keyset_up": _explain(conn, up),
+                     "keyset_down": _explain(conn, down)}
+            latency = {}
+            for depth in depths:
+                # Same page of the nearest-first order (cars at equal distance may be split differently across pages)
+                distances = [[abs(r.listed_price - target) for r in page]
+                             for page in (conn.execute(offset_statement(depth)).all(), keyset_page(conn, cursors[depth])[0])]
+                assert distances[0] == distances[1], (depth, distances)
+                latency[depth] = {
+                    "offset_ms": _time_ms(lambda: conn.execute(offset_statement(depth)).all(), repeat),
+                    "keyset_ms": _time_ms(lambda: keyset_page(conn, cursors[depth]), repeat),
+                }
+        report[phase] = {"plans": plans, "latency": latency}
+        print(f"\n=== {phase} ===")
+        for name, plan in plans.items():
+            print(f"  {name}:")
+            for line in plan: print(f"    {line}")
+        print(f"  {'page':>6} {'OFFSET ms':>10} {'keyset ms':>10}")
+        for depth, result in latency.items():
+            print(f"  {depth:>6} {result['offset_ms']:>10} {result['keyset_ms']:>10}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keyset pagination for /find_by_body: plan + latency benchmark")
+    parser.add_argument("--benchmark", action="store_true", required=True)
+    parser.add_argument("--database-uri", default="sqlite:////tmp/keyset_bench.db")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--depths", default="1,10,100,1000", help="page numbers to time")
+    args = parser.parse_args(argv)
+    benchmark(args.database_uri, args.rows, tuple(int(d) for d in args.depths.split(",")), args.page_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# --- HTTP load test: /predict, /find_by_body, /cars at high concurrency ---
+# Keeps `clients` connections busy from ONE asyncio process (aiohttp), so 500+ concurrent clients cost a few MB
+# instead of 500 threads. Each client sends its next request as soon as the previous one answered; latency is
+# measured per request, non-200 answers are counted as errors (by status).
+# --compare starts the Flask app under gunicorn (gthread workers) and asgi_app.py under uvicorn with the same
+# worker count and the environment of this shell (DATABASE_URI, MODEL_SERVING_MODE, ...), and runs the same load.
+#
+# Usage:
+#   python load_test.py --url http://127.0.0.1:5000 --clients 500                   # a server that is already up
+#   python load_test.py --compare --clients 500 --duration 30 --json async.json
+#   SIMILAR_CARS_INDEX=0 CAR_RECOMMENDER=0 python load_test.py --compare             # every request hits the DB
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import itertools
+import subprocess
+import collections
+
+import numpy as np
+import aiohttp
+
+from synthetic_data import synthetic_requests
+from worker_benchmark import _wait_until_ready
+
+SCENARIOS = ("predict", "find_by_body", "cars", "mix")
+MIX_WEIGHTS = {"predict": 6, "find_by_body": 2, "cars": 2}  # requests per 10 in the "mix" scenario
+
+
+def _request_factory(scenario, bodies):
+    """ Endless iterator of (method, path, json body). """
+    predict = (("POST", "/predict", body) for body in itertools.cycle(bodies))
+    find_by_body = (("POST", "/find_by_body", {"body": body["body"], "predicted_price": 300000 + 97 * (i % 10000)})
+                    for i, body in enumerate(itertools.cycle(bodies)))
+    cars = itertools.repeat(("GET", "/cars", None))
+    sources = {"predict": predict, "find_by_body": find_by_body, "cars": cars}
+    if scenario != "mix": return sources[scenario]
+    pattern = [name for name, weight in MIX_WEIGHTS.items() for _ in range(weight)]
+    return (next(sources[name]) for name in itertools.cycle(pattern))
+
+
+async def drive(base_url, scenario, bodies, clients, duration, timeout=60.0):
+    """ Runs `clients` concurrent request loops for `duration` seconds. Returns throughput / latency stats. """
+    requests_iter = _request_factory(scenario, bodies)
+    latencies = []
+    statuses = collections.Counter()
+    stop_at = time.monotonic() + duration
+
+    async def client(session):
+        while time.monotonic() < stop_at:
+            method, path, body = next(requests_iter)
+            start = time.perf_counter()
+            try:
+                async with session.request(method, base_url + path, json=body) as response:
+                    await response.read()
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    connector = aiohttp.TCPConnector(limit=clients, force_close=False)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        started = time.monotonic()
+        await asyncio.gather(*(client(session) for _ in range(clients)))
+        elapsed = time.monotonic() - started
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "scenario": scenario,
+        "clients": clients,
+        "requests": int(len(latencies)),
+        "errors": sum(n for status, n in statuses.items() if status != 200),
+        "statuses": {str(status): n for status, n in statuses.items()},
+        "rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+    }
+
+
+def _server_command(server, port, workers, flask_threads):
+    if server == "flask":
+        env = {"BIND": f"127.0.0.1:{port}", "WEB_CONCURRENCY": str(workers), "GUNICORN_THREADS": str(flask_threads)}
+        return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], env
+    env = {"WEB_CONCURRENCY": str(workers)}
+    return [sys.executable, "-m", "uvicorn", "asgi_app:app", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning", "--no-access-log"], env
+
+
+def run_server(server, args, bodies):
+    """ Starts one server, runs every scenario against it, stops it. """
+    command, extra_env = _server_command(server, args.port, args.workers, args.flask_threads)
+    env = dict(os.environ, PREDICTION_CACHE_SIZE=os.getenv("PREDICTION_CACHE_SIZE", "0"), **extra_env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_until_ready(base_url, process, args.workers, args.ready_timeout)
+        return [{"server": server, **asyncio.run(drive(base_url, scenario, bodies, args.clients, args.duration))}
+                for scenario in args.scenarios]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _print_result(r):
+    print(f"  {r.get('server', '-'):<7}{r['scenario']:<14}{r['clients']:>8}{r['requests']:>10}{r['rps']:>9.1f}"
+          f"{r['p50_ms'] or 0:>10.1f}{r['p99_ms'] or 0:>10.1f}{r['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-client load test of /predict, /find_by_body and /cars")
+    parser.add_argument("--url", default=None, help="server to drive (default: start servers, see --compare)")
+    parser.add_argument("--compare", action="store_true", help="start gunicorn+Flask and uvicorn+ASGI in turn")
+    parser.add_argument("--servers", nargs="+", choices=["flask", "asgi"], default=["flask", "asgi"])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=["predict", "mix"])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load per scenario")
+    parser.add_argument("--workers", type=int, default=1, help="server processes (WEB_CONCURRENCY)")
+    parser.add_argument("--flask-threads", type=int, default=32, help="GUNICORN_THREADS of the Flask server")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+    if not args.url and not args.compare: parser.error("pass --url or --compare")
+
+    bodies = synthetic_requests(2000)
+    results = []
+    print(f"  {'server':<7}{'scenario':<14}{'clients':>8}{'requests':>10}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    if args.url:
+        for scenario in args.scenarios:
+            results.append(asyncio.run(drive(args.url.rstrip("/"), scenario, bodies, args.clients, args.duration)))
+            _print_result(results[-1])
+    else:
+        for server in args.servers:
+            try:
+                server_results = run_server(server, args, bodies)
+            except Exception as e:
+                print(f"!!! {server} failed: {e} !!!")
+                continue
+            for r in server_results: _print_result(r)
+            results.extend(server_results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
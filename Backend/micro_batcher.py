@@ -0,0 +1,204 @@
+# --- Dynamic Micro-Batching for /predict ---
+# Concurrent /predict requests each score a single row. The batcher sits in front of the model: callers submit
+# their prepared model-input row and get a Future; a background thread collects rows until `max_batch_rows`
+# are waiting or the oldest has waited `max_latency_ms`, runs ONE forward pass over the batch and resolves
+# every caller's Future with its own price and the version of the model that scored it (a hot swap can land between
+# the request and its batch). A batch that fails is retried row by row, so one bad row only
+# fails its own request. A full queue raises QueueFull and a batch that does not finish in time raises TimeoutError:
+# both are back-pressure, answered with 503 + Retry-After. Queue depth, achieved batch sizes and wait times are
+# kept for /batcher/stats.
+# Coalescing needs concurrent requests inside one process: threaded server / gunicorn GUNICORN_THREADS > 1.
+#
+# Usage:
+#   python micro_batcher.py                                 # throughput / latency: direct vs batched, 64 callers
+#   python micro_batcher.py --callers 8 32 128 --max-latency-ms 1 2 5 10
+import os
+import time
+import queue
+import logging
+import argparse
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+logger = logging.getLogger("carify.micro_batcher")
+
+
+class QueueFull(RuntimeError):
+    """ submit() while max_queue rows are already waiting: shed the request instead of queueing it. """
+
+
+class MicroBatcher:
+    """ Coalesces single-row predictions into batched forward passes. predict_fn: DataFrame -> (array of prices,
+    version of the model that scored them). """
+
+    def __init__(self, predict_fn, max_batch_rows=64, max_latency_ms=5.0, max_queue=10000):
+        self.predict_fn = predict_fn
+        self.max_batch_rows = max_batch_rows
+        self.max_latency = max_latency_ms / 1000.0
+        self.max_queue = max_queue
+        self.counters = {"submitted": 0, "batches": 0, "rows": 0, "errors": 0, "rejected": 0, "row_retries": 0}
+        self._histogram = dict.fromkeys(BATCH_SIZE_BUCKETS, 0)
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._forward_total = 0.0
+        self._max_depth = 0
+        self._counter_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _ensure_started(self):
+        """ Starts the batching thread lazily, and again after a fork (threads do not survive into gunicorn workers). """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive(): return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive(): return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """ Queues one model-input row (mapping of column -> value). Returns a Future resolving to (price, model version). """
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((row, future, time.perf_counter()))
+        except queue.Full:
+            with self._counter_lock: self.counters["rejected"] += 1
+            raise QueueFull("Prediction queue is full")
+        with self._counter_lock:
+            self.counters["submitted"] += 1
+            self._max_depth = max(self._max_depth, self._queue.qsize())
+        return future
+
+    def predict(self, row, timeout=30.0):
+        """ submit() and wait: (price, model version). Raises QueueFull, or concurrent.futures.TimeoutError when the
+        row's batch has not finished within timeout seconds. """
+        return self.submit(row).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0][2] + self.max_latency
+            while len(batch) < self.max_batch_rows:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        try:
+            prices, version = self.predict_fn(pd.DataFrame([row for row, _, _ in batch]))
+            results = [(future, (float(price), version), None) for (_, future, _), price in zip(batch, prices)]
+        except Exception as batch_error:
+            logger.warning("Micro-batch of %d rows failed, scoring rows one by one: %s", len(batch), batch_error)
+            results = []
+            for row, future, _ in batch:
+                try:
+                    prices, version = self.predict_fn(pd.DataFrame([row]))
+                    results.append((future, (float(prices[0]), version), None))
+                except Exception as row_error:
+                    results.append((future, None, row_error))
+            with self._counter_lock: self.counters["row_retries"] += len(batch)
+        finished = time.perf_counter()
+
+        for future, scored, error in results:
+            if error is not None: future.set_exception(error)
+            else: future.set_result(scored)
+
+        waits = [started - enqueued for _, _, enqueued in batch]
+        with self._counter_lock:
+            self.counters["batches"] += 1
+            self.counters["rows"] += len(batch)
+            self.counters["errors"] += sum(1 for _, _, error in results if error is not None)
+            bucket = next((b for b in BATCH_SIZE_BUCKETS if len(batch) <= b), BATCH_SIZE_BUCKETS[-1])
+            self._histogram[bucket] += 1
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+            self._forward_total += finished - started
+
+    def stats(self):
+        with self._counter_lock:
+            counters = dict(self.counters)
+            batches, rows = counters["batches"], counters["rows"]
+            return {
+                **counters,
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+                "max_queue_depth": self._max_depth,
+                "avg_batch_size": round(rows / batches, 2) if batches else None,
+                "batch_size_histogram": {f"<={b}": n for b, n in self._histogram.items() if n},
+                "avg_wait_ms": round(self._wait_total / rows * 1000, 3) if rows else None,
+                "max_wait_ms": round(self._wait_max * 1000, 3),
+                "avg_forward_ms": round(self._forward_total / batches * 1000, 3) if batches else None,
+                "max_batch_rows": self.max_batch_rows,
+                "max_latency_ms": self.max_latency * 1000,
+            }
+
+
+# === THROUGHPUT / LATENCY CHECK ===================================
+
+def _hammer(score, rows, callers, duration):
+    """ `callers` threads call score(row) back to back. Returns (calls per second, latencies in ms). """
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def caller(offset):
+        local = []
+        i = offset
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            score(rows[i % len(rows)])
+            local.append(time.perf_counter() - start)
+            i += callers
+        with lock: latencies.extend(local)
+
+    threads = [threading.Thread(target=caller, args=(n,)) for n in range(callers)]
+    started = time.monotonic()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return len(latencies) / (time.monotonic() - started), np.array(latencies) * 1000
+
+
+def main():
+    from inference_engine import FastInferenceEngine, ExportedInferenceEngine, load_tabular_model, sample_frame
+
+    parser = argparse.ArgumentParser(description="Direct single-row predict vs micro-batched, under concurrent callers")
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH", "saved_car_model_log_v1"))
+    parser.add_argument("--export-path", default=None, help="score with an export_model.py artifact instead")
+    parser.add_argument("--callers", type=int, nargs="+", default=[64])
+    parser.add_argument("--max-latency-ms", type=float, nargs="+", default=[1.0, 2.0, 5.0, 10.0])
+    parser.add_argument("--max-batch-rows", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    engine = (ExportedInferenceEngine(args.export_path) if args.export_path
+              else FastInferenceEngine(load_tabular_model(args.model_path)))
+    prediction_col = engine.prediction_col
+    predict_fn = lambda frame: (np.exp(engine.predict(frame)[prediction_col].to_numpy()), None)
+    rows = sample_frame(engine.encoder, 1000).to_dict('records')
+
+    print(f"  {'callers':>7} {'mode':<24}{'calls/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'avg batch':>10}")
+    for callers in args.callers:
+        rps, lat = _hammer(lambda row: predict_fn(pd.DataFrame([row]))[0][0], rows, callers, args.duration)
+        print(f"  {callers:>7} {'direct (1 row/forward)':<24}{rps:>10.0f}{np.percentile(lat, 50):>9.2f}"
+              f"{np.percentile(lat, 99):>9.2f}{1:>10}")
+        for max_latency_ms in args.max_latency_ms:
+            batcher = MicroBatcher(predict_fn, args.max_batch_rows, max_latency_ms)
+            rps, lat = _hammer(batcher.predict, rows, callers, args.duration)
+            label = f"batched <= {max_latency_ms:g} ms"
+            print(f"  {callers:>7} {label:<24}{rps:>10.0f}{np.percentile(lat, 50):>9.2f}"
+                  f"{np.percentile(lat, 99):>9.2f}{batcher.stats()['avg_batch_size']:>10}")
+
+
+if __name__ == "__main__":
+    main()
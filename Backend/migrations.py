@@ -0,0 +1,258 @@
+# --- Schema Migrations ---
+# "car data" is loaded outside this repo (the scraped dataset imported into Supabase), and the tables the API owns
+# are created on first use (create(checkfirst=True)). Changes to tables that already exist go here instead: an
+# ordered list of migrations, each applied once and recorded in schema_migrations (id, description, applied_at).
+# Every migration is written for PostgreSQL (production) and SQLite (self-tests, benchmarks) and is safe to re-run,
+# so a half-applied one can simply be applied again.
+#
+# Usage:
+#   python migrations.py                                   # apply the pending migrations to DATABASE_URI
+#   python migrations.py --status                          # list applied / pending migrations
+#   python migrations.py --database-uri sqlite:////tmp/cars.db
+#   python migrations.py --backfill                        # parse dimensions of rows added since (e.g. after an import)
+import re
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text, inspect, update, bindparam, or_, Table, Column, MetaData, String, Float, select, insert
+
+MIGRATIONS = []  # (id, description, fn(engine, car_table)), in order
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("id", String(128), primary_key=True),
+    Column("description", String(255)),
+    Column("applied_at", Float),
+)
+
+
+def migration(migration_id, description):
+    def register(fn):
+        MIGRATIONS.append((migration_id, description, fn))
+        return fn
+    return register
+
+
+def _autocommit(engine):
+    """ Connection outside a transaction block (PostgreSQL's CREATE INDEX CONCURRENTLY refuses to run inside one). """
+    return engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+
+# === MIGRATIONS ===================================================
+
+BODY_PRICE_KEYS = ("body", "listed_price", "ID")  # ID makes (listed_price, ID) a unique seek key (keyset_pages.py)
+BODY_PRICE_INDEX = "ix_car_data_body_price_v2"  # current covering index of /find_by_body (0003)
+# Columns a /find_by_body page reads besides the keys (app.FIND_BY_BODY_COLUMNS): the typed length/width, and their
+# Text for rows imported since the last backfill
+BODY_PRICE_COVERED = ("model", "myear", "variant", "km", "fuel", "state", "transmission",
+                      "length_mm", "width_mm", "Length", "Width", "image_url")
+
+# Text dimension column -> (typed column, unit scale factors of the values seen in the scraped data)
+_MILLIMETRES = {"": 1.0, "mm": 1.0, "cm": 10.0, "m": 1000.0}
+DIMENSION_COLUMNS = {
+    "Length": ("length_mm", _MILLIMETRES),
+    "Width": ("width_mm", _MILLIMETRES),
+    "Height": ("height_mm", _MILLIMETRES),
+    "Wheel Base": ("wheel_base_mm", _MILLIMETRES),
+    "Kerb Weight": ("kerb_weight_kg", {"": 1.0, "kg": 1.0, "kgs": 1.0}),
+    "Max Torque At": ("max_torque_rpm", {"": 1.0, "rpm": 1.0}),
+}
+BACKFILL_CHUNK_ROWS = 20000
+# number, optional range end, unit: "3995 mm", "1500-2500rpm" (commas stripped and lowercased first)
+MEASURE_PATTERN = r"(\d+(?:\.\d+)?)\s*(?:(?:-|–|~|to)\s*(\d+(?:\.\d+)?))?\s*([a-z]*)"
+_MEASURE = re.compile(MEASURE_PATTERN)
+
+
+def _drop_invalid_index(conn, name):
+    """ A CONCURRENTLY build that failed half-way leaves an INVALID index that IF NOT EXISTS would keep. """
+    invalid = conn.execute(text("SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                                "WHERE c.relname = :name AND NOT i.indisvalid"), {"name": name}).first()
+    if invalid: conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+
+
+def _covering_index(engine, car_table, name, covered, replaces=None):
+    """ (body, listed_price, ID) index carrying `covered`, so a /find_by_body page is an index-only scan. """
+    preparer = engine.dialect.identifier_preparer
+    table = preparer.format_table(car_table)
+    keys = ", ".join(preparer.quote(column) for column in BODY_PRICE_KEYS)
+    covered = ", ".join(preparer.quote(column) for column in covered)
+    with _autocommit(engine) as conn:
+        if engine.dialect.name == "postgresql":
+            _drop_invalid_index(conn, name)
+            # CONCURRENTLY: the live table keeps taking writes while the index builds
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({keys}) INCLUDE ({covered})"))
+            if replaces: conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {replaces}"))
+        else:
+            # No INCLUDE outside PostgreSQL: the covered columns become trailing key columns
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({keys}, {covered})"))
+            if replaces: conn.execute(text(f"DROP INDEX IF EXISTS {replaces}"))
+        conn.execute(text(f"ANALYZE {table}"))
+
+
+@migration("0001_car_data_body_price_index", "(body, listed_price, ID) index on \"car data\" covering /find_by_body")
+def _body_price_index(engine, car_table):
+    _covering_index(engine, car_table, "ix_car_data_body_price",
+                    ("model", "myear", "variant", "km", "fuel", "state", "transmission", "Length", "Width", "image_url"))
+
+
+def parse_measure(values, units):
+    """ Float Series from Text measurements: "1,497", "3995 mm", "1.2 m", "1500-2500rpm" (range -> midpoint).
+    Values with an unknown unit or no number become NaN. Vectorized: one regex pass per chunk. """
+    cleaned = values.astype("string").str.lower().str.replace(",", "", regex=False)
+    parts = cleaned.str.extract(MEASURE_PATTERN)
+    low, high = pd.to_numeric(parts[0], errors="coerce"), pd.to_numeric(parts[1], errors="coerce")
+    value = low.where(high.isna(), (low + high) / 2)
+    return (value * parts[2].fillna("").map(units)).astype(float)
+
+
+def parse_value(value, units):
+    """ parse_measure for one value (None instead of NaN). """
+    match = _MEASURE.search(str(value).lower().replace(",", "")) if value is not None else None
+    scale = units.get(match.group(3)) if match else None
+    if scale is None: return None
+    low, high = float(match.group(1)), match.group(2)
+    return (low if high is None else (low + float(high)) / 2) * scale
+
+
+def dimension(typed_value, text_value, name):
+    """ A typed dimension as served: the backfilled copy, else its Text parsed on read (rows imported since the last
+    backfill have NULL typed columns until `--backfill` runs). name: the Text column ("Length"). """
+    return typed_value if typed_value is not None else parse_value(text_value, DIMENSION_COLUMNS[name][1])
+
+
+def backfill_dimensions(engine, car_table, chunk_rows=BACKFILL_CHUNK_ROWS, only_missing=True):
+    """ Parses the Text dimension columns into their typed copies in chunks of chunk_rows, one short UPDATE
+    transaction per chunk (row locks only, never the table). PostgreSQL streams the rows through a server-side
+    cursor on one connection and writes on another; SQLite (one writer) reads keyset pages instead.
+    only_missing: just rows whose typed columns are all NULL (new rows). Returns the number of rows updated. """
+    c = car_table.c
+    sources = [c[name] for name in DIMENSION_COLUMNS]
+    targets = [c[typed] for typed, _ in DIMENSION_COLUMNS.values()]
+    statement = select(c.ID, *sources).order_by(c.ID)
+    if only_missing: statement = statement.where(*[target.is_(None) for target in targets], or_(*[source.isnot(None) for source in sources]))
+    write = update(car_table).where(c.ID == bindparam("_id"))  # executemany: SET columns come from the parameter keys
+
+    def chunks():
+        if engine.dialect.name == "sqlite":
+            last_id = None
+            while True:
+                with engine.connect() as conn:
+                    rows = conn.execute((statement if last_id is None else statement.where(c.ID > last_id)).limit(chunk_rows)).all()
+                if not rows: return
+                last_id = rows[-1][0]
+                yield rows
+        else:
+            with engine.connect() as conn:
+                result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(statement)
+                yield from result.partitions()
+
+    done, start = 0, time.perf_counter()
+    for rows in chunks():
+        frame = pd.DataFrame.from_records(rows, columns=["ID"] + list(DIMENSION_COLUMNS))
+        params = pd.DataFrame({"_id": frame["ID"]})
+        for name, (typed, units) in DIMENSION_COLUMNS.items():
+            params[typed] = parse_measure(frame[name], units)
+        params = params.astype(object).where(params.notna(), None)
+        params["_id"] = frame["ID"].astype(np.int64).tolist()
+        with engine.begin() as conn:
+            conn.execute(write, params.to_dict("records"))
+        done += len(rows)
+        print(f"  {done:,} rows backfilled ({done / (time.perf_counter() - start):,.0f} rows/s)")
+    return done
+
+
+@migration("0002_car_data_typed_dimensions", "Float copies of the Text dimension columns of \"car data\", backfilled")
+def _typed_dimensions(engine, car_table):
+    preparer = engine.dialect.identifier_preparer
+    table = preparer.format_table(car_table)
+    existing = {column["name"] for column in inspect(engine).get_columns(car_table.name, schema=car_table.schema)}
+    with _autocommit(engine) as conn:
+        # Nullable, no default: a catalog-only change; lock_timeout keeps the brief exclusive lock from queueing
+        # behind a long transaction (and blocking every query queued after it)
+        if engine.dialect.name == "postgresql": conn.execute(text("SET lock_timeout = '5s'"))
+        for typed, _ in DIMENSION_COLUMNS.values():
+            if typed not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {preparer.quote(typed)} DOUBLE PRECISION"))
+    backfill_dimensions(engine, car_table, only_missing=False)
+
+
+@migration("0003_car_data_body_price_index_typed", "Covering /find_by_body index with the typed length/width")
+def _body_price_index_typed(engine, car_table):
+    _covering_index(engine, car_table, BODY_PRICE_INDEX, BODY_PRICE_COVERED, replaces="ix_car_data_body_price")
+
+
+@migration("0004_predictions_model_version", "predictions.model_version: the model version that served each row")
+def _predictions_model_version(engine, car_table):
+    # predictions shares the API's metadata with "car data"; a table created before model_registry.py lacks it
+    predictions = car_table.metadata.tables["predictions"]
+    if not inspect(engine).has_table(predictions.name, schema=predictions.schema): return
+    existing = {column["name"] for column in inspect(engine).get_columns(predictions.name, schema=predictions.schema)}
+    if "model_version" in existing: return
+    preparer = engine.dialect.identifier_preparer
+    with _autocommit(engine) as conn:
+        if engine.dialect.name == "postgresql": conn.execute(text("SET lock_timeout = '5s'"))
+        conn.execute(text(f"ALTER TABLE {preparer.format_table(predictions)} ADD COLUMN model_version VARCHAR(64)"))
+
+
+# === RUNNER =======================================================
+
+def applied(engine):
+    """ {migration id: applied_at} of the migrations already recorded. """
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return dict(conn.execute(select(schema_migrations.c.id, schema_migrations.c.applied_at)).all())
+
+
+def pending(engine):
+    """ Ids of the migrations not applied yet, in order (read-only: creates nothing). """
+    if not inspect(engine).has_table(schema_migrations.name): return [migration_id for migration_id, _, _ in MIGRATIONS]
+    with engine.connect() as conn:
+        done = set(conn.execute(select(schema_migrations.c.id)).scalars())
+    return [migration_id for migration_id, _, _ in MIGRATIONS if migration_id not in done]
+
+
+def upgrade(engine, car_table, only=None):
+    """ Applies the pending migrations in order (or just `only`); returns the ids applied. """
+    done = applied(engine)
+    ran = []
+    for migration_id, description, fn in MIGRATIONS:
+        if migration_id in done or (only is not None and migration_id != only): continue
+        print(f"--- Applying {migration_id}: {description} ---")
+        start = time.perf_counter()
+        fn(engine, car_table)
+        with engine.begin() as conn:
+            conn.execute(insert(schema_migrations).values(id=migration_id, description=description, applied_at=time.time()))
+        print(f"--- {migration_id} applied in {time.perf_counter() - start:.1f}s ---")
+        ran.append(migration_id)
+    if not ran: print("--- Schema is up to date ---")
+    return ran
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply schema migrations to "car data"')
+    parser.add_argument("--database-uri", default=None, help="default: DATABASE_URI (app.py)")
+    parser.add_argument("--status", action="store_true", help="list applied / pending migrations and exit")
+    parser.add_argument("--only", default=None, help="apply just this migration id")
+    parser.add_argument("--backfill", action="store_true", help="parse the dimensions of rows whose typed columns are empty")
+    parser.add_argument("--chunk-rows", type=int, default=BACKFILL_CHUNK_ROWS, help="rows per backfill UPDATE batch")
+    args = parser.parse_args(argv)
+
+    import app as api
+    engine = create_engine(args.database_uri or api.DATABASE_URI)
+    if args.status:
+        done = applied(engine)
+        for migration_id, description, _ in MIGRATIONS:
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(done[migration_id])) if migration_id in done else "pending"
+            print(f"  {migration_id:<40} {when:<17} {description}")
+        return
+    if args.backfill:
+        print(f"--- Backfilled {backfill_dimensions(engine, api.CarInfo.__table__, args.chunk_rows):,} rows ---")
+        return
+    upgrade(engine, api.CarInfo.__table__, args.only)
+
+
+if __name__ == "__main__":
+    main()
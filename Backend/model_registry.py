@@ -0,0 +1,383 @@
+# --- Model Registry: versioned models, hot swap and shadow scoring ---
+# Trained models are registered in MODEL_REGISTRY_DIR, one directory per version:
+#   <registry>/<version>/manifest.json   version, created_at, source, fingerprint, notes, metrics
+#   <registry>/<version>/model/          TabularModel checkpoint (the saved_car_model_log_v1 layout)
+#   <registry>/<version>/export/         export_model.py / quantize_model.py artifact (MODEL_SERVING_MODE=exported)
+#   <registry>/CURRENT                   the version /predict serves
+#   <registry>/SHADOW                    {"version", "fraction"}: a candidate also scored on sampled /predict traffic
+# A version is copied under a temporary name and renamed into place, and the pointer files are replaced with
+# os.replace, so a reader never sees half a version or half a pointer.
+# Every API worker runs a ModelWatcher thread that polls the pointers. A new CURRENT is loaded and warmed on that
+# thread while requests keep using the old model, then swapped in with one assignment (no restart, no cold first
+# request). A SHADOW version is loaded the same way; ShadowScorer re-scores a sampled fraction of /predict
+# requests with it on its own thread, after the response was computed, and logs both prices (logger
+# "carify.shadow", /model_registry/stats). Promoting the shadow version reuses its already warm model.
+#
+# Usage:
+#   python model_registry.py register saved_car_model_log_v1 --export saved_car_model_log_v1_export --version v1
+#   python model_registry.py list
+#   python model_registry.py promote v2                   # workers swap within MODEL_REGISTRY_POLL_SECONDS
+#   python model_registry.py shadow v3 --fraction 0.05    # also score 5% of /predict requests with v3
+#   python model_registry.py shadow --off
+import os
+import re
+import json
+import time
+import queue
+import random
+import shutil
+import logging
+import argparse
+import threading
+import collections
+
+import numpy as np
+
+from prediction_cache import model_fingerprint
+
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "model_registry")
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+SHADOW_FILE = "SHADOW"
+CHECKPOINT_DIR = "model"
+EXPORT_DIR = "export"
+FAILED_RETRY_SECONDS = 300.0  # a version that failed to load is not retried on every poll
+_VERSION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")  # fits predictions.model_version
+
+logger = logging.getLogger("carify.registry")
+shadow_logger = logging.getLogger("carify.shadow")
+
+
+# === REGISTRY FILES ===============================================
+
+def _write_atomic(path, content):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f: f.write(content)
+    os.replace(tmp, path)
+
+
+def read_manifest(registry_dir, version):
+    with open(os.path.join(registry_dir, version, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def list_versions(registry_dir):
+    """ Manifests of every registered version, oldest first. """
+    if not os.path.isdir(registry_dir): return []
+    manifests = [read_manifest(registry_dir, name) for name in os.listdir(registry_dir)
+                 if not name.startswith(".") and os.path.isfile(os.path.join(registry_dir, name, MANIFEST_FILE))]
+    return sorted(manifests, key=lambda manifest: manifest["created_at"])
+
+
+def version_path(registry_dir, version, exported=False):
+    """ Model directory of a version: its checkpoint, or its export artifact. """
+    return os.path.join(registry_dir, version, EXPORT_DIR if exported else CHECKPOINT_DIR)
+
+
+def register(registry_dir, checkpoint, version=None, export=None, notes=None, metrics=None):
+    """ Copies a trained model (and optionally its export) into the registry as a new version; returns its manifest. """
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    if not _VERSION_NAME.match(version): raise ValueError(f"Invalid version name {version!r}")
+    final = os.path.join(registry_dir, version)
+    if os.path.exists(final): raise ValueError(f"Version {version!r} already exists in {registry_dir}")
+    if not os.path.isdir(checkpoint): raise FileNotFoundError(f"Model path '{checkpoint}' not found")
+    os.makedirs(registry_dir, exist_ok=True)
+    staging = os.path.join(registry_dir, f".{version}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(checkpoint, os.path.join(staging, CHECKPOINT_DIR))
+    if export: shutil.copytree(export, os.path.join(staging, EXPORT_DIR))
+    manifest = {"version": version, "created_at": time.time(), "source": os.path.abspath(checkpoint),
+                "fingerprint": model_fingerprint(os.path.join(staging, CHECKPOINT_DIR)), "export": bool(export),
+                "notes": notes, "metrics": metrics or {}}
+    _write_atomic(os.path.join(staging, MANIFEST_FILE), json.dumps(manifest, indent=2))
+    os.rename(staging, final)
+    return manifest
+
+
+def current_version(registry_dir):
+    """ Version named by CURRENT, or None when no version was promoted (the API then serves MODEL_PATH). """
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE)) as f: return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def promote(registry_dir, version):
+    """ Makes `version` the served one; a shadow run of that version ends (it is now compared with nothing). """
+    read_manifest(registry_dir, version)  # must be registered
+    _write_atomic(os.path.join(registry_dir, CURRENT_FILE), version + "\n")
+    shadowed = shadow_config(registry_dir)
+    if shadowed is not None and shadowed[0] == version: set_shadow(registry_dir, None)
+
+
+def shadow_config(registry_dir):
+    """ (version, fraction) of the shadow candidate, or None. """
+    try:
+        with open(os.path.join(registry_dir, SHADOW_FILE)) as f: config = json.load(f)
+    except FileNotFoundError:
+        return None
+    return config["version"], float(config["fraction"])
+
+
+def set_shadow(registry_dir, version, fraction=0.05):
+    """ Starts shadow scoring with `version`, or stops it (version None). """
+    path = os.path.join(registry_dir, SHADOW_FILE)
+    if version is None:
+        if os.path.exists(path): os.remove(path)
+        return
+    if not 0 < fraction <= 1: raise ValueError("fraction must be in (0, 1]")
+    read_manifest(registry_dir, version)
+    _write_atomic(path, json.dumps({"version": version, "fraction": fraction}))
+
+
+# === SERVING ======================================================
+
+class LoadedModel:
+    """ One loaded and warmed model version. The API scores through exactly one of these and replaces it with one
+    assignment, so a request never pairs the model of one version with the inference engine of another. """
+
+    def __init__(self, version, path, model, engine, engine_name, load_seconds, warmup_ms):
+        self.version = version
+        self.path = path
+        self.model = model
+        self.engine = engine  # FastInferenceEngine / ExportedInferenceEngine, or None (TabularModel.predict)
+        self.engine_name = engine_name
+        self.load_seconds = load_seconds
+        self.warmup_ms = warmup_ms
+        self.loaded_at = time.time()
+
+    def describe(self):
+        return {"version": self.version, "path": self.path, "engine": self.engine_name,
+                "load_seconds": self.load_seconds, "warmup_ms": self.warmup_ms, "loaded_at": self.loaded_at}
+
+
+class ShadowScorer:
+    """ Re-scores a sampled fraction of requests with a candidate model on a background thread and logs both prices.
+    offer() never blocks the request: a full queue drops the sample. """
+
+    def __init__(self, candidate, fraction, predict, max_queue=1000):
+        self.candidate = candidate
+        self.fraction = fraction
+        self.predict = predict  # predict(rows, loaded_model) -> array of prices
+        self.max_queue = max_queue
+        self.counters = {"sampled": 0, "scored": 0, "dropped": 0, "failed": 0}
+        self._diffs = collections.deque(maxlen=10000)  # (shadow - served) / served of the latest scored rows
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _ensure_started(self):
+        """ Starts the scoring thread lazily, and again after a fork. """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive(): return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive(): return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+            self._thread.start()
+
+    def _count(self, key, n=1):
+        with self._lock: self.counters[key] += n
+
+    def offer(self, rows, served_prices, served_version):
+        """ Samples one request (rows: what the served model scored). Returns True if it was queued. """
+        if self._stop.is_set() or random.random() >= self.fraction: return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((rows, served_prices, served_version))
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("sampled")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                rows, served_prices, served_version = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                shadow_prices = self.predict(rows, self.candidate)
+            except Exception as e:
+                self._count("failed")
+                logger.warning("Shadow scoring with %s failed: %s", self.candidate.version, e)
+                continue
+            for served, shadow in zip(served_prices, shadow_prices):
+                served, shadow = float(served), float(shadow)
+                record = {"served_version": served_version, "served_price": round(served, 2),
+                          "shadow_version": self.candidate.version, "shadow_price": round(shadow, 2)}
+                if served > 0 and np.isfinite(shadow):
+                    record["relative_diff"] = round((shadow - served) / served, 4)
+                    with self._lock: self._diffs.append(record["relative_diff"])
+                shadow_logger.info("shadow %s", json.dumps(record))
+                self._count("scored")
+
+    def close(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            diffs = np.asarray(self._diffs)
+        summary = {}
+        if len(diffs):
+            magnitude = np.abs(diffs)
+            summary = {"mean_relative_diff": round(float(diffs.mean()), 4),
+                       "mean_abs_relative_diff": round(float(magnitude.mean()), 4),
+                       "p50_abs_relative_diff": round(float(np.percentile(magnitude, 50)), 4),
+                       "p95_abs_relative_diff": round(float(np.percentile(magnitude, 95)), 4)}
+        return {"version": self.candidate.version, "fraction": self.fraction, **counters,
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0, **summary}
+
+
+class ModelWatcher:
+    """ Polls CURRENT / SHADOW and loads changed versions off the request path.
+    load(version) -> LoadedModel (loaded and warmed, raises on failure); serving() -> the LoadedModel in use;
+    activate(loaded) swaps it in; set_shadow(loaded or None, fraction) replaces the shadow candidate. """
+
+    def __init__(self, registry_dir, load, serving, activate, set_shadow, poll_seconds=30.0):
+        self.registry_dir = registry_dir
+        self.load = load
+        self.serving = serving
+        self.activate = activate
+        self.set_shadow = set_shadow
+        self.poll_seconds = poll_seconds
+        self.counters = {"checks": 0, "swaps": 0, "shadow_loads": 0, "load_failures": 0}
+        self.last_error = None
+        self._shadow = None  # (LoadedModel, fraction) of the running shadow candidate
+        self._failed = {}  # version -> monotonic time of its failed load
+        self._check_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def _load(self, version, force):
+        failed_at = self._failed.get(version)
+        if not force and failed_at is not None and time.monotonic() - failed_at < FAILED_RETRY_SECONDS: return None
+        try:
+            loaded = self.load(version)
+        except Exception as e:
+            self._failed[version] = time.monotonic()
+            self.counters["load_failures"] += 1
+            self.last_error = f"{version}: {e}"
+            logger.error("Model version %s not loaded, keeping the current one: %s", version, e)
+            return None
+        self._failed.pop(version, None)
+        return loaded
+
+    def check(self, force=False):
+        """ One poll: swaps in a new CURRENT and (re)loads a changed SHADOW. force retries failed versions now.
+        Returns the list of actions taken. """
+        with self._check_lock:
+            self.counters["checks"] += 1
+            actions = []
+            target = current_version(self.registry_dir)
+            serving = self.serving()
+            if target is not None and (serving is None or serving.version != target):
+                shadow = self._shadow[0] if self._shadow is not None else None
+                loaded = shadow if shadow is not None and shadow.version == target else self._load(target, force)
+                if loaded is not None:
+                    self.activate(loaded)
+                    self.counters["swaps"] += 1
+                    actions.append(f"serving {target}")
+
+            try:
+                config = shadow_config(self.registry_dir)
+            except (ValueError, KeyError) as e:
+                config = None
+                self.last_error = f"{SHADOW_FILE}: {e}"
+            serving = self.serving()
+            if config is not None and serving is not None and config[0] == serving.version: config = None  # itself
+            if config is None:
+                if self._shadow is not None:
+                    self.set_shadow(None, 0.0)
+                    self._shadow = None
+                    actions.append("shadow off")
+            elif self._shadow is None or (self._shadow[0].version, self._shadow[1]) != config:
+                version, fraction = config
+                loaded = self._shadow[0] if self._shadow is not None and self._shadow[0].version == version else None
+                loaded = loaded or self._load(version, force)
+                if loaded is not None:
+                    self.set_shadow(loaded, fraction)
+                    self._shadow = (loaded, fraction)
+                    self.counters["shadow_loads"] += 1
+                    actions.append(f"shadow {version} at {fraction:g}")
+            return actions
+
+    def start(self):
+        """ Starts the polling thread once per process (again after a fork: threads do not survive it). """
+        if self.poll_seconds <= 0 or self._pid == os.getpid(): return
+        with self._start_lock:
+            if self._pid == os.getpid(): return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="model-watcher", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.check()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("Model registry check failed: %s", e)
+
+    def stats(self):
+        serving = self.serving()
+        return {"registry_dir": self.registry_dir, "current": current_version(self.registry_dir),
+                "serving": serving.describe() if serving is not None else None,
+                "shadow": self._shadow[0].describe() if self._shadow is not None else None,
+                "poll_seconds": self.poll_seconds, **self.counters, "last_error": self.last_error}
+
+
+# === CLI ==========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Register, promote and shadow model versions")
+    parser.add_argument("--registry-dir", default=MODEL_REGISTRY_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("register", help="copy a trained model into the registry as a new version")
+    add.add_argument("checkpoint", help="TabularModel checkpoint directory (saved_car_model_log_v1 layout)")
+    add.add_argument("--export", default=None, help="export_model.py artifact directory of the same model")
+    add.add_argument("--version", default=None, help="default: a timestamp")
+    add.add_argument("--notes", default=None)
+    add.add_argument("--promote", action="store_true", help="make it the served version right away")
+    commands.add_parser("list", help="registered versions")
+    promote_cmd = commands.add_parser("promote", help="serve this version (workers hot-swap to it)")
+    promote_cmd.add_argument("version")
+    shadow = commands.add_parser("shadow", help="score sampled /predict traffic with a candidate version too")
+    shadow.add_argument("version", nargs="?")
+    shadow.add_argument("--fraction", type=float, default=0.05)
+    shadow.add_argument("--off", action="store_true")
+    args = parser.parse_args(argv)
+
+    registry_dir = args.registry_dir
+    if args.command == "register":
+        manifest = register(registry_dir, args.checkpoint, args.version, args.export, args.notes)
+        print(f"--- Registered {manifest['version']} (fingerprint {manifest['fingerprint']}) ---")
+        if args.promote:
+            promote(registry_dir, manifest["version"])
+            print(f"--- {manifest['version']} is now current ---")
+    elif args.command == "list":
+        current, shadowed = current_version(registry_dir), shadow_config(registry_dir)
+        for manifest in list_versions(registry_dir):
+            marks = ["current"] if manifest["version"] == current else []
+            if shadowed and manifest["version"] == shadowed[0]: marks.append(f"shadow {shadowed[1]:g}")
+            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(manifest["created_at"]))
+            print(f"  {manifest['version']:<24} {created}  {'export' if manifest['export'] else '      '}  "
+                  f"{', '.join(marks):<16} {manifest.get('notes') or ''}")
+    elif args.command == "promote":
+        promote(registry_dir, args.version)
+        print(f"--- {args.version} is now current ---")
+    elif args.off or args.version is None:
+        set_shadow(registry_dir, None)
+        print("--- Shadow scoring off ---")
+    else:
+        set_shadow(registry_dir, args.version, args.fraction)
+        print(f"--- Shadow scoring {args.version} on {args.fraction:.0%} of /predict requests ---")
+
+
+if __name__ == "__main__":
+    main()
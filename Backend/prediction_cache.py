@@ -0,0 +1,131 @@
+# --- Prediction Result Cache ---
+# In-process LRU + TTL cache for /predict responses, optionally backed by a shared Redis (or Redis-compatible
+# stand-in) so several workers reuse each other's results. Keys are built from the canonicalized model input
+# (cleaned names, imputed blanks, rounded numbers) plus a fingerprint of the model directory, taken once when the
+# cache is created. A cache belongs to one loaded model (app.py creates a new one on every model swap), so a new or
+# retrained model never serves stale prices: its shared entries simply stop matching.
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("carify.prediction_cache")
+
+
+def model_fingerprint(path):
+    """ Short hash over (relative path, size, mtime) of every file under path; changes when the model changes. """
+    entries = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            try:
+                stat = os.stat(full)
+            except OSError:
+                continue
+            entries.append((os.path.relpath(full, path), stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(json.dumps(sorted(entries)).encode()).hexdigest()[:16]
+
+
+def canonical_key(row, categorical_cols, numerical_cols, round_digits=2):
+    """ Canonical form of one model-input row (a mapping of cleaned column name -> imputed value). """
+    parts = [str(row[col]).strip() for col in categorical_cols]
+    parts += [round(float(row[col]), round_digits) for col in numerical_cols]
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+
+class RedisCacheBackend:
+    """ Shared second-level cache. Values are JSON; expiry is delegated to Redis (SETEX). """
+
+    def __init__(self, url, prefix="carprice:predict:"):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.2)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, max(int(ttl), 1), json.dumps(value))
+
+
+class PredictionCache:
+    """ Thread-safe LRU with per-entry TTL, optional shared backend and hit/miss counters. """
+
+    def __init__(self, max_entries=4096, ttl=600.0, model_path=None, shared_backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.model_path = model_path
+        self.shared_backend = shared_backend
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._fingerprint = model_fingerprint(model_path) if model_path else ""
+        self.counters = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                         "shared_errors": 0}
+
+    def make_key(self, row, categorical_cols, numerical_cols, round_digits=2):
+        return f"{self._fingerprint}:{canonical_key(row, categorical_cols, numerical_cols, round_digits)}"
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return value
+                del self._entries[key]
+                self.counters["expirations"] += 1
+
+        if self.shared_backend is not None:
+            try:
+                value = self.shared_backend.get(key)
+            except Exception as e:
+                value = None
+                with self._lock: self.counters["shared_errors"] += 1
+                logger.warning("Shared prediction cache read failed: %s", e)
+            if value is not None:
+                self._store_local(key, value)
+                with self._lock: self.counters["shared_hits"] += 1
+                return value
+
+        with self._lock: self.counters["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        self._store_local(key, value)
+        if self.shared_backend is not None:
+            try:
+                self.shared_backend.set(key, value, self.ttl)
+            except Exception as e:
+                with self._lock: self.counters["shared_errors"] += 1
+                logger.warning("Shared prediction cache write failed: %s", e)
+
+    def _store_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock: self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["shared_hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hit_ratio": round((self.counters["hits"] + self.counters["shared_hits"]) / lookups, 4) if lookups else None,
+                "model_fingerprint": self._fingerprint,
+                "shared_backend": type(self.shared_backend).__name__ if self.shared_backend is not None else None,
+            }
@@ -0,0 +1,130 @@
+# --- Write-Behind PredictionLog Writer ---
+# Takes the predictions-table INSERT + commit off the request path: handlers enqueue plain dicts on a bounded
+# in-memory queue and a background thread flushes them as one multi-row INSERT (executemany, which
+# SQLAlchemy 2.0 sends to Postgres as batched multi-VALUES statements) every `flush_rows` rows or
+# `flush_interval_ms`, whichever comes first.
+# Backpressure: a full queue blocks the producer for at most `block_timeout` seconds, then the row is dropped
+# and counted. close() drains everything still queued (registered with atexit by app.py).
+import os
+import time
+import queue
+import logging
+import threading
+
+from sqlalchemy import insert
+
+logger = logging.getLogger("carify.prediction_logger")
+
+_WAKE = object()  # queued by close() so the flusher does not sit out the rest of its interval in get()
+
+
+class PredictionLogWriter:
+    """ Bounded queue + background flusher for PredictionLog rows. """
+
+    def __init__(self, session_factory, table_model, max_queue=10000, flush_rows=500, flush_interval_ms=200,
+                 block_timeout=0.01):
+        self.session_factory = session_factory
+        self.table_model = table_model
+        self.max_queue = max_queue
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.block_timeout = block_timeout
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+        self._counter_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._stop = None
+        self._thread = None
+        self._last_flush_seconds = None
+
+    def _ensure_started(self):
+        """ Starts the flusher lazily, and again after a fork (threads do not survive into gunicorn workers). """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive(): return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive(): return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="prediction-log-writer", daemon=True)
+            self._thread.start()
+
+    def _count(self, key, n=1):
+        with self._counter_lock: self.counters[key] += n
+
+    def submit(self, row):
+        """ Enqueues one row (dict of PredictionLog columns). Returns False if it was dropped. """
+        self._ensure_started()
+        try:
+            if self.block_timeout > 0: self._queue.put(row, timeout=self.block_timeout)
+            else: self._queue.put_nowait(row)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def submit_many(self, rows):
+        return sum(1 for row in rows if self.submit(row))
+
+    def _run(self):
+        pending = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                row = self._queue.get(timeout=timeout)
+                # Grab whatever else is already queued without waiting
+                while True:
+                    if row is not _WAKE: pending.append(row)
+                    if len(pending) >= self.flush_rows: break
+                    row = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            stopping = self._stop.is_set()
+            if pending and (len(pending) >= self.flush_rows or time.monotonic() >= deadline or stopping):
+                self._flush(pending)
+                pending = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+            if stopping and self._queue.empty() and not pending:
+                return
+
+    def _flush(self, rows):
+        start = time.perf_counter()
+        db = self.session_factory()
+        try:
+            db.execute(insert(self.table_model), rows)
+            db.commit()
+            self._count("written", len(rows))
+        except Exception as db_error:
+            db.rollback()
+            self._count("failed", len(rows))
+            logger.error("Write-behind logging error (%d rows lost): %s", len(rows), db_error)
+        finally:
+            db.close()
+            self._count("flushes")
+            self._last_flush_seconds = time.perf_counter() - start
+
+    def close(self, timeout=10.0):
+        """ Signals the flusher to stop and waits (up to `timeout` seconds) until the queue is drained. """
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive(): return
+        logger.info("Draining prediction log queue (%d rows)...", self._queue.qsize())
+        self._stop.set()
+        try: self._queue.put_nowait(_WAKE)
+        except queue.Full: pass  # a full queue means the flusher is not waiting in get()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("Prediction log drain timed out with %d rows still queued", self._queue.qsize())
+
+    def stats(self):
+        with self._counter_lock: counters = dict(self.counters)
+        return {
+            **counters,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "flush_rows": self.flush_rows,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "last_flush_ms": round(self._last_flush_seconds * 1000, 2) if self._last_flush_seconds is not None else None,
+        }
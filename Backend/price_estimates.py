@@ -0,0 +1,277 @@
+# --- Precomputed Price Estimates + Deal Scores ---
+# Listings in /find_by_body and in /predict's similar cars say nothing about whether they are cheap for what they are.
+# This job stores, for every "car data" row, the model's predicted_price and its deal_ratio (listed_price /
+# predicted_price: below 1 = listed under the model's estimate) in the car_price_estimates table:
+#   * incremental: each pass reads the inventory in ID pages and compares it with the stored rows. Only cars that
+#     are new, whose model inputs changed (input_hash) or that were scored by another model version get a forward
+#     pass; a changed listed_price alone just recomputes deal_ratio. Estimates of deleted cars are removed;
+#   * model_version is the served registry version (model_registry.py), or the fingerprint of MODEL_PATH when
+#     nothing was promoted, so a new model is rolled through the whole table on the next pass. With --every the job
+#     notices a newly promoted model and reloads it first.
+# The API keeps car id -> (estimated price, deal ratio) in memory (PriceEstimateIndex): every listing it returns
+# gets estimated_price + deal_ratio, and /find_by_body can rank or filter by deal ("sort": "deal",
+# "max_deal_ratio") with no forward pass per listing. deal_ratio is indexed for the SQL fallback.
+#
+# Usage:
+#   python price_estimates.py                # one incremental pass
+#   python price_estimates.py --every 600    # keep running: one pass every 10 minutes
+#   python price_estimates.py --full         # rescore every car
+#   python price_estimates.py --self-test    # offline: SQLite + synthetic inventory
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, delete, insert
+
+from similar_cars_index import RefreshingIndex
+
+PAGE_ROWS = 5000
+_UNSCORED = (None, None)
+
+
+def deal_ratio(listed_price, predicted_price):
+    """ listed / predicted, or None when either is missing or not positive. """
+    if listed_price is None or predicted_price is None or pd.isna(predicted_price): return None
+    if listed_price <= 0 or predicted_price <= 0: return None
+    return round(float(listed_price) / float(predicted_price), 4)
+
+
+def input_hashes(frame):
+    """ 16 hex digit hash of each row's model inputs as stored, to spot cars whose features changed. """
+    return [f"{h:016x}" for h in pd.util.hash_pandas_object(frame.astype(str), index=False).to_numpy()]
+
+
+class PriceEstimateJob:
+    """ Keeps the estimate table in step with "car data" and the model currently loaded. """
+
+    def __init__(self, session_factory, car_model, estimate_model, schema, predict, model_version, page_rows=PAGE_ROWS):
+        self.session_factory = session_factory
+        self.car_model = car_model
+        self.estimate_model = estimate_model
+        self.schema = schema
+        self.predict = predict  # ValidatedBatch -> prices (app._predict_prices)
+        self.model_version = model_version  # () -> version of the loaded model
+        self.page_rows = page_rows
+        by_clean_name = {column.name.replace(' ', '_').lower(): column for column in car_model.__table__.columns}
+        missing = [col for col in schema.columns if col not in by_clean_name]
+        if missing: raise ValueError(f"Model inputs missing from {car_model.__table__.name}: {missing}")
+        self.input_columns = [by_clean_name[col] for col in schema.columns]
+
+    def _estimate_row(self, car_id, listed_price, predicted_price, version, input_hash):
+        predicted_price = None if predicted_price is None or pd.isna(predicted_price) else float(predicted_price)
+        return {"car_id": int(car_id), "listed_price": listed_price, "predicted_price": predicted_price,
+                "deal_ratio": deal_ratio(listed_price, predicted_price), "model_version": version,
+                "input_hash": input_hash, "scored_at": time.time()}
+
+    def _page(self, page, stored, version, full, stats):
+        """ New estimate rows for one page of cars (only the ones that changed). """
+        hashes = input_hashes(page[self.schema.columns])
+        listed_prices = [None if pd.isna(price) else int(price) for price in page["listed_price"]]
+        out, to_score = [], []
+        for i, (car_id, input_hash) in enumerate(zip(page["ID"], hashes)):
+            old = stored.get(car_id)
+            if full or old is None or old.input_hash != input_hash or old.model_version != version:
+                to_score.append(i)
+            elif old.listed_price != listed_prices[i]:
+                out.append(self._estimate_row(car_id, listed_prices[i], old.predicted_price, version, input_hash))
+                stats["repriced"] += 1
+            else:
+                stats["unchanged"] += 1
+        if not to_score: return out
+
+        # Rows with unusable inputs are stored with a null estimate, so they are retried only when they change
+        batch = self.schema.validate_frame(page.iloc[to_score])
+        prices = np.full(len(to_score), np.nan)
+        if batch.valid_positions: prices[np.asarray(batch.valid_positions)] = self.predict(batch)
+        stats["scored"] += len(batch.valid_positions)
+        stats["invalid"] += len(to_score) - len(batch.valid_positions)
+        for i, price in zip(to_score, prices):
+            out.append(self._estimate_row(page["ID"].iat[i], listed_prices[i], price, version, hashes[i]))
+        return out
+
+    def run(self, full=False):
+        """ One pass over the inventory; returns counts of scored / repriced / unchanged / invalid / removed cars. """
+        version = self.model_version()
+        if not version: raise RuntimeError("Model not loaded")
+        table = self.estimate_model.__table__
+        car = self.car_model
+        stats = {"cars": 0, "scored": 0, "repriced": 0, "unchanged": 0, "invalid": 0, "removed": 0}
+        start = time.perf_counter()
+        print(f"--- Price estimates pass (model {version}{', full rescore' if full else ''}) ---")
+
+        statement = select(car.ID, car.listed_price, *self.input_columns).order_by(car.ID).limit(self.page_rows)
+        names = ["ID", "listed_price"] + list(self.schema.columns)
+        last_id = None
+        db = self.session_factory()
+        try:
+            table.create(db.get_bind(), checkfirst=True)
+            while True:
+                # Keyset pages, each written in its own transaction (no read cursor held open across writes)
+                rows = db.execute(statement if last_id is None else statement.where(car.ID > last_id)).all()
+                if not rows: break
+                first_id, last_id = rows[0][0], rows[-1][0]
+                stored = {r.car_id: r for r in db.execute(select(table).where(table.c.car_id.between(first_id, last_id)))}
+                out = self._page(pd.DataFrame.from_records(rows, columns=names), stored, version, full, stats)
+                if out:
+                    db.execute(delete(table).where(table.c.car_id.in_([row["car_id"] for row in out])))
+                    db.execute(insert(table), out)
+                db.commit()
+                stats["cars"] += len(rows)
+                print(f"  [{stats['cars']:,} cars] {stats['scored']:,} scored, {stats['repriced']:,} repriced "
+                      f"({stats['cars'] / (time.perf_counter() - start):,.0f} cars/s)")
+            stats["removed"] = db.execute(delete(table).where(table.c.car_id.not_in(select(car.ID)))).rowcount
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        stats["seconds"] = round(time.perf_counter() - start, 2)
+        print(f"--- Price estimates done: {stats} ---")
+        return stats
+
+
+class _EstimateSnapshot:
+    """ car id -> (estimated price, deal ratio). """
+
+    def __init__(self, rows):
+        self.by_car = {car_id: (predicted_price, ratio) for car_id, predicted_price, ratio in rows}
+        self.row_count = len(self.by_car)
+        self.scored_count = sum(1 for _, ratio in self.by_car.values() if ratio is not None)
+        self.loaded_at = time.time()
+
+
+class PriceEstimateIndex(RefreshingIndex):
+    """ In-memory copy of car_price_estimates used to add deal scores to listings and to rank them by deal. """
+
+    name = "price estimate index"
+    unit = "estimates"
+
+    def __init__(self, session_factory, car_model, estimate_model, refresh_seconds=300.0):
+        super().__init__(session_factory, car_model, refresh_seconds)
+        self.estimate_model = estimate_model
+
+    def _build(self, db):
+        table = self.estimate_model.__table__
+        try:
+            rows = db.execute(select(table.c.car_id, table.c.predicted_price, table.c.deal_ratio)
+                              .execution_options(yield_per=10000)).all()
+        except Exception:
+            db.rollback()  # table does not exist until price_estimates.py has run once
+            rows = []
+        return _EstimateSnapshot(rows)
+
+    def _snapshot_stats(self, snapshot):
+        return {"with_deal_ratio": snapshot.scored_count}
+
+    def annotate(self, cars, sort_by_deal=False):
+        """ Copies of the car dicts with estimated_price and deal_ratio (None until scored); sort_by_deal puts the
+        lowest ratio first and unscored cars last. """
+        self.maybe_refresh()
+        by_car = self._snapshot.by_car
+        out = []
+        for car in cars:
+            estimated_price, ratio = by_car.get(car.get("id"), _UNSCORED)
+            out.append(dict(car, estimated_price=estimated_price, deal_ratio=ratio))
+        if sort_by_deal: out.sort(key=lambda car: (car["deal_ratio"] is None, car["deal_ratio"] or 0.0))
+        return out
+
+    def ranking(self, predicted_price, by_deal, max_deal_ratio=None):
+        """ key(car id, listed price) for SimilarCarsIndex.find_ranked: the deal ratio (by_deal) or the distance to the
+        predicted price. Cars without a deal ratio, or above max_deal_ratio, get None (left out). """
+        self.maybe_refresh()
+        by_car = self._snapshot.by_car
+
+        def key(car_id, listed_price):
+            ratio = by_car.get(car_id, _UNSCORED)[1]
+            if ratio is None or (max_deal_ratio is not None and ratio > max_deal_ratio): return None
+            return ratio if by_deal else abs(listed_price - predicted_price)
+        return key
+
+
+# === OFFLINE SELF-TEST ============================================
+
+def self_test(n_rows=5000):
+    import os
+    import tempfile
+    from sqlalchemy import create_engine, update, func
+    from sqlalchemy.orm import sessionmaker
+    from synthetic_data import seed_table
+    import app as api
+
+    if not api.load_model(): raise SystemExit(f"!!! Model not loaded: {api.model_status['error']} !!!")
+    work_dir = tempfile.mkdtemp(prefix="price_estimates_")
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'cars.db')}")
+    seed_table(engine, api.CarInfo.__table__, n_rows)
+    Session = sessionmaker(bind=engine)
+    version = {"current": api.model_status["version"]}
+    job = PriceEstimateJob(Session, api.CarInfo, api.CarPriceEstimate, api.INPUT_SCHEMA, api._predict_prices,
+                           lambda: version["current"], page_rows=1000)
+    cars = api.CarInfo.__table__
+
+    first = job.run()
+    assert first["scored"] + first["invalid"] == n_rows, first
+    again = job.run()
+    assert again["scored"] == again["repriced"] == 0 and again["unchanged"] == n_rows, again
+
+    with engine.begin() as conn:
+        conn.execute(update(cars).where(cars.c.ID <= 10).values(km=cars.c.km + 1000))
+        conn.execute(update(cars).where(cars.c.ID.between(11, 30)).values(listed_price=cars.c.listed_price + 1))
+        conn.execute(cars.delete().where(cars.c.ID > n_rows - 5))
+    changed = job.run()
+    assert changed["scored"] + changed["invalid"] == 10 and changed["repriced"] == 20 and changed["removed"] == 5, changed
+
+    version["current"] = "retrained"
+    rolled = job.run()
+    assert rolled["scored"] + rolled["invalid"] == n_rows - 5, rolled
+
+    index = PriceEstimateIndex(Session, api.CarInfo, api.CarPriceEstimate)
+    index.load()
+    with engine.connect() as conn:
+        listed = dict(conn.execute(select(cars.c.ID, cars.c.listed_price).where(cars.c.ID <= 30)).all())
+        versions = conn.execute(select(func.count()).select_from(api.CarPriceEstimate.__table__)
+                                .where(api.CarPriceEstimate.model_version != "retrained")).scalar()
+    assert versions == 0
+    cars_out = index.annotate([{"id": car_id} for car_id in listed], sort_by_deal=True)
+    ratios = [car["deal_ratio"] for car in cars_out if car["deal_ratio"] is not None]
+    assert ratios == sorted(ratios)
+    for car in cars_out:
+        if car["deal_ratio"] is not None:
+            assert abs(car["deal_ratio"] - listed[car["id"]] / car["estimated_price"]) < 1e-3
+    print(f"--- Self-test passed: first pass {first['seconds']}s, no-op pass {again['seconds']}s, "
+          f"{index.stats()['with_deal_ratio']} cars with a deal ratio ---")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Store model price estimates and deal ratios for every car")
+    parser.add_argument("--full", action="store_true", help="rescore every car, not only new/changed ones")
+    parser.add_argument("--every", type=float, default=None, help="keep running: seconds between passes")
+    parser.add_argument("--page-rows", type=int, default=PAGE_ROWS, help="cars per read/score/write step")
+    parser.add_argument("--self-test", action="store_true", help="offline run against SQLite and synthetic cars")
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        self_test()
+        return
+    import app as api
+    if not api.init_database() or not api.load_model(): raise SystemExit(1)
+    job = PriceEstimateJob(api.SessionLocal, api.CarInfo, api.CarPriceEstimate, api.INPUT_SCHEMA, api._predict_prices,
+                           lambda: api.model_status["version"], page_rows=args.page_rows)
+    full = args.full
+    while True:
+        try:
+            job.run(full=full)
+            full = False
+        except Exception as e:
+            if args.every is None: raise
+            print(f"!!! Price estimates pass failed: {e} !!!")
+        if args.every is None: return
+        time.sleep(args.every)
+        # A newly promoted (or retrained) model: reload it, then the next pass rescores every car under its version
+        if api._served_version() != api.model_status["version"] and not api.load_model():
+            print(f"!!! Model reload failed, keeping the previous one: {api.model_status['error']} !!!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# --- Dynamic int8 quantization of the FT-Transformer, with an accuracy gate ---
+# Quantizes every nn.Linear (attention qkv/out projections, GEGLU feed-forward, head) to int8 weights with
+# dynamically quantized activations, traces it to <export-path>/model_int8.pt and compares it with the fp32
+# graph (model.pt from export_model.py) on a holdout CSV: latency, memory and MAPE of the price.
+# The verdict goes to quantization_report.json with the sha256 of the model.pt it was measured against; app.py only
+# serves EXPORT_RUNTIME=int8 when "passed" is true and that model.pt is still the one exported. Only a labelled
+# --holdout run can pass: --synthetic compares int8 with fp32 and never unlocks int8 serving.
+#
+# Usage:
+#   python export_model.py                                           # fp32 artifact first
+#   python quantize_model.py --holdout "holdout.csv" --max-mape-increase 0.5
+#   python quantize_model.py --synthetic 5000                        # no labels: int8 vs fp32 drift only
+import os
+import json
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+import psutil
+import torch
+
+from inference_engine import (
+    FeatureEncoder, load_tabular_model, sample_frame, time_call, file_sha256,
+    PREPROCESS_SPEC_FILE, TORCHSCRIPT_FILE, QUANTIZED_TORCHSCRIPT_FILE, QUANTIZATION_REPORT_FILE,
+)
+from export_model import _ExportWrapper, DEFAULT_MODEL_PATH
+
+ORIGINAL_TARGET_COL = 'listed_price'
+MIN_VALID_PRICE = 20000  # same outlier cut as model.ipynb
+
+
+def load_holdout(path, encoder):
+    """ Reads a CSV in the training-data layout and cleans it the way model.ipynb does. Returns (features, prices). """
+    try:
+        df = pd.read_csv(path)
+    except pd.errors.ParserError:
+        df = pd.read_csv(path, engine='python', on_bad_lines='skip')
+    df.columns = df.columns.str.replace(' ', '_').str.lower()
+
+    if ORIGINAL_TARGET_COL not in df.columns and f"log_{ORIGINAL_TARGET_COL}" in df.columns:
+        df[ORIGINAL_TARGET_COL] = np.expm1(df[f"log_{ORIGINAL_TARGET_COL}"])
+    df = df[df[ORIGINAL_TARGET_COL] > MIN_VALID_PRICE].copy()
+
+    if 'gear_box' in df.columns and df['gear_box'].dtype == object:
+        df['gear_box'] = df['gear_box'].astype(str).str.extract(r'(\d+)', expand=False).astype(float)
+    for col in encoder.continuous_cols:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+        df[col] = df[col].fillna(df[col].median())
+    for col in encoder.categorical_cols:
+        if df[col].isnull().any(): df[col] = df[col].fillna(df[col].mode()[0])
+        df[col] = df[col].astype(str)
+
+    return df[encoder.categorical_cols + encoder.continuous_cols].reset_index(drop=True), df[ORIGINAL_TARGET_COL].to_numpy(dtype=float)
+
+
+def _predict_prices(graph, continuous, categorical, batch_size=4096):
+    outputs = []
+    with torch.inference_mode():
+        for start in range(0, len(continuous), batch_size):
+            outputs.append(graph(
+                torch.from_numpy(continuous[start:start + batch_size]),
+                torch.from_numpy(categorical[start:start + batch_size]),
+            ).numpy())
+    # Same log -> price conversion as app.py's _predict_prices
+    return np.exp(np.concatenate(outputs).astype(np.float64))
+
+
+def _mape(predicted, actual):
+    return float(np.mean(np.abs(predicted - actual) / np.abs(actual)) * 100)
+
+
+def _load_graph_measuring_rss(path):
+    """ Loads a TorchScript file and returns (graph, resident memory it added in MB). """
+    process = psutil.Process()
+    before = process.memory_info().rss
+    graph = torch.jit.load(path, map_location="cpu")
+    graph.eval()
+    return graph, (process.memory_info().rss - before) / 2**20
+
+
+def quantize(model_path, export_path):
+    """ Builds and saves the dynamically quantized (int8 Linear) TorchScript graph. """
+    print(f"--- Loading model from {model_path}... ---")
+    tabular_model = load_tabular_model(model_path)
+    encoder = FeatureEncoder.from_datamodule(tabular_model.datamodule)
+    wrapper = _ExportWrapper(tabular_model.model.eval()).eval()
+
+    print("--- Quantizing nn.Linear layers to int8 (dynamic)... ---")
+    quantized = torch.ao.quantization.quantize_dynamic(wrapper, {torch.nn.Linear}, dtype=torch.qint8)
+
+    continuous, categorical = encoder.encode_frame(sample_frame(encoder, 64))
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, (torch.from_numpy(continuous), torch.from_numpy(categorical)), check_trace=False)
+    traced.save(os.path.join(export_path, QUANTIZED_TORCHSCRIPT_FILE))
+    print(f"--- Saved {QUANTIZED_TORCHSCRIPT_FILE} to {export_path} ---")
+
+
+def evaluate(export_path, holdout_path=None, synthetic_rows=0, max_mape_increase=0.5, repeat=200, batch_rows=256):
+    """ Compares the fp32 and int8 graphs and writes quantization_report.json. Returns the report. """
+    with open(os.path.join(export_path, PREPROCESS_SPEC_FILE)) as f:
+        encoder = FeatureEncoder.from_spec(json.load(f))
+
+    fp32_path = os.path.join(export_path, TORCHSCRIPT_FILE)
+    int8_path = os.path.join(export_path, QUANTIZED_TORCHSCRIPT_FILE)
+    fp32, fp32_rss = _load_graph_measuring_rss(fp32_path)
+    int8, int8_rss = _load_graph_measuring_rss(int8_path)
+
+    if holdout_path:
+        features, actual = load_holdout(holdout_path, encoder)
+        source = holdout_path
+    else:
+        features, actual = sample_frame(encoder, synthetic_rows), None
+        source = f"synthetic ({synthetic_rows} rows, fp32 predictions used as reference)"
+    continuous, categorical = encoder.encode_frame(features)
+    print(f"--- Evaluating on {len(features)} rows from {source} ---")
+
+    fp32_prices = _predict_prices(fp32, continuous, categorical)
+    int8_prices = _predict_prices(int8, continuous, categorical)
+    reference = actual if actual is not None else fp32_prices
+
+    def latency(graph, rows):
+        c, k = torch.from_numpy(continuous[:rows]), torch.from_numpy(categorical[:rows])
+        with torch.inference_mode():
+            return time_call(lambda: graph(c, k), repeat)
+
+    results = {}
+    for name, graph, prices, path, rss in (("fp32", fp32, fp32_prices, fp32_path, fp32_rss),
+                                           ("int8", int8, int8_prices, int8_path, int8_rss)):
+        results[name] = {
+            "mape_pct": round(_mape(prices, reference), 4),
+            "latency_1_row_ms": round(latency(graph, 1), 4),
+            f"latency_{batch_rows}_rows_ms": round(latency(graph, batch_rows), 4),
+            "file_size_mb": round(os.path.getsize(path) / 2**20, 3),
+            "load_rss_mb": round(rss, 2),
+        }
+    mape_increase = results["int8"]["mape_pct"] - results["fp32"]["mape_pct"]
+    labelled = actual is not None
+    passed = bool(labelled and mape_increase <= max_mape_increase)
+    if not labelled: reason = "no labelled holdout (synthetic drift check only); re-run with --holdout"
+    elif not passed: reason = f"MAPE +{mape_increase:.3f} pp exceeds tolerance {max_mape_increase} pp"
+    else: reason = None
+
+    report = {
+        "passed": passed,
+        "reason": reason,
+        "labelled": labelled,
+        "fp32_sha256": file_sha256(fp32_path),
+        "mape_increase_pp": round(mape_increase, 4),
+        "max_mape_increase_pp": max_mape_increase,
+        "max_abs_price_diff": float(np.max(np.abs(int8_prices - fp32_prices))),
+        "rows": len(features),
+        "source": source,
+        "evaluated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        **results,
+    }
+    with open(os.path.join(export_path, QUANTIZATION_REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=1)
+
+    print(f"  {'':<24}{'fp32':>12}{'int8':>12}")
+    for key in results["fp32"]:
+        print(f"  {key:<24}{results['fp32'][key]:>12}{results['int8'][key]:>12}")
+    verdict = ("PASSED" if passed else "FAILED") if labelled else "drift only, int8 serving stays disabled"
+    print(f"--- MAPE increase: {mape_increase:+.4f} pp (tolerance {max_mape_increase} pp) -> {verdict} ---")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a dynamic int8 model variant and gate it on holdout MAPE")
+    parser.add_argument("--model-path", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--export-path", default=None, help="export_model.py output; defaults to <model-path>_export")
+    parser.add_argument("--holdout", default=None, help="holdout CSV in the training-data layout (with listed_price)")
+    parser.add_argument("--synthetic", type=int, default=0, help="rows of synthetic input when no holdout CSV is given")
+    parser.add_argument("--max-mape-increase", type=float, default=0.5, help="allowed int8 MAPE increase, percentage points")
+    parser.add_argument("--repeat", type=int, default=200, help="timed calls per latency measurement")
+    parser.add_argument("--skip-quantize", action="store_true", help="re-evaluate an existing model_int8.pt")
+    args = parser.parse_args()
+    export_path = args.export_path or f"{os.path.normpath(args.model_path)}_export"
+
+    if not os.path.exists(os.path.join(export_path, TORCHSCRIPT_FILE)):
+        parser.error(f"{export_path}/{TORCHSCRIPT_FILE} not found; run export_model.py first")
+    if not args.holdout and args.synthetic <= 0:
+        parser.error("pass --holdout CSV (or --synthetic N for an unlabeled drift check)")
+
+    if not args.skip_quantize:
+        quantize(args.model_path, export_path)
+    report = evaluate(export_path, args.holdout, args.synthetic, args.max_mape_increase, args.repeat)
+    if report["labelled"] and not report["passed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
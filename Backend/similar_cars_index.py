@@ -0,0 +1,264 @@
+# --- In-Memory Similar-Car Index ---
+# Snapshot of the "car data" inventory used by /predict's SMART QUERY and /find_by_body, so neither hits the
+# database per request. Rows are partitioned by body and sorted by listed_price; a nearest-price top-k lookup
+# is a bisect plus an outward two-pointer walk. The three SMART QUERY tiers are answered from one walk:
+#   Tier 1  the nearest cars of that body that lie inside the +/-30% price band
+#   Tier 2  otherwise the nearest cars of that body at any price
+#   Tier 3  otherwise the first cars (by ID) that have an image
+# The snapshot is rebuilt in a background thread once it is older than `refresh_seconds` and swapped in
+# atomically; lookups never wait for a reload. If a load fails the previous snapshot keeps serving and the
+# reload is retried at most every RETRY_SECONDS.
+import sys
+import time
+import heapq
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+
+from sqlalchemy import select
+
+from keyset_pages import next_page
+from migrations import dimension
+
+# Column order of the row tuples kept in the index
+INDEX_COLUMNS = ("ID", "model", "listed_price", "myear", "fuel", "variant", "km", "state", "body",
+                 "image_url", "transmission", "length_mm", "width_mm")
+RETRY_SECONDS = 30.0
+
+logger = logging.getLogger("carify.similar_cars_index")
+
+_ID, _MODEL, _PRICE, _MYEAR, _FUEL, _VARIANT, _KM, _STATE, _BODY, _IMAGE, _TRANSMISSION, _LENGTH, _WIDTH = range(len(INDEX_COLUMNS))
+
+
+def similar_car_dict(row):
+    """ /predict similar_cars item (same keys as the SQL path). """
+    return {
+        "id": row[_ID], "model": row[_MODEL], "listed_price": row[_PRICE],
+        "myear": row[_MYEAR], "fuel": row[_FUEL], "variant": row[_VARIANT],
+        "km": row[_KM], "state": row[_STATE], "body": row[_BODY],
+        "image_url": row[_IMAGE]
+    }
+
+
+def matching_car_dict(row):
+    """ /find_by_body matching_cars item (same keys as the SQL path). """
+    return {
+        "id": row[_ID], "model": row[_MODEL], "listed_price": row[_PRICE],
+        "myear": row[_MYEAR], "variant": row[_VARIANT], "km": row[_KM],
+        "fuel": row[_FUEL], "state": row[_STATE], "body": row[_BODY],
+        "transmission": row[_TRANSMISSION], "length": row[_LENGTH], "width": row[_WIDTH],
+        "image_url": row[_IMAGE]
+    }
+
+
+def _nearest(prices, rows, target, limit, lower=None, upper=None):
+    """ Up to `limit` rows closest to `target` by price (ties prefer the cheaper car), optionally within [lower, upper]. """
+    hi = bisect_left(prices, target)
+    lo = hi - 1
+    out = []
+    while len(out) < limit:
+        take_lo = lo >= 0 and (lower is None or prices[lo] >= lower)
+        take_hi = hi < len(prices) and (upper is None or prices[hi] <= upper)
+        if not take_lo and not take_hi: break
+        if take_lo and (not take_hi or target - prices[lo] <= prices[hi] - target):
+            out.append(rows[lo]); lo -= 1
+        else:
+            out.append(rows[hi]); hi += 1
+    return out
+
+
+class _Snapshot:
+    """ Immutable view of the inventory at one point in time. """
+
+    def __init__(self, rows):
+        by_body = {}
+        self.unpriced = {}
+        self.with_image = []
+        for row in rows:
+            if row[_PRICE] is None: self.unpriced.setdefault(row[_BODY], []).append(row)
+            else: by_body.setdefault(row[_BODY], []).append(row)
+            if row[_IMAGE] is not None and len(self.with_image) < 16: self.with_image.append(row)
+
+        self.partitions = {}
+        for body, body_rows in by_body.items():
+            body_rows.sort(key=lambda r: (r[_PRICE], r[_ID]))  # (listed_price, ID): the keyset order of find_page
+            self.partitions[body] = ([r[_PRICE] for r in body_rows], body_rows)
+        self.row_count = len(rows)
+        self.loaded_at = time.time()
+        self._memory_bytes = None
+
+    def memory_bytes(self):
+        """ Approximate footprint: partition lists, row tuples and their (distinct) field objects (computed once). """
+        if self._memory_bytes is None: self._memory_bytes = self._measure()
+        return self._memory_bytes
+
+    def _measure(self):
+        seen = set()
+        total = 0
+        def add(obj):
+            nonlocal total
+            if id(obj) not in seen:
+                seen.add(id(obj)); total += sys.getsizeof(obj)
+        for prices, rows in self.partitions.values():
+            add(prices); add(rows)
+            for price in prices: add(price)
+            for row in rows:
+                add(row)
+                for value in row: add(value)
+        for rows in self.unpriced.values():
+            add(rows)
+            for row in rows:
+                add(row)
+                for value in row: add(value)
+        return total
+
+
+class RefreshingIndex:
+    """ Base for in-memory views of "car data": owns the snapshot and its throttled background reload.
+    Subclasses implement _build(session) returning a snapshot object with row_count and loaded_at. """
+
+    name = "index"
+    unit = "cars"
+
+    def __init__(self, session_factory, car_model, refresh_seconds=300.0):
+        self.session_factory = session_factory
+        self.car_model = car_model
+        self.refresh_seconds = refresh_seconds
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        self._last_attempt = 0.0
+        self.last_load_seconds = None
+        self.last_error = None
+        self.loads = 0
+        self.load_errors = 0
+
+    @property
+    def ready(self):
+        return self._snapshot is not None
+
+    def _build(self, db):
+        raise NotImplementedError
+
+    def load(self):
+        """ Builds a new snapshot from the database and swaps it in. """
+        start = time.perf_counter()
+        self._last_attempt = time.time()  # a concurrent maybe_refresh() waits RETRY_SECONDS instead of loading twice
+        db = self.session_factory()
+        try:
+            snapshot = self._build(db)
+        finally:
+            db.close()
+        self._snapshot = snapshot
+        self.loads += 1
+        self.last_load_seconds = time.perf_counter() - start
+        logger.info("%s loaded: %d %s in %.2fs", self.name.capitalize(), snapshot.row_count, self.unit, self.last_load_seconds)
+
+    def _refresh_in_background(self):
+        try:
+            self.load()
+            self.last_error = None
+        except Exception as e:
+            self.load_errors += 1
+            self.last_error = str(e)
+            logger.warning("%s refresh failed (keeping previous snapshot): %s", self.name.capitalize(), e)
+        finally:
+            with self._refresh_lock: self._refreshing = False
+
+    def maybe_refresh(self):
+        """ Starts a background reload when the snapshot is older than refresh_seconds (at most one at a time). """
+        snapshot = self._snapshot
+        now = time.time()
+        if snapshot is not None and now - snapshot.loaded_at < self.refresh_seconds: return
+        with self._refresh_lock:
+            if self._refreshing or now - self._last_attempt < RETRY_SECONDS: return
+            self._refreshing = True
+            self._last_attempt = now
+        threading.Thread(target=self._refresh_in_background, name=f"{self.name.replace(' ', '-')}-refresh", daemon=True).start()
+
+    def _snapshot_stats(self, snapshot):
+        return {}
+
+    def stats(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"ready": False, "loads": self.loads, "load_errors": self.load_errors, "last_error": self.last_error}
+        return {
+            "ready": True,
+            "rows": snapshot.row_count,
+            **self._snapshot_stats(snapshot),
+            "loaded_at": snapshot.loaded_at,
+            "staleness_seconds": round(time.time() - snapshot.loaded_at, 1),
+            "refresh_seconds": self.refresh_seconds,
+            "last_load_seconds": round(self.last_load_seconds, 3) if self.last_load_seconds is not None else None,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "last_error": self.last_error,
+        }
+
+
+class SimilarCarsIndex(RefreshingIndex):
+    """ Periodically refreshed in-memory index over CarInfo for similar-car and find-by-body lookups. """
+
+    name = "similar-car index"
+
+    def _build(self, db):
+        """ Reads the whole inventory once (ordered by ID, streamed). Length/width: the typed copies, or their Text
+        parsed for rows not backfilled yet. """
+        columns = [getattr(self.car_model, name) for name in INDEX_COLUMNS + ("Length", "Width")]
+        result = db.execute(select(*columns).order_by(self.car_model.ID).execution_options(yield_per=10000))
+        rows = []
+        for row in result:
+            length, width = dimension(row[_LENGTH], row[-2], "Length"), dimension(row[_WIDTH], row[-1], "Width")
+            rows.append(tuple(row[:_LENGTH]) + (length, width))
+        return _Snapshot(rows)
+
+    def _snapshot_stats(self, snapshot):
+        return {"body_types": len(snapshot.partitions), "memory_bytes": snapshot.memory_bytes()}
+
+    def find_similar(self, target_body, prediction_result, limit=10, band=0.3, fallback_limit=4):
+        """ SMART QUERY tiers in one pass. Returns (list of similar_cars dicts, tier number). """
+        self.maybe_refresh()
+        snapshot = self._snapshot
+        if target_body:
+            prices, rows = snapshot.partitions.get(target_body, ((), ()))
+            nearest = _nearest(prices, rows, prediction_result, limit)
+            # The band is symmetric around p, so in-band cars are a prefix of the nearest list (bounds as in SQL)
+            lower, upper = prediction_result * (1 - band), prediction_result * (1 + band)
+            in_band = [r for r in nearest if lower <= r[_PRICE] <= upper]
+            if in_band: return [similar_car_dict(r) for r in in_band], 1
+            nearest += snapshot.unpriced.get(target_body, [])[:limit - len(nearest)]
+            if nearest: return [similar_car_dict(r) for r in nearest], 2
+        return [similar_car_dict(r) for r in snapshot.with_image[:fallback_limit]], 3
+
+    def find_near_price(self, target_body, predicted_price, lower_bound, upper_bound, limit=10):
+        """ /find_by_body: cars of one body inside [lower, upper], nearest price first. """
+        self.maybe_refresh()
+        prices, rows = self._snapshot.partitions.get(target_body, ((), ()))
+        return [matching_car_dict(r) for r in _nearest(prices, rows, predicted_price, limit, lower_bound, upper_bound)]
+
+    def find_ranked(self, target_body, lower_bound, upper_bound, key, limit=10):
+        """ /find_by_body: cars of one body inside [lower, upper] with the smallest key(id, listed_price); rows whose
+        key is None are left out (ties keep the cheaper car first). """
+        self.maybe_refresh()
+        prices, rows = self._snapshot.partitions.get(target_body, ((), ()))
+        candidates = ((key(rows[i][_ID], rows[i][_PRICE]), i)
+                      for i in range(bisect_left(prices, lower_bound), bisect_right(prices, upper_bound)))
+        ranked = heapq.nsmallest(limit, (candidate for candidate in candidates if candidate[0] is not None))
+        return [matching_car_dict(rows[i]) for _, i in ranked]
+
+    def find_page(self, walk, page_size):
+        """ One page of a paginated /find_by_body (keyset_pages.Walk): (matching_cars dicts, next cursor).
+        Partitions are sorted by (listed_price, ID), so both sides are a bisect plus a slice, like the SQL seeks. """
+        self.maybe_refresh()
+        prices, rows = self._snapshot.partitions.get(walk.body, ((), ()))
+        position = lambda row: (row[_PRICE], row[_ID])
+        up_rows, down_rows = [], []
+        if not walk.up_done:
+            start = bisect_right(rows, tuple(walk.up), key=position) if walk.up is not None else bisect_left(prices, walk.target)
+            up_rows = [row for row in rows[start:start + page_size] if row[_PRICE] <= walk.upper]
+        if not walk.down_done:
+            end = bisect_left(rows, tuple(walk.down), key=position) if walk.down is not None else bisect_left(prices, walk.target)
+            down_rows = [row for row in reversed(rows[max(0, end - page_size):end]) if row[_PRICE] >= walk.lower]
+        page, cursor = next_page(walk, up_rows, down_rows, page_size, position)
+        return [matching_car_dict(row) for row in page], cursor
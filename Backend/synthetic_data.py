@@ -0,0 +1,150 @@
+# --- Synthetic "car data" inventory for benchmarks ---
+# Generates rows shaped like the "car data" table (same column names, Text dimension columns plus their typed
+# copies from migrations.py, lowercase category values as seen by the model) with plausible correlations: price
+# depends on body, year, km and engine size, dimensions depend on body. Used by the benchmark modes of the serving
+# modules so they can be run at 10k..millions of listings without the real dataset.
+#
+# Usage (from another module):
+#   from synthetic_data import synthetic_cars, seed_table, synthetic_requests
+#   frame = synthetic_cars(100_000)
+#   seed_table(engine, CarInfo.__table__, 2_000_000)   # creates + fills the table (skipped if already that big)
+#   bodies = synthetic_requests(1000)                   # /predict JSON bodies
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, insert
+
+BODIES = ('hatchback', 'sedan', 'suv', 'muv', 'minivans', 'coupe', 'luxury vehicles', 'pickup trucks', 'convertibles',
+          'wagon', 'hybrids')
+BODY_WEIGHTS = (0.37, 0.22, 0.24, 0.07, 0.03, 0.01, 0.03, 0.01, 0.005, 0.01, 0.005)
+# (base price, length mm, width mm, height mm, wheel base mm, kerb weight kg) per body
+BODY_PROFILES = {
+    'hatchback': (450000, 3800, 1680, 1520, 2450, 950),
+    'sedan': (750000, 4400, 1730, 1480, 2620, 1150),
+    'suv': (1100000, 4350, 1800, 1700, 2650, 1450),
+    'muv': (900000, 4450, 1750, 1750, 2750, 1400),
+    'minivans': (500000, 3700, 1600, 1800, 2400, 900),
+    'coupe': (3500000, 4600, 1850, 1350, 2700, 1500),
+    'luxury vehicles': (4500000, 5000, 1900, 1500, 3000, 1900),
+    'pickup trucks': (1200000, 5300, 1850, 1820, 3100, 1900),
+    'convertibles': (4000000, 4500, 1820, 1350, 2600, 1600),
+    'wagon': (700000, 4300, 1700, 1550, 2550, 1200),
+    'hybrids': (2000000, 4600, 1800, 1450, 2750, 1550),
+}
+FUELS = ('petrol', 'diesel', 'cng', 'electric', 'lpg')
+FUEL_WEIGHTS = (0.6, 0.33, 0.05, 0.015, 0.005)
+ENGINE_TYPES = tuple(f"engine {i:02d}" for i in range(40)) + ('petrol engine', 'diesel engine', 'k10b engine',
+                                                              'tsi petrol engine', '1.0 sce', 'g12b')
+DRIVE_TYPES = ('fwd', 'rwd', '2wd', '4wd', 'awd', '4x2')
+STATES = ('maharashtra', 'uttar pradesh', 'karnataka', 'uttarakhand', 'telangana', 'bihar', 'delhi', 'kerala',
+          'tamil nadu', 'gujarat', 'haryana', 'rajasthan', 'west bengal', 'punjab')
+OWNER_TYPES = ('first', 'second', 'third', 'fourth', 'fifth', 'unregistered car')
+OWNER_WEIGHTS = (0.62, 0.25, 0.08, 0.03, 0.01, 0.01)
+OEMS = ('maruti', 'hyundai', 'honda', 'tata', 'mahindra', 'toyota', 'kia', 'volkswagen', 'skoda', 'renault',
+        'bmw', 'mercedes-benz', 'audi')
+
+
+def _pick(rng, values, n, weights=None):
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=n, p=weights)]
+
+
+def synthetic_cars(n_rows, seed=42, image_ratio=0.6, start_id=1):
+    """ DataFrame of n_rows fake listings with the "car data" column names and types. """
+    rng = np.random.default_rng(seed)
+    body_idx = rng.choice(len(BODIES), size=n_rows, p=BODY_WEIGHTS)
+    body = np.asarray(BODIES, dtype=object)[body_idx]
+    profile = np.array([BODY_PROFILES[b] for b in BODIES], dtype=float)[body_idx]
+
+    myear = rng.integers(2005, 2024, size=n_rows)
+    km = np.clip(rng.lognormal(np.log(12000 * (2024 - myear)), 0.45), 500, 500000).astype(np.int64)
+    cylinders = rng.choice([3, 4, 6, 8], size=n_rows, p=[0.3, 0.6, 0.08, 0.02])
+    length = profile[:, 1] + rng.normal(0, 120, n_rows)
+    width = profile[:, 2] + rng.normal(0, 40, n_rows)
+    height = profile[:, 3] + rng.normal(0, 50, n_rows)
+    wheel_base = profile[:, 4] + rng.normal(0, 60, n_rows)
+    kerb_weight = profile[:, 5] + rng.normal(0, 90, n_rows) + (cylinders - 4) * 60
+    max_torque_at = np.clip(rng.normal(3000, 900, n_rows), 1200, 6000)
+
+    age_factor = 0.88 ** (2024 - myear)
+    km_factor = np.clip(1.1 - km / 400000, 0.5, 1.1)
+    price = profile[:, 0] * age_factor * km_factor * (1 + (cylinders - 4) * 0.25) * rng.lognormal(0, 0.2, n_rows)
+
+    oem = _pick(rng, OEMS, n_rows)
+    model_no = rng.integers(1, 9, size=n_rows)
+    ids = np.arange(start_id, start_id + n_rows, dtype=np.int64)
+    has_image = rng.random(n_rows) < image_ratio
+
+    def text(values):
+        return pd.Series(np.round(values).astype(np.int64)).astype(str)
+
+    return pd.DataFrame({
+        "ID": ids,
+        "myear": myear,
+        "body": body,
+        "transmission": _pick(rng, ('manual', 'automatic'), n_rows, (0.7, 0.3)),
+        "fuel": _pick(rng, FUELS, n_rows, FUEL_WEIGHTS),
+        "km": km,
+        "oem": oem,
+        "model": pd.Series(oem).str.cat(pd.Series(model_no).astype(str), sep=" model "),
+        "variant": pd.Series(rng.choice(['base', 'mid', 'top', 'sport'], size=n_rows)),
+        "listed_price": np.round(price, -3).astype(np.int64),
+        "utype": _pick(rng, ('individual', 'dealer'), n_rows, (0.55, 0.45)),
+        "Engine Type": _pick(rng, ENGINE_TYPES, n_rows),
+        "No of Cylinder": cylinders,
+        "Length": text(length),
+        "Width": text(width),
+        "Height": text(height),
+        "Wheel Base": text(wheel_base),
+        "Kerb Weight": text(kerb_weight),
+        "Gear Box": rng.choice([4, 5, 6, 7, 8], size=n_rows, p=[0.05, 0.55, 0.25, 0.1, 0.05]),
+        "Drive Type": _pick(rng, DRIVE_TYPES, n_rows),
+        "Seats": rng.choice([4, 5, 7, 8], size=n_rows, p=[0.05, 0.75, 0.17, 0.03]),
+        "Steering Type": _pick(rng, ('power', 'manual'), n_rows, (0.95, 0.05)),
+        "state": _pick(rng, STATES, n_rows),
+        "owner_type": _pick(rng, OWNER_TYPES, n_rows, OWNER_WEIGHTS),
+        "Max Torque At": text(max_torque_at),
+        "image_url": np.where(has_image, [f"https://images.example.com/cars/{i}.jpg" for i in ids], None),
+        "length_mm": np.round(length),
+        "width_mm": np.round(width),
+        "height_mm": np.round(height),
+        "wheel_base_mm": np.round(wheel_base),
+        "kerb_weight_kg": np.round(kerb_weight),
+        "max_torque_rpm": np.round(max_torque_at),
+    })
+
+
+def seed_table(engine, table, n_rows, chunk_rows=100000, seed=42):
+    """ Creates `table` (with its indexes) if needed and appends synthetic rows until it holds n_rows. """
+    table.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        existing = conn.execute(select(func.count()).select_from(table)).scalar()
+        start_id = (conn.execute(select(func.max(table.c.ID))).scalar() or 0) + 1
+    if existing >= n_rows:
+        print(f"--- {table.name} already has {existing:,} rows ---")
+        return existing
+
+    print(f"--- Seeding {table.name} with {n_rows - existing:,} synthetic rows... ---")
+    start = time.perf_counter()
+    for offset in range(0, n_rows - existing, chunk_rows):
+        count = min(chunk_rows, n_rows - existing - offset)
+        frame = synthetic_cars(count, seed=seed + start_id + offset, start_id=start_id + offset)
+        rows = frame.astype(object).where(frame.notna(), None).to_dict('records')
+        with engine.begin() as conn:
+            conn.execute(insert(table), rows)
+        print(f"  {existing + offset + count:,} rows ({time.perf_counter() - start:.0f}s)")
+    return n_rows
+
+
+REQUEST_COLUMNS = ('body', 'Drive Type', 'Engine Type', 'fuel', 'owner_type', 'state', 'Steering Type', 'transmission',
+                   'utype', 'myear', 'km', 'No of Cylinder', 'Length', 'Width', 'Height', 'Wheel Base', 'Kerb Weight',
+                   'Gear Box', 'Seats', 'Max Torque At')
+
+
+def synthetic_requests(n_rows, seed=7):
+    """ /predict request bodies (cleaned field names, numbers as numbers) drawn from synthetic listings. """
+    frame = synthetic_cars(n_rows, seed=seed)[list(REQUEST_COLUMNS)]
+    for col in ('Length', 'Width', 'Height', 'Wheel Base', 'Kerb Weight', 'Max Torque At'):
+        frame[col] = frame[col].astype(float)
+    frame.columns = [col.replace(' ', '_').lower() for col in frame.columns]
+    return frame.to_dict('records')
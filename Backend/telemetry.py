@@ -0,0 +1,265 @@
+# --- Request telemetry: per-stage spans, Prometheus metrics, logging ---
+# Every API request gets a RequestTrace (held in a contextvar, so helpers deep in the call stack can reach it).
+# The route wraps its stages in trace.stage("validate" / "cache" / "inference" / "similar_cars" / "log" / ...).
+# Code inside a stage can attach labels with annotate(); for example, the similar-car helpers record which tier
+# answered ("index_1", "sql_2", "features", ...).
+#   * every stage duration goes to the carify_stage_duration_seconds histogram (labels: endpoint, stage, tier);
+#   * a sampled share of requests (TRACE_SAMPLE_RATE), plus every request slower than TRACE_SLOW_MS, is logged as
+#     one structured line with its span breakdown;
+#   * forward passes, SQL statements and DB pool checkouts have their own histograms, fed from _predict_prices,
+#     SQLAlchemy cursor events and TimedQueuePool;
+#   * model / cache / queue / snapshot gauges are refreshed from the app's stats at scrape time (and every
+#     GAUGE_REFRESH_SECONDS while requests flow). GET /metrics renders them in the Prometheus text format.
+# Under gunicorn with several workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory so /metrics aggregates
+# all workers (gunicorn.conf.py cleans up after exited workers).
+#
+# Usage (from app.py / asgi_app.py):
+#   trace = telemetry.start_trace("/predict")
+#   with trace.stage("similar_cars"): ... telemetry.annotate(tier="index_1") ...
+#   telemetry.finish_trace(trace, 200)
+import os
+import json
+import time
+import random
+import logging
+import threading
+import contextlib
+import contextvars
+
+from prometheus_client import Histogram, Counter, Gauge, REGISTRY, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+logger = logging.getLogger("carify")
+
+METRICS = os.getenv("METRICS", "1") == "1"  # "0": no spans, no histograms (/metrics stays, mostly empty)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))  # share of requests logged with their spans
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))  # requests slower than this are always logged
+GAUGE_REFRESH_SECONDS = 5.0
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1.0)
+ROW_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+REQUEST_SECONDS = Histogram("carify_request_duration_seconds", "API request latency (until the response headers)",
+                            ["endpoint", "status"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("carify_stage_duration_seconds", "Time spent per request stage",
+                          ["endpoint", "stage", "tier"], buckets=LATENCY_BUCKETS)
+INFERENCE_SECONDS = Histogram("carify_inference_seconds", "Model forward pass (one call, any batch size)",
+                              ["engine"], buckets=FAST_BUCKETS)
+INFERENCE_ROWS = Histogram("carify_inference_batch_rows", "Rows per model forward pass", ["engine"], buckets=ROW_BUCKETS)
+DB_QUERY_SECONDS = Histogram("carify_db_query_seconds", "SQL statement execution time", ["statement"], buckets=FAST_BUCKETS)
+DB_POOL_WAIT_SECONDS = Histogram("carify_db_pool_wait_seconds", "Time to check a connection out of the pool "
+                                 "(includes opening a new one)", ["pool"], buckets=FAST_BUCKETS)
+PREDICTION_CACHE_LOOKUPS = Counter("carify_prediction_cache_lookups_total", "/predict cache lookups", ["result"])
+SIMILAR_CARS_TIERS = Counter("carify_similar_cars_tier_total", "Similar-car searches by the tier that answered", ["tier"])
+
+MODEL_READY = Gauge("carify_model_ready", "1 once the model is loaded and warm", multiprocess_mode="livemin")
+MODEL_LOAD_SECONDS = Gauge("carify_model_load_seconds", "Model load time", multiprocess_mode="max")
+MODEL_WARMUP_SECONDS = Gauge("carify_model_warmup_seconds", "First forward pass time", multiprocess_mode="max")
+MODEL_INFO = Gauge("carify_model_info", "Serving configuration of the loaded model", ["mode", "runtime", "engine"],
+                   multiprocess_mode="max")
+PREDICTION_CACHE_ENTRIES = Gauge("carify_prediction_cache_entries", "Entries in the per-worker prediction cache",
+                                 multiprocess_mode="livesum")
+LOG_QUEUE_DEPTH = Gauge("carify_log_queue_depth", "Prediction log rows waiting for the write-behind flush",
+                        multiprocess_mode="livesum")
+MICROBATCH_QUEUE_DEPTH = Gauge("carify_microbatch_queue_depth", "Rows waiting in the /predict micro-batcher",
+                               multiprocess_mode="livesum")
+DB_POOL_CHECKED_OUT = Gauge("carify_db_pool_checked_out", "Connections currently checked out of the pool",
+                            multiprocess_mode="livesum")
+SNAPSHOT_ROWS = Gauge("carify_snapshot_rows", "Rows held by an in-memory snapshot", ["snapshot"], multiprocess_mode="max")
+SNAPSHOT_AGE_SECONDS = Gauge("carify_snapshot_age_seconds", "Age of an in-memory snapshot", ["snapshot"],
+                             multiprocess_mode="max")
+
+_current_trace = contextvars.ContextVar("carify_trace", default=None)
+_gauge_refreshers = []
+_gauge_lock = threading.Lock()
+_gauges_refreshed_at = 0.0
+
+
+def configure_logging():
+    """ Handler for the "carify" loggers: LOG_LEVEL (INFO), LOG_FORMAT "text" or "json" (one object per line). """
+    if logger.handlers: return
+    handler = logging.StreamHandler()
+    if os.getenv("LOG_FORMAT", "text") == "json":
+        handler.setFormatter(_JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name,
+                 "pid": record.process, "msg": record.getMessage()}
+        if hasattr(record, "trace"): entry["trace"] = record.trace
+        if record.exc_info: entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestTrace:
+    """ Stage timings of one request. Stages may nest; annotate() labels the innermost open one. """
+
+    __slots__ = ("endpoint", "started", "spans", "sampled", "_open", "_token")
+
+    def __init__(self, endpoint, sampled):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = []
+        self.sampled = sampled
+        self._open = []
+        self._token = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        span = {"stage": name}
+        self.spans.append(span)
+        self._open.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            seconds = time.perf_counter() - start
+            self._open.pop()
+            span["ms"] = round(seconds * 1000, 3)
+            STAGE_SECONDS.labels(self.endpoint, name, span.get("tier", "")).observe(seconds)
+
+
+class _NoTrace:
+    """ Stand-in when METRICS=0 (or outside a request): stages cost one context manager and nothing else. """
+
+    sampled = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        yield {}
+
+
+NO_TRACE = _NoTrace()
+
+
+def start_trace(endpoint):
+    if not METRICS: return NO_TRACE
+    trace = RequestTrace(endpoint, random.random() < TRACE_SAMPLE_RATE)
+    trace._token = _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace, status):
+    """ Records the request latency; logs the span breakdown of sampled and slow requests. """
+    if trace is NO_TRACE or trace is None: return
+    seconds = time.perf_counter() - trace.started
+    REQUEST_SECONDS.labels(trace.endpoint, str(status)).observe(seconds)
+    with contextlib.suppress(ValueError): _current_trace.reset(trace._token)  # other context (e.g. streamed body)
+    if trace.sampled or seconds * 1000 >= TRACE_SLOW_MS:
+        summary = {"endpoint": trace.endpoint, "status": status, "ms": round(seconds * 1000, 3), "spans": trace.spans}
+        logger.info("trace %s", json.dumps(summary), extra={"trace": summary})
+    if time.monotonic() - _gauges_refreshed_at >= GAUGE_REFRESH_SECONDS: refresh_gauges()
+
+
+def current_trace():
+    return _current_trace.get() or NO_TRACE
+
+
+def annotate(**labels):
+    """ Adds labels (e.g. tier="sql_2") to the innermost open stage of the current request. """
+    trace = _current_trace.get()
+    if trace is not None and trace._open: trace._open[-1].update(labels)
+    if "tier" in labels and METRICS: SIMILAR_CARS_TIERS.labels(labels["tier"]).inc()
+
+
+def observe_inference(engine_name, rows, seconds):
+    if not METRICS: return
+    INFERENCE_SECONDS.labels(engine_name).observe(seconds)
+    INFERENCE_ROWS.labels(engine_name).observe(rows)
+
+
+def observe_cache_lookup(hit):
+    if METRICS: PREDICTION_CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+
+
+# === DATABASE INSTRUMENTATION =====================================
+
+class _PoolWaitTimer:
+    """ Times every checkout (waiting for a free connection, or opening one) into carify_db_pool_wait_seconds. """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT_SECONDS.labels(self._metrics_name).observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_PoolWaitTimer, QueuePool):
+    _metrics_name = "sync"
+
+
+class TimedAsyncQueuePool(_PoolWaitTimer, AsyncAdaptedQueuePool):
+    _metrics_name = "async"
+
+
+def instrument_engine(engine):
+    """ Statement timing via cursor events (for an AsyncEngine pass engine.sync_engine). """
+    if not METRICS: return engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("carify_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("carify_query_start")
+        if not starts: return
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_SECONDS.labels(verb).observe(time.perf_counter() - starts.pop())
+
+    return engine
+
+
+def pool_class(engine_kind="sync"):
+    """ Pool class for create_engine(poolclass=...): timed when metrics are on. """
+    if engine_kind == "async": return TimedAsyncQueuePool if METRICS else AsyncAdaptedQueuePool
+    return TimedQueuePool if METRICS else QueuePool
+
+
+# === GAUGES + EXPOSITION ==========================================
+
+def register_gauge_refresh(fn):
+    """ fn() sets gauges from the app's current stats; called at scrape time and every GAUGE_REFRESH_SECONDS. """
+    _gauge_refreshers.append(fn)
+
+
+def refresh_gauges():
+    global _gauges_refreshed_at
+    if not _gauge_lock.acquire(blocking=False): return
+    try:
+        _gauges_refreshed_at = time.monotonic()
+        for fn in _gauge_refreshers:
+            try:
+                fn()
+            except Exception as e:
+                logger.warning("Gauge refresh failed: %s", e)
+    finally:
+        _gauge_lock.release()
+
+
+def render_metrics():
+    """ (body, content type) of the Prometheus text exposition, aggregated over workers in multiprocess mode. """
+    refresh_gauges()
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid):
+    """ gunicorn child_exit hook: drops the live gauges of an exited worker in multiprocess mode. """
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,64 @@
+# The Backend modules import each other as top-level modules (import app, from inference_engine import ...) and
+# open the model at the relative MODEL_PATH: tests run with Backend/ on sys.path and as the working directory.
+# app.py reads its configuration at import, so the test database and state directories are set here, first.
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_PATH = os.path.join(BACKEND_DIR, "saved_car_model_log_v1")
+sys.path.insert(0, BACKEND_DIR)
+
+STATE_DIR = tempfile.mkdtemp(prefix="carify_tests_")
+os.environ["DATABASE_URI"] = f"sqlite:///{os.path.join(STATE_DIR, 'cars.db')}"
+os.environ["THUMBNAIL_DIR"] = os.path.join(STATE_DIR, "thumbnails")
+os.environ["MODEL_REGISTRY_DIR"] = os.path.join(STATE_DIR, "model_registry")
+os.environ["MODEL_REGISTRY_POLL_SECONDS"] = "0"
+SEED_ROWS = 3000
+
+requires_model = pytest.mark.skipif(not os.path.isdir(MODEL_PATH), reason="saved_car_model_log_v1 is not checked out")
+
+
+@pytest.fixture(autouse=True, scope="session")
+def backend_cwd():
+    previous = os.getcwd()
+    os.chdir(BACKEND_DIR)
+    yield BACKEND_DIR
+    os.chdir(previous)
+
+
+@pytest.fixture(scope="session")
+def api():
+    """ app.py on a migrated SQLite "car data" of SEED_ROWS synthetic cars (model not loaded). """
+    import app as api
+    import migrations
+    from synthetic_data import seed_table
+    assert api.init_database()
+    seed_table(api.engine, api.CarInfo.__table__, SEED_ROWS)
+    migrations.upgrade(api.engine, api.CarInfo.__table__)
+    api._warmup_pid = os.getpid()  # no background warm-up on the first request: served_api warms up explicitly
+    return api
+
+
+@pytest.fixture
+def sql_only(api, monkeypatch):
+    """ api with the in-memory snapshots unplugged, so the routes take their SQL paths. """
+    for name in ("similar_cars_index", "car_recommender", "price_estimate_index", "thumbnail_index"):
+        monkeypatch.setattr(api, name, None)
+    return api
+
+
+@pytest.fixture(scope="session")
+def served_api(api):
+    """ api warmed up the way gunicorn's preload does it: model loaded, snapshots built. """
+    if not os.path.isdir(MODEL_PATH): pytest.skip("saved_car_model_log_v1 is not checked out")
+    api.create_app(preload=True)
+    assert api.model is not None, api.model_status
+    return api
+
+
+@pytest.fixture
+def client(served_api):
+    return served_api.app.test_client()
@@ -0,0 +1,51 @@
+# Workers sharing one car_options summary table: only one of them rebuilds it.
+import os
+import threading
+
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.orm import sessionmaker
+
+from car_options import CarOptionsCache
+from synthetic_data import seed_table
+
+
+def _summary_db(tmp_path):
+    import app as api
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_path, 'cars.db')}", connect_args={"timeout": 30})
+    seed_table(engine, api.CarInfo.__table__, 2000)
+    return engine, sessionmaker(bind=engine), api.CarInfo, api.CarOption
+
+
+def test_fresh_summary_is_not_rebuilt_by_the_next_worker(tmp_path):
+    engine, Session, car_model, summary_model = _summary_db(tmp_path)
+    first = CarOptionsCache(Session, car_model, summary_model)
+    first.load()
+    second = CarOptionsCache(Session, car_model, summary_model)
+    second.load()
+    assert (first.rebuilds, second.rebuilds) == (1, 0)
+    assert first.current().etag == second.current().etag
+
+
+def test_a_worker_that_waited_for_the_lock_keeps_the_new_summary(tmp_path):
+    engine, Session, car_model, summary_model = _summary_db(tmp_path)
+    workers = [CarOptionsCache(Session, car_model, summary_model) for _ in range(4)]
+    results, errors = [], []
+
+    def rebuild(cache):
+        db = Session()
+        try:
+            results.append(cache._rebuild(db, cache.refresh_seconds))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=rebuild, args=(cache,)) for cache in workers]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert not errors
+    assert sum(cache.rebuilds for cache in workers) == 1
+    assert len({refreshed_at for _, refreshed_at in results}) == 1
+    with engine.connect() as conn:
+        rows = conn.execute(select(func.count()).select_from(summary_model.__table__)).scalar()
+    assert rows == sum(len(values) for values in results[0][0].values())
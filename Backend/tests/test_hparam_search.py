@@ -0,0 +1,8 @@
+# Offline --self-test of the hyperparameter search: trials in a process pool, pruning and the Pareto report.
+import pytest
+
+
+def test_self_test():
+    pytest.importorskip("pytorch_tabular")
+    import hparam_search
+    hparam_search.self_test(n_rows=1500)
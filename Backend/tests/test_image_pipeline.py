@@ -0,0 +1,6 @@
+# Offline --self-test of the image pipeline: parallel lookups, resumable checkpoint, failed lookups retried.
+
+
+def test_self_test():
+    import image_pipeline
+    image_pipeline.self_test(n_rows=5000)
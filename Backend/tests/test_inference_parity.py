@@ -0,0 +1,36 @@
+# FastInferenceEngine and the exported graph must score exactly like TabularModel.predict (inference_engine.py and
+# export_model.py check the same interactively).
+import numpy as np
+import pytest
+
+from conftest import MODEL_PATH, requires_model
+
+ATOL = 1e-4  # log-price
+ROWS = 256
+
+
+@pytest.fixture(scope="module")
+def tabular_model():
+    from inference_engine import load_tabular_model
+    model = load_tabular_model(MODEL_PATH)
+    model.datamodule.batch_size = ROWS
+    return model
+
+
+@requires_model
+def test_fast_engine_matches_tabular_model(tabular_model):
+    from inference_engine import FastInferenceEngine, sample_frame
+    engine = FastInferenceEngine(tabular_model)
+    frame = sample_frame(engine.encoder, ROWS)  # includes unseen categories
+    expected = tabular_model.predict(frame)[engine.prediction_col].to_numpy()
+    np.testing.assert_allclose(engine.predict(frame)[engine.prediction_col].to_numpy(), expected, rtol=0, atol=ATOL)
+    # Single rows take the records path of /predict
+    records = frame.iloc[:8].to_dict("records")
+    single = np.array([engine.predict_records([record])[0] for record in records])
+    np.testing.assert_allclose(single, expected[:8], rtol=0, atol=ATOL)
+
+
+@requires_model
+def test_exported_graph_matches_tabular_model(tabular_model, tmp_path):
+    from export_model import export
+    assert export(MODEL_PATH, str(tmp_path / "export")) <= ATOL
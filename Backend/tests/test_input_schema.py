@@ -0,0 +1,83 @@
+# InputSchema: per-field error messages, numeric strings coerced, blanks imputed, validate_frame agreeing with
+# validate row by row, and the compiled frame matching the per-field preparation it replaced.
+import numpy as np
+import pandas as pd
+import pytest
+
+from input_schema import InputSchema, _legacy_prepare
+from synthetic_data import synthetic_requests
+
+from conftest import MODEL_PATH, requires_model
+
+
+@pytest.fixture
+def schema():
+    return InputSchema(["body", "fuel"], ["myear", "km"])
+
+
+def test_numeric_strings_are_coerced(schema):
+    batch = schema.validate({"body": "suv", "fuel": "diesel", "myear": "2015", "km": " 72339.5 "})
+    assert batch.errors == [None]
+    assert batch.rows() == [{"body": "suv", "fuel": "diesel", "myear": 2015.0, "km": 72339.5}]
+    assert batch.columns["myear"].dtype == np.float64
+
+
+def test_blanks_are_imputed(schema):
+    batch = schema.validate({"body": "  ", "fuel": None, "myear": "", "km": None})
+    assert batch.errors == [None]
+    assert batch.rows() == [{"body": "Unknown", "fuel": "Unknown", "myear": 0.0, "km": 0.0}]
+
+
+@pytest.mark.parametrize("payload, error, fields", [
+    ({"body": "suv", "myear": 2015},
+     "Missing input fields: fuel, km", {"fuel": "missing", "km": "missing"}),
+    ({"body": "suv", "fuel": "diesel", "myear": "last year", "km": 1000},
+     "Invalid non-numeric input for field(s): 'myear' (value: 'last year')", {"myear": "not a number"}),
+    ({"body": "suv", "fuel": "diesel", "myear": "x", "km": [1]},
+     "Invalid non-numeric input for field(s): 'myear' (value: 'x'), 'km' (value: '[1]')",
+     {"myear": "not a number", "km": "not a number"}),
+    ({"body": "suv", "myear": "x"},
+     "Missing input fields: fuel, km", {"fuel": "missing", "km": "missing", "myear": "not a number"}),
+    ([1, 2], "Input record must be a JSON object", {}),
+])
+def test_per_field_errors(schema, payload, error, fields):
+    assert schema.validate([payload]).errors == [{"error": error, "fields": fields}]
+
+
+def test_bad_rows_keep_the_good_ones(schema):
+    good = {"body": "suv", "fuel": "diesel", "myear": 2015, "km": 1000}
+    batch = schema.validate([good, {"body": "suv"}, "text", {**good, "km": "far"}, {**good, "myear": "2020"}])
+    assert [error is None for error in batch.errors] == [True, False, False, False, True]
+    assert batch.valid_positions == [0, 4]
+    assert list(batch.frame()["myear"]) == [2015.0, 2020.0]
+    assert list(batch.frame().columns) == schema.columns
+
+
+def test_validate_frame_agrees_with_validate(schema):
+    payloads = [{"body": "suv", "fuel": "diesel", "myear": 2015, "km": "1200"},
+                {"body": None, "fuel": "", "myear": None, "km": 35000.5},
+                {"body": "sedan", "fuel": "petrol", "myear": "soon", "km": 10},
+                {"body": "muv", "fuel": "cng", "myear": float("nan"), "km": " 7 "}]
+    by_row = schema.validate(payloads)
+    by_column = schema.validate_frame(pd.DataFrame(payloads))
+    assert by_column.errors == by_row.errors
+    assert by_column.rows() == by_row.rows()
+    for col in schema.columns:
+        assert list(by_column.columns[col]) == list(by_row.columns[col])
+
+
+def test_validate_frame_needs_every_column(schema):
+    with pytest.raises(ValueError, match="km"):
+        schema.validate_frame(pd.DataFrame([{"body": "suv", "fuel": "diesel", "myear": 2015}]))
+
+
+@requires_model
+def test_model_schema_matches_legacy_preparation():
+    schema = InputSchema.from_model_dir(MODEL_PATH)
+    payloads = synthetic_requests(50)
+    payloads[0]["km"], payloads[1]["body"] = "", None
+    batch = schema.validate(payloads)
+    assert batch.errors == [None] * 50
+    expected = _legacy_prepare(payloads, schema.categorical_cols, schema.continuous_cols)[schema.columns]
+    pd.testing.assert_frame_equal(batch.frame(), expected)
+    pd.testing.assert_frame_equal(schema.validate_frame(pd.DataFrame(payloads)).frame(), batch.frame())
@@ -0,0 +1,121 @@
+# Keyset pagination of /find_by_body: cursor round-trip and rejection, pages that add up to exactly the
+# unpaginated nearest-price order (no duplicates or gaps at equal listed_price), and the in-memory index
+# answering page for page like SQL.
+import base64
+import json
+
+import pytest
+from sqlalchemy import select
+
+from keyset_pages import Walk
+from similar_cars_index import SimilarCarsIndex
+
+PAGE_SIZE = 7
+
+
+@pytest.fixture(scope="module")
+def search(api):
+    """ (body, target price, bounds) of a body with many cars, and the unpaginated answer in nearest-price order. """
+    cars = api.CarInfo
+    with api.SessionLocal() as db:
+        body = db.execute(select(cars.body).group_by(cars.body).order_by(api.sql_func.count().desc())).scalars().first()
+        prices = sorted(db.execute(select(cars.listed_price).where(cars.body == body)).scalars())
+    target = float(prices[len(prices) // 2])
+    _, _, bounds, _ = api._parse_find_by_body({"body": body, "predicted_price": target})  # the endpoint's window
+    with api.SessionLocal() as db:
+        rows = db.execute(select(cars.ID, cars.listed_price).where(
+            cars.body == body, cars.listed_price >= bounds[0], cars.listed_price <= bounds[1])).all()
+    # Ties: the cheaper car, then the lower ID above / the higher ID below the target
+    order = sorted(rows, key=lambda r: (abs(r.listed_price - target), r.listed_price, r.ID if r.listed_price >= target else -r.ID))
+    assert len({r.listed_price for r in rows}) < len(rows) / 2  # plenty of cars at equal listed_price
+    return body, target, bounds, [r.ID for r in order]
+
+
+@pytest.fixture(scope="module")
+def index(api):
+    index = SimilarCarsIndex(api.SessionLocal, api.CarInfo)
+    index.load()
+    return index
+
+
+def _walk_all(fetch_page, walk):
+    """ Follows the cursors to the end; every cursor goes through encode/decode. Returns the matching cars. """
+    cars, pages = [], 0
+    while walk is not None:
+        page, cursor = fetch_page(walk, pages)
+        assert len(page) == PAGE_SIZE or cursor is None
+        cars += page
+        pages += 1
+        walk = Walk.decode(cursor) if cursor is not None else None
+    return cars
+
+
+def test_cursor_round_trip():
+    walk = Walk("SUV", 750000.0, 250000.0, 1250000.0, up=[751000.0, 42], down=[749000.0, 7], down_done=True)
+    decoded = Walk.decode(walk.encode())
+    assert vars(decoded) == {**vars(walk), "up": (751000.0, 42), "down": (749000.0, 7)}
+    assert decoded.encode() == walk.encode()
+    assert vars(Walk.decode(Walk.start("SUV", 1, 0, 2).encode())) == vars(Walk.start("SUV", 1, 0, 2))
+
+
+def _cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip("=")
+
+
+VALID = {"v": 1, "b": "SUV", "t": 1.0, "l": 0.0, "h": 2.0, "u": None, "d": None, "ud": False, "dd": False}
+
+
+@pytest.mark.parametrize("cursor", [
+    "garbage", "", "!!!", 12345, ["a"], _cursor([1, 2]), _cursor({**VALID, "v": 2}), _cursor({**VALID, "u": ["a", 1]}),
+    _cursor({**VALID, "d": [1, 2, 3]}), _cursor({**VALID, "t": "far"}), _cursor({k: v for k, v in VALID.items() if k != "h"}),
+    Walk.start("SUV", 1, 0, 2).encode()[:-3],
+], ids=lambda cursor: str(cursor)[:20])
+def test_bad_cursor_is_a_400(api, cursor):
+    with pytest.raises(ValueError):
+        Walk.decode(cursor)
+    response = api.app.test_client().post("/find_by_body", json={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid 'cursor'"}
+
+
+@pytest.mark.parametrize("page_size", [0, -1, 101, "ten"])
+def test_bad_page_size_is_a_400(api, page_size):
+    response = api.app.test_client().post("/find_by_body", json={"body": "SUV", "predicted_price": 1, "page_size": page_size})
+    assert response.status_code == 400
+
+
+def test_sql_pages_add_up_to_the_unpaginated_order(api, search):
+    body, target, bounds, expected = search
+    assert len(expected) > 5 * PAGE_SIZE
+    with api.SessionLocal() as db:
+        cars = _walk_all(lambda walk, _: api._find_by_body_page(db, walk, PAGE_SIZE), Walk.start(body, target, *bounds))
+    ids = [car["id"] for car in cars]
+    assert len(ids) == len(set(ids))
+    assert ids == expected
+
+
+def test_index_pages_match_sql(api, search, index):
+    body, target, bounds, expected = search
+    by_index = _walk_all(lambda walk, _: index.find_page(walk, PAGE_SIZE), Walk.start(body, target, *bounds))
+    with api.SessionLocal() as db:
+        by_sql = _walk_all(lambda walk, _: api._find_by_body_page(db, walk, PAGE_SIZE), Walk.start(body, target, *bounds))
+        # Each path continues the other's cursors
+        mixed = _walk_all(lambda walk, n: (index.find_page(walk, PAGE_SIZE) if n % 2 else api._find_by_body_page(db, walk, PAGE_SIZE)),
+                          Walk.start(body, target, *bounds))
+    assert by_index == by_sql == mixed
+    assert [car["id"] for car in by_index] == expected
+
+
+def test_paging_through_the_endpoint(sql_only, search):
+    body, target, _, expected = search
+    client = sql_only.app.test_client()
+    request, ids = {"body": body, "predicted_price": target, "page_size": PAGE_SIZE}, []
+    while True:
+        response = client.post("/find_by_body", json=request)
+        assert response.status_code == 200
+        page = response.get_json()
+        ids += [car["id"] for car in page["matching_cars"]]
+        if page["next_cursor"] is None: break
+        request = {"cursor": page["next_cursor"], "page_size": PAGE_SIZE}
+    assert len(ids) == len(set(ids))
+    assert ids == expected
@@ -0,0 +1,102 @@
+# MicroBatcher: concurrent rows coalesce into batches, a full queue or a slow batch is back-pressure (503 from
+# /predict), and each row resolves with the version of the model that scored it, across a swap and a row retry.
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from micro_batcher import MicroBatcher, QueueFull
+from synthetic_data import synthetic_requests
+
+
+class BlockedModel:
+    """ predict_fn that holds every batch until `release` is set. """
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def __call__(self, frame):
+        self.release.wait(10)
+        return np.ones(len(frame)), "v1"
+
+
+def _saturated(max_queue):
+    """ A batcher whose thread is stuck in a batch and whose queue holds max_queue rows. """
+    blocked = BlockedModel()
+    batcher = MicroBatcher(blocked, max_batch_rows=1, max_latency_ms=0.0, max_queue=max_queue)
+    batcher.submit({"x": 0.0})
+    deadline = time.monotonic() + 5
+    while batcher._queue.qsize() and time.monotonic() < deadline: time.sleep(0.001)  # taken by the batch thread
+    for _ in range(max_queue): batcher.submit({"x": 0.0})
+    return batcher, blocked
+
+
+def test_concurrent_rows_share_forward_passes():
+    batch_sizes = []
+    batcher = MicroBatcher(lambda frame: (batch_sizes.append(len(frame)) or frame["x"].to_numpy() * 2, "v1"),
+                           max_batch_rows=64, max_latency_ms=50.0)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, batcher.predict({"x": float(i)})))
+               for i in range(32)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert results == {i: (2.0 * i, "v1") for i in range(32)}
+    assert sum(batch_sizes) == 32 and len(batch_sizes) < 32
+    assert batcher.stats()["rows"] == 32
+
+
+def test_full_queue_is_rejected():
+    batcher, blocked = _saturated(max_queue=2)
+    try:
+        with pytest.raises(QueueFull):
+            batcher.submit({"x": 1.0})
+        assert batcher.stats()["rejected"] == 1
+    finally:
+        blocked.release.set()
+
+
+@pytest.mark.parametrize("max_queue, timeout", [(1, 30.0), (100, 0.05)], ids=["queue_full", "batch_timeout"])
+def test_predict_sheds_load_with_503(client, served_api, monkeypatch, max_queue, timeout):
+    batcher, blocked = _saturated(max_queue)
+    monkeypatch.setattr(served_api, "micro_batcher", batcher)
+    monkeypatch.setattr(served_api, "prediction_cache", None)
+    monkeypatch.setattr(served_api, "MICROBATCH_TIMEOUT", timeout)
+    try:
+        response = client.post("/predict", json=synthetic_requests(1)[0])
+    finally:
+        blocked.release.set()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.get_json() == {"error": "Server busy, retry shortly"}
+
+
+class SwappableModel:
+    """ predict_fn over a model that is replaced by assigning `version` (price = x * multiplier of the version). """
+    multipliers = {"v1": 1.0, "v2": 2.0}
+
+    def __init__(self):
+        self.version = "v1"
+
+    def __call__(self, frame):
+        version = self.version
+        if (frame["x"] < 0).any(): raise ValueError("bad row")
+        return frame["x"].to_numpy() * self.multipliers[version], version
+
+
+def test_rows_report_the_version_that_scored_them():
+    served = SwappableModel()
+    batcher = MicroBatcher(served, max_batch_rows=8, max_latency_ms=1.0)
+    assert batcher.predict({"x": 3.0}) == (3.0, "v1")
+    served.version = "v2"  # hot swap between two batches
+    assert batcher.predict({"x": 3.0}) == (6.0, "v2")
+
+
+def test_row_retry_keeps_the_version():
+    served = SwappableModel()
+    batcher = MicroBatcher(served, max_batch_rows=4, max_latency_ms=50.0)
+    futures = [batcher.submit({"x": x}) for x in (1.0, -1.0, 2.0)]
+    assert futures[0].result(5) == (1.0, "v1")
+    assert isinstance(futures[1].exception(5), ValueError)
+    assert futures[2].result(5) == (2.0, "v1")
+    assert batcher.stats()["errors"] == 1
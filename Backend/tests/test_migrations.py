@@ -0,0 +1,92 @@
+# Dimension parsing (parse_measure / parse_value / dimension) and the chunked backfill of the typed columns.
+import math
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, insert, select, update
+
+import migrations
+from migrations import DIMENSION_COLUMNS, parse_measure, parse_value, dimension
+
+MM = DIMENSION_COLUMNS["Length"][1]
+KG = DIMENSION_COLUMNS["Kerb Weight"][1]
+RPM = DIMENSION_COLUMNS["Max Torque At"][1]
+
+CASES = [
+    ("3995", MM, 3995.0),
+    ("3995 mm", MM, 3995.0),
+    ("3995mm", MM, 3995.0),
+    ("1,497", MM, 1497.0),
+    ("1,497 MM", MM, 1497.0),
+    ("399.5 cm", MM, 3995.0),
+    ("1.2 m", MM, 1200.0),
+    ("1,200 kgs", KG, 1200.0),
+    ("1500-2500rpm", RPM, 2000.0),
+    ("1500 - 2500 rpm", RPM, 2000.0),
+    ("1500–2500", RPM, 2000.0),
+    ("4500 to 5000 rpm", RPM, 4750.0),
+    ("1,750-2,750rpm", RPM, 2250.0),
+    ("", MM, None),
+    ("   ", MM, None),
+    (None, MM, None),
+    ("n/a", MM, None),
+    ("not available", RPM, None),
+    ("12 furlongs", MM, None),
+    ("3995 rpm", MM, None),
+]
+
+
+@pytest.mark.parametrize("text, units, expected", CASES)
+def test_parse_value(text, units, expected):
+    assert parse_value(text, units) == expected
+
+
+def test_parse_measure_matches_parse_value():
+    """ The vectorized parser (backfill) and the scalar one (parse on read) agree on every case. """
+    for units in (MM, KG, RPM):
+        texts = [text for text, case_units, _ in CASES if case_units is units]
+        parsed = parse_measure(pd.Series(texts, dtype=object), units)
+        for text, value in zip(texts, parsed):
+            expected = parse_value(text, units)
+            assert (math.isnan(value) and expected is None) or value == expected, (text, value, expected)
+
+
+def test_dimension_prefers_the_typed_copy():
+    assert dimension(4000.0, "3995 mm", "Length") == 4000.0
+    assert dimension(None, "3995 mm", "Length") == 3995.0
+    assert dimension(None, "1500-2500rpm", "Max Torque At") == 2000.0
+    assert dimension(None, "unknown", "Width") is None
+    assert dimension(None, None, "Width") is None
+
+
+def test_backfill_on_sqlite(tmp_path, api):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cars.db'}")
+    cars = api.CarInfo.__table__
+    cars.create(engine)
+    rows = [
+        {"ID": 1, "Length": "3,995 mm", "Width": "1695", "Height": "1.5 m", "Wheel Base": "2450",
+         "Kerb Weight": "1,050 kg", "Max Torque At": "1500-2500rpm"},
+        {"ID": 2, "Length": "4.3 m", "Width": "178 cm", "Height": None, "Wheel Base": "",
+         "Kerb Weight": "heavy", "Max Torque At": "4000 rpm"},
+        {"ID": 3, "Length": None, "Width": None, "Height": None, "Wheel Base": None,
+         "Kerb Weight": None, "Max Torque At": None},
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(cars), rows)
+
+    assert migrations.backfill_dimensions(engine, cars, chunk_rows=1, only_missing=False) == 3
+    typed = [typed for typed, _ in DIMENSION_COLUMNS.values()]
+    with engine.connect() as conn:
+        values = {row[0]: tuple(row[1:]) for row in conn.execute(select(cars.c.ID, *[cars.c[t] for t in typed]))}
+    assert values[1] == (3995.0, 1695.0, 1500.0, 2450.0, 1050.0, 2000.0)
+    assert values[2] == (4300.0, 1780.0, None, None, None, 4000.0)
+    assert values[3] == (None,) * len(typed)
+
+    # --backfill: only rows whose typed columns are all still NULL (and that have some Text)
+    with engine.begin() as conn:
+        conn.execute(insert(cars), [{"ID": 4, "Length": "4,100", "Width": "1,800 mm"}])
+        conn.execute(update(cars).where(cars.c.ID == 1).values(length_mm=1.0))
+    assert migrations.backfill_dimensions(engine, cars, only_missing=True) == 1
+    with engine.connect() as conn:
+        length = dict(conn.execute(select(cars.c.ID, cars.c.length_mm)).all())
+    assert length == {1: 1.0, 2: 4300.0, 3: None, 4: 4100.0}
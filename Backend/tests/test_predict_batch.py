@@ -0,0 +1,77 @@
+# /predict/batch through the Flask test client: JSON array and NDJSON bodies, results streamed in input order,
+# per-row validation errors next to scored rows, and the empty body.
+import json
+
+import pytest
+
+from synthetic_data import synthetic_requests
+
+ROWS = 40
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+@pytest.fixture(scope="module")
+def records():
+    return synthetic_requests(ROWS)
+
+
+@pytest.fixture(scope="module")
+def expected(served_api, records):
+    """ Prices of the records scored one at a time (the order the batch must reproduce). """
+    return [float(served_api._predict_prices(served_api.INPUT_SCHEMA.validate(record))[0]) for record in records]
+
+
+def test_json_array_in_input_order(client, records, expected):
+    response = client.post("/predict/batch", json=records)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    results = _lines(response)
+    assert [result["index"] for result in results] == list(range(ROWS))
+    assert [result["predicted_price"] for result in results] == pytest.approx(expected, rel=1e-4)
+
+
+def test_cars_key_and_ndjson_match_the_array(client, records):
+    array = _lines(client.post("/predict/batch", json=records))
+    wrapped = _lines(client.post("/predict/batch", json={"cars": records}))
+    ndjson = client.post("/predict/batch", data="".join(json.dumps(record) + "\n" for record in records),
+                         content_type="application/x-ndjson")
+    assert ndjson.status_code == 200
+    assert wrapped == array
+    assert [result["index"] for result in _lines(ndjson)] == list(range(ROWS))
+    assert ([result["predicted_price"] for result in _lines(ndjson)]
+            == pytest.approx([result["predicted_price"] for result in array], rel=1e-4))
+
+
+def test_mini_batches_keep_the_order(client, served_api, records, expected, monkeypatch):
+    monkeypatch.setattr(served_api, "PREDICT_BATCH_SIZE", 7)
+    results = _lines(client.post("/predict/batch", json=records))
+    assert [result["index"] for result in results] == list(range(ROWS))
+    assert [result["predicted_price"] for result in results] == pytest.approx(expected, rel=1e-4)
+
+
+def test_invalid_rows_are_reported_in_place(client, records, expected):
+    missing = {k: v for k, v in records[1].items() if k != "km"}
+    not_a_number = {**records[3], "myear": "last year"}
+    body = "\n".join([json.dumps(records[0]), json.dumps(missing), "{not json", json.dumps(not_a_number),
+                      json.dumps(records[4]), "", json.dumps([1, 2])]) + "\n"
+    results = _lines(client.post("/predict/batch", data=body, content_type="application/x-ndjson"))
+    assert [result["index"] for result in results] == list(range(6))  # the blank line is skipped
+    assert results[0]["predicted_price"] == pytest.approx(expected[0], rel=1e-4)
+    assert results[1] == {"index": 1, "error": "Missing input fields: km", "fields": {"km": "missing"}}
+    assert results[2]["error"] == "Input record must be a JSON object"
+    assert results[3]["fields"] == {"myear": "not a number"} and "last year" in results[3]["error"]
+    assert results[4]["predicted_price"] == pytest.approx(expected[4], rel=1e-4)
+    assert results[5]["error"] == "Input record must be a JSON object"
+
+
+def test_empty_bodies(client):
+    assert client.post("/predict/batch", json=[]).status_code == 400
+    assert client.post("/predict/batch", json=[]).get_json() == {"error": "No input data"}
+    no_body = client.post("/predict/batch", data="", content_type="application/json")
+    assert no_body.status_code == 400 and "Expected a JSON array" in no_body.get_json()["error"]
+    assert client.post("/predict/batch", json={"car": {}}).status_code == 400
+    empty_stream = client.post("/predict/batch", data="\n\n", content_type="application/x-ndjson")
+    assert empty_stream.status_code == 200 and empty_stream.get_data() == b""
@@ -0,0 +1,49 @@
+# The model fingerprint is taken once per cache, never on the /predict path; shared-backend failures are counted
+# exactly under concurrent requests.
+import threading
+
+import prediction_cache
+from prediction_cache import PredictionCache
+
+ROW = {"body": "SUV", "km": 12000.456}
+
+
+def test_fingerprint_is_computed_once(tmp_path, monkeypatch):
+    (tmp_path / "model.ckpt").write_bytes(b"weights")
+    cache = PredictionCache(model_path=str(tmp_path))
+    walks = []
+    monkeypatch.setattr(prediction_cache.os, "walk", lambda *args: walks.append(args) or iter(()))
+    keys = {cache.make_key(ROW, ["body"], ["km"]) for _ in range(100)}
+    assert len(keys) == 1 and not walks
+
+
+def test_a_new_model_gets_new_keys(tmp_path):
+    (tmp_path / "model.ckpt").write_bytes(b"weights")
+    before = PredictionCache(model_path=str(tmp_path)).make_key(ROW, ["body"], ["km"])
+    (tmp_path / "model.ckpt").write_bytes(b"retrained weights")
+    after = PredictionCache(model_path=str(tmp_path)).make_key(ROW, ["body"], ["km"])
+    assert before != after
+
+
+class _BrokenBackend:
+    def get(self, key): raise ConnectionError("shared cache down")
+    def set(self, key, value, ttl): raise ConnectionError("shared cache down")
+
+
+def test_shared_errors_are_counted_across_threads():
+    cache = PredictionCache(shared_backend=_BrokenBackend())
+    prediction_cache.logger.disabled = True
+    def work(n):
+        for i in range(500):
+            key = f"{n}:{i}"
+            cache.get(key)
+            cache.set(key, {"predicted_price": 1.0})
+    try:
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+    finally:
+        prediction_cache.logger.disabled = False
+    stats = cache.stats()
+    assert stats["shared_errors"] == 8 * 500 * 2
+    assert stats["misses"] == 8 * 500 and stats["shared_hits"] == 0
@@ -0,0 +1,93 @@
+# PredictionLogWriter on a SQLite predictions table: flush after flush_rows rows or after flush_interval_ms,
+# rows dropped (and counted) when the queue is full, close() draining what is still queued.
+import time
+import threading
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from prediction_logger import PredictionLogWriter
+
+
+def _row(i):
+    return {"input_myear": 2015.0, "input_km": float(1000 * i), "input_body": "suv", "predicted_price": 500000.0 + i,
+            "model_version": "test"}
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline: return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def logged(api, tmp_path):
+    """ (session factory, count of rows in the predictions table) on an empty SQLite database. """
+    engine = create_engine(f"sqlite:///{tmp_path / 'predictions.db'}")
+    api.PredictionLog.__table__.create(engine)
+    session_factory = sessionmaker(bind=engine)
+    def count():
+        with engine.connect() as conn: return conn.execute(select(func.count()).select_from(api.PredictionLog.__table__)).scalar()
+    yield session_factory, count
+    engine.dispose()
+
+
+@pytest.fixture
+def make_writer(api):
+    writers = []
+    def make(session_factory, **options):
+        writers.append(PredictionLogWriter(session_factory, api.PredictionLog, **options))
+        return writers[-1]
+    yield make
+    for writer in writers: writer.close()
+
+
+def test_flushes_after_flush_rows(logged, make_writer):
+    session_factory, count = logged
+    writer = make_writer(session_factory, flush_rows=5, flush_interval_ms=60000)
+    assert writer.submit_many(_row(i) for i in range(8)) == 8
+    assert _wait_for(lambda: count() == 5)
+    time.sleep(0.2)
+    assert count() == 5  # the other 3 wait for the interval (or close)
+    assert writer.stats()["flushes"] == 1
+
+
+def test_flushes_after_interval(logged, make_writer):
+    session_factory, count = logged
+    writer = make_writer(session_factory, flush_rows=1000, flush_interval_ms=300)
+    started = time.monotonic()
+    assert writer.submit_many(_row(i) for i in range(3)) == 3
+    assert count() == 0
+    assert _wait_for(lambda: count() == 3)
+    assert time.monotonic() - started >= 0.1
+    stats = writer.stats()
+    assert stats["written"] == 3 and stats["queue_depth"] == 0
+
+
+def test_full_queue_drops_and_counts(logged, make_writer):
+    session_factory, count = logged
+    gate = threading.Event()
+    def blocked_session():
+        gate.wait(5)
+        return session_factory()
+    writer = make_writer(blocked_session, max_queue=2, flush_rows=1, flush_interval_ms=10, block_timeout=0)
+    accepted = [writer.submit(_row(i)) for i in range(10)]
+    stats = writer.stats()
+    assert accepted.count(False) == stats["dropped"] >= 7  # one row in the stalled flush, two queued
+    assert stats["enqueued"] + stats["dropped"] == 10
+    gate.set()
+    writer.close()
+    assert count() == writer.stats()["written"] == stats["enqueued"]
+
+
+def test_close_drains_pending_rows(logged, make_writer):
+    session_factory, count = logged
+    writer = make_writer(session_factory, flush_rows=1000, flush_interval_ms=60000)
+    assert writer.submit_many(_row(i) for i in range(20)) == 20
+    assert count() == 0
+    writer.close()
+    assert count() == 20
+    assert writer.stats()["written"] == 20 and not writer._thread.is_alive()
@@ -0,0 +1,8 @@
+# Offline --self-test of the deal scores: incremental passes, version roll-over and the deal-ratio ranking.
+from conftest import requires_model
+
+
+@requires_model
+def test_self_test():
+    import price_estimates
+    price_estimates.self_test(n_rows=2000)
@@ -0,0 +1,94 @@
+# SimilarCarsIndex.find_similar against the SQL SMART QUERY tiers (app._similar_car_tiers) on the same SQLite
+# inventory: same tier, same cars, same order. Covers exact-price ties, an empty tier falling through, bodies with
+# unpriced cars, and no / unknown body.
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from similar_cars_index import SimilarCarsIndex
+from synthetic_data import seed_table
+
+ROWS = 2000
+
+
+@pytest.fixture(scope="module")
+def inventory(api, tmp_path_factory):
+    """ Synthetic cars plus a few hand-made ones: a body with three priced and four unpriced cars, a body with
+    unpriced cars only. Returns (session factory, loaded index). """
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('similar') / 'cars.db'}")
+    table = api.CarInfo.__table__
+    seed_table(engine, table, ROWS)
+    extra = [(ROWS + 1, "pickup", 500000), (ROWS + 2, "pickup", 510000), (ROWS + 3, "pickup", 510000)]
+    extra += [(ROWS + 4 + i, "pickup", None) for i in range(4)] + [(ROWS + 8 + i, "roadster", None) for i in range(3)]
+    with engine.begin() as conn:
+        conn.execute(insert(table), [{"ID": car_id, "body": body, "listed_price": price, "model": f"extra {car_id}",
+                                      "image_url": f"https://images.example.com/cars/{car_id}.jpg" if car_id % 2 else None}
+                                     for car_id, body, price in extra])
+    session_factory = sessionmaker(bind=engine)
+    index = SimilarCarsIndex(session_factory, api.CarInfo, refresh_seconds=3600)
+    index.load()
+    yield session_factory, index
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def ties(api, inventory):
+    """ (body, price) listed by the most cars, and the midpoint between it and the next price of that body. """
+    session_factory, _ = inventory
+    CarInfo = api.CarInfo
+    with session_factory() as db:
+        pairs = db.execute(select(CarInfo.body, CarInfo.listed_price).where(CarInfo.listed_price != None)).all()
+    counts = {}
+    for pair in pairs: counts[pair] = counts.get(pair, 0) + 1
+    (body, price), count = max(counts.items(), key=lambda item: item[1])
+    assert count > 1
+    higher = min(p for b, p in counts if b == body and p > price)
+    return body, price, (price + higher) / 2
+
+
+def _sql_tiers(api, session_factory, target_body, prediction_result):
+    with session_factory() as db:
+        for tier, _, statement in api._similar_car_tiers(target_body, prediction_result):
+            rows = db.execute(statement).all()
+            if rows: break
+    return [api._similar_car_dict(row) for row in rows], tier
+
+
+def _check(api, inventory, target_body, prediction_result, expected_tier):
+    session_factory, index = inventory
+    cars, tier = index.find_similar(target_body, prediction_result)
+    assert (cars, tier) == _sql_tiers(api, session_factory, target_body, prediction_result)
+    assert tier == expected_tier
+    return cars
+
+
+@pytest.mark.parametrize("body, price", [("suv", 800000.0), ("hatchback", 450123.5), ("sedan", 1234567.0)])
+def test_band_tier(api, inventory, body, price):
+    cars = _check(api, inventory, body, price, 1)
+    assert 0 < len(cars) <= 10
+    assert all(0.7 * price <= car["listed_price"] <= 1.3 * price for car in cars)
+
+
+def test_exact_price_ties(api, inventory, ties):
+    body, price, midpoint = ties
+    cars = _check(api, inventory, body, float(price), 1)
+    assert cars[0]["listed_price"] == price
+    _check(api, inventory, body, midpoint, 1)
+
+
+@pytest.mark.parametrize("price", [1.0, 1e12])
+def test_empty_band_falls_through_to_body(api, inventory, price):
+    cars = _check(api, inventory, "suv", price, 2)
+    assert len(cars) == 10
+
+
+def test_unpriced_cars_fill_the_body_tier(api, inventory):
+    cars = _check(api, inventory, "pickup", 5e6, 2)
+    assert [car["listed_price"] for car in cars] == [510000, 510000, 500000, None, None, None, None]
+    assert _check(api, inventory, "roadster", 5e5, 2)
+
+
+@pytest.mark.parametrize("body", [None, "", "hovercraft"])
+def test_no_body_falls_through_to_images(api, inventory, body):
+    cars = _check(api, inventory, body, 800000.0, 3)
+    assert len(cars) == 4 and all(car["image_url"] for car in cars)
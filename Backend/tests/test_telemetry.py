@@ -0,0 +1,41 @@
+# /metrics after one /predict: the per-stage histograms and the tier label of the similar-car stage, for the
+# in-memory index and for the SQL tiers.
+import re
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+
+from synthetic_data import synthetic_requests
+
+PREDICT_STAGES = {"validate", "inference", "similar_cars", "log"}
+
+
+def _samples(client, name):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    families = {family.name: family for family in text_string_to_metric_families(response.get_data(as_text=True))}
+    return families[name].samples
+
+
+@pytest.fixture
+def uncached(served_api, monkeypatch):
+    """ No prediction cache, so the request runs every stage. """
+    monkeypatch.setattr(served_api, "prediction_cache", None)
+    return served_api
+
+
+@pytest.mark.parametrize("path, pattern", [("index", r"index_[123]"), ("sql", r"sql_[123]")])
+def test_predict_exposes_stages_and_tier(request, client, uncached, path, pattern):
+    if path == "sql": request.getfixturevalue("sql_only")
+    elif uncached.similar_cars_index is None: pytest.skip("similar-cars index not loaded")
+    response = client.post("/predict", json=synthetic_requests(1, seed=7)[0])
+    assert response.status_code == 200, response.get_json()
+
+    counts = [s for s in _samples(client, "carify_stage_duration_seconds")
+              if s.name.endswith("_count") and s.labels["endpoint"] == "/predict" and s.value > 0]
+    assert PREDICT_STAGES <= {s.labels["stage"] for s in counts}
+    tiers = {s.labels["tier"] for s in counts if s.labels["stage"] == "similar_cars"}
+    assert any(re.fullmatch(pattern, tier) for tier in tiers), tiers
+
+    answered = {s.labels["tier"] for s in _samples(client, "carify_similar_cars_tier") if s.value > 0}
+    assert any(re.fullmatch(pattern, tier) for tier in answered), answered
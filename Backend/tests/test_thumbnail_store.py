@@ -0,0 +1,6 @@
+# Offline --self-test of the thumbnail store: URL checks, WebP thumbnails, transient failures retried.
+
+
+def test_self_test():
+    import thumbnail_store
+    thumbnail_store.self_test(n_rows=2000)
@@ -0,0 +1,8 @@
+# Offline --self-test of the training pipeline: cached dataset, retrain, then load and score the way app.py does.
+import pytest
+
+
+def test_self_test():
+    pytest.importorskip("pytorch_tabular")
+    import train_model
+    train_model.self_test(n_rows=1500)
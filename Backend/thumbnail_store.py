@@ -0,0 +1,371 @@
+# --- Image Verification + WebP Thumbnail Store ---
+# The scraped image_url values point at third-party hosts: some are dead, some serve HTML error pages, some are
+# multi-megabyte originals shown in a 300px card. This stage fetches every DISTINCT image_url once, checks the
+# status, content type and size, decodes it and writes a fixed-size WebP thumbnail into a content-addressed store:
+#   THUMBNAIL_DIR/ab/abcdef....webp      (name = sha256 of the thumbnail bytes, so identical images share a file)
+# The outcome of each URL goes to the image_thumbnails table (status "ok" + hash, or the rejection reason).
+# Transient failures (connection errors, resets mid-download, 429 / 5xx) are stored too but are retried by the next
+# run, and until then the API keeps passing the original URL through.
+# The API keeps a url -> hash map of that table in memory (ThumbnailIndex) and rewrites image_url in /predict and
+# /find_by_body responses to its own /img/<hash> route, served with `Cache-Control: public, immutable`. Rejected
+# images become null (the frontend shows its placeholder); URLs not checked yet are passed through unchanged.
+#
+# Usage:
+#   python thumbnail_store.py                           # check the URLs not in image_thumbnails yet
+#   python thumbnail_store.py --recheck --concurrency 16 # check every URL again
+#   python thumbnail_store.py --self-test               # offline: SQLite + generated images behind a fake HTTP session
+import io
+import os
+import re
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy import select, distinct, delete, insert, or_
+
+from image_pipeline import pooled_session, HostRateLimiter, BROWSER_HEADERS
+from similar_cars_index import RefreshingIndex
+
+THUMBNAIL_SIZE = (480, 300)  # matches the 16:10 car cards of the frontend
+WEBP_QUALITY = 80
+MAX_SOURCE_BYTES = 8 * 1024 * 1024
+MAX_SOURCE_PIXELS = 40_000_000  # decompression-bomb guard
+ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/jpg", "image/pjpeg", "image/png", "image/webp", "image/gif",
+                         "image/bmp", "image/avif"}
+FETCH_TIMEOUT = 15
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Statuses that say nothing about the image itself: checked again by the next run, never shown as rejected
+TRANSIENT_STATUSES = {"unreachable", "http_429"} | {f"http_{code}" for code in range(500, 600)}
+
+
+class ThumbnailStore:
+    """ Content-addressed directory of WebP thumbnails: root/<first 2 hex chars>/<sha256>.webp. """
+
+    def __init__(self, root):
+        self.root = root
+
+    @staticmethod
+    def valid_hash(thumb_hash):
+        return bool(HASH_PATTERN.match(thumb_hash or ""))
+
+    def path_for(self, thumb_hash):
+        return os.path.join(self.root, thumb_hash[:2], f"{thumb_hash}.webp")
+
+    def put(self, data):
+        """ Stores the thumbnail bytes (atomic rename, no-op if already present) and returns their hash. """
+        thumb_hash = hashlib.sha256(data).hexdigest()
+        path = self.path_for(thumb_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f: f.write(data)
+            os.replace(tmp_path, path)
+        return thumb_hash
+
+    def file_count(self):
+        return sum(len(files) for _, _, files in os.walk(self.root))
+
+
+class RejectedImage(Exception):
+    """ The URL did not yield a usable image; str(e) is the status stored in image_thumbnails. """
+
+
+def fetch_image(http, limiter, url, max_bytes=MAX_SOURCE_BYTES):
+    """ GETs one image (streamed, size-capped). Returns (content type, bytes) or raises RejectedImage. """
+    host = urlparse(url).netloc
+    if urlparse(url).scheme not in ("http", "https") or not host: raise RejectedImage("bad_url")
+    limiter.wait(host)
+    try:
+        response = http.get(url, headers=BROWSER_HEADERS, timeout=FETCH_TIMEOUT, stream=True)
+    except Exception as e:
+        raise RejectedImage("unreachable") from e
+    try:
+        if response.status_code != 200: raise RejectedImage(f"http_{response.status_code}")
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type not in ALLOWED_CONTENT_TYPES: raise RejectedImage("not_an_image")
+        declared = response.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes: raise RejectedImage("too_large")
+        chunks, size = [], 0
+        try:
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > max_bytes: raise RejectedImage("too_large")
+                chunks.append(chunk)
+        except (requests.RequestException, ConnectionError, TimeoutError) as e:
+            raise RejectedImage("unreachable") from e  # reset / timeout while reading the body
+        if not size: raise RejectedImage("empty")
+        return content_type, b"".join(chunks)
+    finally:
+        response.close()
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE, quality=WEBP_QUALITY):
+    """ Decodes the source image and returns (webp bytes, (source width, source height)); center-cropped to `size`. """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            source_size = image.size
+            if source_size[0] * source_size[1] > MAX_SOURCE_PIXELS: raise RejectedImage("too_many_pixels")
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+            thumbnail = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+        raise RejectedImage("undecodable") from e
+    out = io.BytesIO()
+    thumbnail.save(out, "WEBP", quality=quality, method=4)
+    return out.getvalue(), source_size
+
+
+class ThumbnailBuilder:
+    """ Checks every distinct "car data".image_url and records the outcome in the thumbnail table. """
+
+    def __init__(self, session_factory, car_model, thumb_model, store, concurrency=8, batch_size=200,
+                 rates=None, default_rate=4.0, http=None):
+        self.session_factory = session_factory
+        self.car_model = car_model
+        self.thumb_model = thumb_model
+        self.store = store
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.limiter = HostRateLimiter(rates or {}, default_rate=default_rate)
+        self.http = http or pooled_session(concurrency, retries=2)
+        self.stats = {"checked": 0, "ok": 0, "rejected": 0, "retryable": 0, "source_bytes": 0, "thumbnail_bytes": 0}
+        self._stats_lock = threading.Lock()
+
+    def pending_urls(self, recheck=False, limit=None):
+        """ Distinct image URLs of the inventory, minus those already in the thumbnail table unless recheck
+        (URLs whose last check failed transiently are always checked again). """
+        db = self.session_factory()
+        try:
+            self.thumb_model.__table__.create(db.get_bind(), checkfirst=True)
+            image_url = self.car_model.image_url
+            urls = db.execute(select(distinct(image_url)).where(image_url != None, image_url != "")).scalars().all()
+            if not recheck:
+                thumb = self.thumb_model
+                known = set(db.execute(select(thumb.source_url).where(thumb.status.notin_(TRANSIENT_STATUSES))).scalars())
+                urls = [url for url in urls if url not in known]
+        finally:
+            db.close()
+        urls.sort()
+        return urls[:limit] if limit else urls
+
+    def check(self, url):
+        """ Fetch + verify + thumbnail one URL; returns its image_thumbnails row. """
+        row = {"source_url": url, "status": "ok", "thumb_hash": None, "content_type": None, "source_bytes": None,
+               "width": None, "height": None, "checked_at": time.time()}
+        try:
+            row["content_type"], data = fetch_image(self.http, self.limiter, url)
+            row["source_bytes"] = len(data)
+            thumbnail, (row["width"], row["height"]) = make_thumbnail(data)
+            row["thumb_hash"] = self.store.put(thumbnail)
+        except RejectedImage as e:
+            row["status"] = str(e)
+        with self._stats_lock:
+            self.stats["checked"] += 1
+            if row["thumb_hash"]:
+                self.stats["ok"] += 1
+                self.stats["source_bytes"] += row["source_bytes"]
+                self.stats["thumbnail_bytes"] += len(thumbnail)
+            elif row["status"] in TRANSIENT_STATUSES:
+                self.stats["retryable"] += 1
+            else:
+                self.stats["rejected"] += 1
+        return row
+
+    def _write(self, rows):
+        """ Replaces the rows of these URLs in one transaction (portable upsert). """
+        table = self.thumb_model.__table__
+        db = self.session_factory()
+        try:
+            db.execute(delete(table).where(table.c.source_url.in_([row["source_url"] for row in rows])))
+            db.execute(insert(table), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def run(self, recheck=False, limit=None):
+        urls = self.pending_urls(recheck, limit)
+        print(f"--- Checking {len(urls)} image URLs with {self.concurrency} workers ---")
+        start = time.perf_counter()
+        batch = []
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="thumbnail") as pool:
+            for done, row in enumerate(pool.map(self.check, urls), 1):
+                batch.append(row)
+                if len(batch) >= self.batch_size or done == len(urls):
+                    self._write(batch)
+                    batch = []
+                    print(f"  [{done}/{len(urls)}] {self.stats['ok']} ok, {self.stats['rejected']} rejected, "
+                          f"{self.stats['retryable']} to retry "
+                          f"({done / (time.perf_counter() - start):.1f} urls/s)")
+        print(f"--- Done in {time.perf_counter() - start:.1f}s: {self.stats} ---")
+        return self.stats
+
+
+class _ThumbnailSnapshot:
+    """ source url -> thumbnail hash (None for rejected images). Transient failures are left out: not checked yet. """
+
+    def __init__(self, rows):
+        self.by_url = {url: thumb_hash for url, status, thumb_hash in rows if status not in TRANSIENT_STATUSES}
+        self.row_count = len(self.by_url)
+        self.ok_count = sum(1 for thumb_hash in self.by_url.values() if thumb_hash)
+        self.retry_count = len(rows) - self.row_count
+        self.loaded_at = time.time()
+
+
+class ThumbnailIndex(RefreshingIndex):
+    """ In-memory copy of image_thumbnails used to point image_url at /img/<hash>. """
+
+    name = "thumbnail index"
+    unit = "image urls"
+
+    def __init__(self, session_factory, car_model, thumb_model, refresh_seconds=600.0):
+        super().__init__(session_factory, car_model, refresh_seconds)
+        self.thumb_model = thumb_model
+
+    def _build(self, db):
+        table = self.thumb_model.__table__
+        try:
+            rows = db.execute(select(table.c.source_url, table.c.status, table.c.thumb_hash)).all()
+        except Exception:
+            db.rollback()  # table does not exist until thumbnail_store.py has run once
+            rows = []
+        return _ThumbnailSnapshot(rows)
+
+    def _snapshot_stats(self, snapshot):
+        return {"thumbnails": snapshot.ok_count, "rejected": snapshot.row_count - snapshot.ok_count,
+                "retryable": snapshot.retry_count}
+
+    def local_url(self, url, base_url):
+        """ /img URL of a verified image, None for a rejected one, `url` itself when it was never checked (or its
+        last check failed transiently). """
+        self.maybe_refresh()
+        if not url: return url
+        by_url = self._snapshot.by_url
+        if url not in by_url: return url
+        thumb_hash = by_url[url]
+        return f"{base_url}/img/{thumb_hash}" if thumb_hash else None
+
+    def rewrite(self, cars, base_url):
+        """ Copies of the car dicts with image_url replaced by local_url(). """
+        return [dict(car, image_url=self.local_url(car.get("image_url"), base_url)) for car in cars]
+
+
+# === OFFLINE SELF-TEST ============================================
+
+class _FakeResponse:
+    def __init__(self, status_code, content_type, body, reset_after=None):
+        self.status_code = status_code
+        self.headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+        self._body = body
+        self._reset_after = reset_after
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self._body), chunk_size):
+            if self._reset_after is not None and i >= self._reset_after:
+                raise requests.exceptions.ChunkedEncodingError("Connection reset by peer")
+            yield self._body[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeImageHost:
+    """ requests.Session stand-in serving generated images (and a few broken answers) from memory. """
+
+    def __init__(self, n_images=40):
+        self.responses = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        for i in range(n_images):
+            color = (i * 53 % 256, i * 97 % 256, i * 31 % 256)
+            fmt, content_type = (("JPEG", "image/jpeg"), ("PNG", "image/png"))[i % 2]
+            out = io.BytesIO()
+            Image.new("RGB", (1600 + i, 1000), color).save(out, fmt)
+            self.responses[f"https://img{i % 4}.mock/car{i}.{fmt.lower()}"] = (200, content_type, out.getvalue())
+        # Same picture published at a second URL: one file in the store
+        self.responses["https://mirror.mock/car0.jpeg"] = self.responses["https://img0.mock/car0.jpeg"]
+        self.responses["https://img1.mock/gone.jpg"] = (404, "text/html", b"<html>not found</html>")
+        self.responses["https://img2.mock/page.jpg"] = (200, "text/html", b"<html>are you human?</html>")
+        self.responses["https://img3.mock/corrupt.jpg"] = (200, "image/jpeg", b"\xff\xd8\xff" + b"\0" * 512)
+        self.responses["https://img3.mock/huge.png"] = (200, "image/png", b"\0" * (MAX_SOURCE_BYTES + 1))
+        # Transient: checked again by the next run
+        self.responses["https://img0.mock/reset.jpg"] = (200, "image/jpeg", b"\xff\xd8\xff" + b"\1" * 256 * 1024, 64 * 1024)
+        self.responses["https://img1.mock/busy.jpg"] = (503, "text/html", b"<html>try later</html>")
+
+    def get(self, url, **kwargs):
+        with self._lock: self.requests += 1
+        if url not in self.responses: raise ConnectionError(f"no route to {url}")
+        return _FakeResponse(*self.responses[url])
+
+
+def self_test(n_rows=5000, concurrency=8):
+    from sqlalchemy import create_engine, update
+    from sqlalchemy.orm import sessionmaker
+    from synthetic_data import seed_table
+    import app as api
+
+    work_dir = tempfile.mkdtemp(prefix="thumbnails_")
+    engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'cars.db')}")
+    seed_table(engine, api.CarInfo.__table__, n_rows)
+    host = FakeImageHost()
+    urls = sorted(host.responses) + ["https://offline.mock/missing.jpg", "ftp://img0.mock/car.jpg"]
+    with engine.begin() as conn:
+        for i, url in enumerate(urls):
+            conn.execute(update(api.CarInfo.__table__).where(api.CarInfo.__table__.c.ID % len(urls) == i).values(image_url=url))
+    Session = sessionmaker(bind=engine)
+    store = ThumbnailStore(os.path.join(work_dir, "thumbnails"))
+
+    builder = ThumbnailBuilder(Session, api.CarInfo, api.ImageThumbnail, store, concurrency=concurrency,
+                               batch_size=10, default_rate=1000.0, http=host)
+    stats = builder.run()
+    assert host.requests == len(urls) - 1, "every distinct http(s) URL must be fetched exactly once"
+    assert stats["ok"] == 41 and stats["rejected"] == 5 and stats["retryable"] == 3, stats
+    assert store.file_count() == 40, "identical images must share one thumbnail file"
+    transient = ["https://img0.mock/reset.jpg", "https://img1.mock/busy.jpg", "https://offline.mock/missing.jpg"]
+    assert ThumbnailBuilder(Session, api.CarInfo, api.ImageThumbnail, store, http=host).pending_urls() == transient
+
+    index = ThumbnailIndex(Session, api.CarInfo, api.ImageThumbnail)
+    index.load()
+    local = index.local_url("https://img0.mock/car0.jpeg", "http://api")
+    assert local == index.local_url("https://mirror.mock/car0.jpeg", "http://api")
+    thumb_hash = local.rsplit("/", 1)[1]
+    with Image.open(store.path_for(thumb_hash)) as image: assert image.format == "WEBP" and image.size == THUMBNAIL_SIZE
+    assert index.local_url("https://img2.mock/page.jpg", "http://api") is None
+    assert index.local_url("https://never.checked/x.jpg", "http://api") == "https://never.checked/x.jpg"
+    assert all(index.local_url(url, "http://api") == url for url in transient)
+    print(f"--- {stats['source_bytes'] / 1e6:.1f} MB of source images -> {stats['thumbnail_bytes'] / 1e6:.2f} MB of thumbnails ---")
+    print(f"--- Self-test passed ({work_dir}) ---")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify "car data".image_url and build the WebP thumbnail store')
+    parser.add_argument("--thumbnail-dir", default=os.getenv("THUMBNAIL_DIR", "thumbnails"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=200, help="URLs per image_thumbnails write")
+    parser.add_argument("--rate", type=float, default=4.0, help="requests per second per image host")
+    parser.add_argument("--recheck", action="store_true", help="check URLs already in image_thumbnails again")
+    parser.add_argument("--limit", type=int, default=None, help="check at most this many URLs")
+    parser.add_argument("--self-test", action="store_true", help="offline run against SQLite and generated images")
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        self_test(concurrency=args.concurrency)
+        return
+    import app as api
+    if not api.init_database(): raise SystemExit(1)
+    builder = ThumbnailBuilder(api.SessionLocal, api.CarInfo, api.ImageThumbnail, ThumbnailStore(args.thumbnail_dir),
+                               concurrency=args.concurrency, batch_size=args.batch_size, default_rate=args.rate)
+    builder.run(recheck=args.recheck, limit=args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+# --- Training Pipeline (model.ipynb as a reproducible CLI) ---
+# Trains the FT-Transformer served by app.py from "Car data to fed to the model.csv", with the notebook's
+# cleaning steps and model, timed stage by stage:
+#   hash       sha256 of the source file: the key of the preprocessed-dataset cache
+#   load       cache hit: the cleaned, typed dataset from <cache-dir>/<key>.parquet. Miss: parse the CSV (pyarrow's
+#              multithreaded reader, then the C parser skipping bad lines, the python parser only as a last resort),
+#              clean it like the notebook (column names, price > 20,000, log1p target, gear_box digits,
+#              median/mode imputation, str/float dtypes) and write the cache
+#   split      80/20 train/validation split (random_state = --seed, as in the notebook)
+#   prepare    encoders + normalisation fitted, DataLoaders built (--num-workers worker processes)
+#   train      Lightning fit with early stopping on valid_loss
+#   evaluate   validation RMSE / MAE / MAPE in rupees
+#   save       saved_car_model_<name>/ (TabularModel.save_model): MODEL_PATH for app.py, or model_registry.py
+# The run summary (source hash, cache hit, rows, stage timings, metrics, settings) is written next to the model as
+# training_run.json, so the cost of a retrain can be compared between runs.
+# CPU-friendly defaults instead of the notebook's batch_size 32 / num_workers 0: batches of 1024 rows and
+# persistent DataLoader workers. The learning rate is scaled with sqrt(batch size / 32) from the notebook's 1e-4.
+#
+# Usage:
+#   python train_model.py --csv "Car data to fed to the model.csv"                 # -> saved_car_model_log_<timestamp>
+#   python train_model.py --csv cars.csv --output saved_car_model_log_v2 --register v2 --promote
+#   python train_model.py --self-test                                              # synthetic CSV, 2 epochs, twice
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+import app as api
+
+PREPROCESS_VERSION = 1  # bump when clean_dataset changes: cached datasets of older versions are not reused
+DEFAULT_CACHE_DIR = os.getenv("TRAINING_CACHE_DIR", ".training_cache")
+MIN_PRICE = 20000  # listings below this are data errors (notebook step 3.2)
+TARGET_COL = f"log_{api.ORIGINAL_TARGET_COL}"
+NOTEBOOK_BATCH_SIZE, NOTEBOOK_LEARNING_RATE = 32, 1e-4
+NOTEBOOK_ARCHITECTURE = {"input_embed_dim": 32, "num_heads": 4, "num_attn_blocks": 2,
+                         "attn_dropout": 0.1, "ff_dropout": 0.1, "embedding_dropout": 0.1}
+
+
+class StageTimer:
+    """ Wall-clock seconds per pipeline stage, printed as each one finishes. """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = round(time.perf_counter() - start, 3)
+        print(f"--- [{name}] {self.seconds[name]:.2f}s ---")
+
+
+# === DATASET ======================================================
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_source_csv(path):
+    """ Raw CSV: pyarrow's multithreaded parser, then the C parser skipping malformed lines, then python's. """
+    try:
+        return pd.read_csv(path, engine="pyarrow")
+    except Exception as e:
+        print(f"!!! pyarrow CSV parser failed ({e}), retrying with the C parser (bad lines skipped) !!!")
+    try:
+        return pd.read_csv(path, on_bad_lines="skip", low_memory=False)
+    except pd.errors.ParserError as e:
+        print(f"!!! C parser failed ({e}), retrying with engine='python' !!!")
+        return pd.read_csv(path, engine="python", on_bad_lines="skip")
+
+
+def clean_dataset(raw):
+    """ The notebook's cleaning (steps 2-4): model-ready columns with str categoricals, float numericals and the
+    log1p target. Imputation statistics come from the whole dataset, as in the notebook. """
+    df = raw.copy()
+    df.columns = df.columns.str.replace(" ", "_").str.lower()
+    df = df[pd.to_numeric(df[api.ORIGINAL_TARGET_COL], errors="coerce") > MIN_PRICE].copy()
+    df[TARGET_COL] = np.log1p(df.pop(api.ORIGINAL_TARGET_COL).astype(float))
+    df["gear_box"] = df["gear_box"].astype(str).str.extract(r"(\d+)", expand=False).astype(float)
+
+    numerical, categorical = api.CLEANED_NUMERICAL_COLS, api.CLEANED_CATEGORICAL_COLS
+    for col in numerical:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+        if df[col].isnull().any(): df[col] = df[col].fillna(df[col].median())
+    for col in categorical:
+        if df[col].isnull().any(): df[col] = df[col].fillna(df[col].mode()[0])
+    df[categorical] = df[categorical].astype(str)
+    df[numerical] = df[numerical].astype(float)
+    return df[categorical + numerical + [TARGET_COL]].reset_index(drop=True)
+
+
+def load_dataset(csv_path, cache_dir, source_hash):
+    """ (cleaned dataset, cache hit?) for the source file, from the Parquet cache when its key matches. """
+    key = f"{source_hash[:24]}-p{PREPROCESS_VERSION}"
+    cache_path = os.path.join(cache_dir, f"{key}.parquet")
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path), True
+    df = clean_dataset(read_source_csv(csv_path))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp, index=False, compression="zstd")
+    os.replace(tmp, cache_path)  # concurrent runs never read half a file
+    return df, False
+
+
+# === MODEL ========================================================
+
+def build_model(batch_size, learning_rate, max_epochs, num_workers, seed, work_dir, tensorboard=False,
+                architecture=None, progress_bar="simple"):
+    """ The notebook's FT-Transformer (same architecture, early stopping, load_best) with CPU-friendly loading.
+    architecture: FTTransformerConfig settings replacing NOTEBOOK_ARCHITECTURE's (hparam_search.py). """
+    from pytorch_tabular import TabularModel
+    from pytorch_tabular.config import DataConfig, TrainerConfig, ExperimentConfig, OptimizerConfig
+    from pytorch_tabular.models import FTTransformerConfig
+
+    data_config = DataConfig(
+        target=[TARGET_COL],
+        continuous_cols=api.CLEANED_NUMERICAL_COLS,
+        categorical_cols=api.CLEANED_CATEGORICAL_COLS,
+        num_workers=num_workers,
+        pin_memory=False,  # CPU training: nothing to pin for
+        # Workers survive between epochs instead of being re-forked for every train / validation pass
+        dataloader_kwargs={"persistent_workers": True} if num_workers > 0 else {},
+    )
+    trainer_config = TrainerConfig(
+        auto_lr_find=False,
+        batch_size=batch_size,
+        max_epochs=max_epochs,
+        accelerator="auto",
+        devices=1,
+        early_stopping="valid_loss",
+        early_stopping_patience=5,
+        check_val_every_n_epoch=1,
+        checkpoints_path=work_dir,
+        load_best=True,
+        progress_bar=progress_bar,
+        seed=seed,
+        trainer_kwargs={"default_root_dir": work_dir},  # Lightning's default logger writes there, not into the cwd
+    )
+    model_config = FTTransformerConfig(
+        task="regression",
+        learning_rate=learning_rate,
+        **{**NOTEBOOK_ARCHITECTURE, **(architecture or {})},
+    )
+    experiment_config = ExperimentConfig(project_name="Car_Price_Log_Transform_v1", log_target="tensorboard") if tensorboard else None
+    return TabularModel(data_config=data_config, model_config=model_config, optimizer_config=OptimizerConfig(),
+                        trainer_config=trainer_config, experiment_config=experiment_config)
+
+
+def _allow_checkpoint_globals():
+    """ torch.load (weights_only) of the Lightning checkpoints that load_best reads back (notebook step 7). """
+    import typing
+    import collections
+    import torch
+    from omegaconf.base import ContainerMetadata, Metadata
+    from omegaconf.dictconfig import DictConfig
+    from omegaconf.listconfig import ListConfig
+    from omegaconf.nodes import AnyNode
+    torch.serialization.add_safe_globals([ContainerMetadata, typing.Any, dict, collections.defaultdict, ListConfig,
+                                          list, int, AnyNode, Metadata, DictConfig])
+
+
+def evaluate(tabular_model, val_df):
+    """ Validation error in rupees (the model predicts log1p(price)). """
+    predicted = np.expm1(tabular_model.predict(val_df)[f"{TARGET_COL}_prediction"].to_numpy())
+    actual = np.expm1(val_df[TARGET_COL].to_numpy())
+    error = predicted - actual
+    return {"val_rmse": round(float(np.sqrt(np.mean(error ** 2))), 2), "val_mae": round(float(np.mean(np.abs(error))), 2),
+            "val_mape": round(float(np.mean(np.abs(error) / actual)), 4), "val_rows": int(len(val_df))}
+
+
+def _serving_config(tabular_model):
+    """ The saved config is what app.py loads: no DataLoader worker processes per TabularModel.predict call. """
+    for config in (tabular_model.config, getattr(tabular_model.datamodule, "config", None)):
+        if config is None: continue
+        config.num_workers = 0
+        config.dataloader_kwargs = {}
+        if "trainer_kwargs" in config: config.trainer_kwargs = {}  # the run's temporary directory
+
+
+# === PIPELINE =====================================================
+
+def default_num_workers():
+    return min(4, max(0, api._available_cpus() - 1))
+
+
+def default_learning_rate(batch_size):
+    return NOTEBOOK_LEARNING_RATE * float(np.sqrt(batch_size / NOTEBOOK_BATCH_SIZE))
+
+
+def split_dataset(df, seed):
+    """ (train, validation): the notebook's 80/20 split. """
+    from sklearn.model_selection import train_test_split
+    if len(df) < 20:
+        print("!!! Fewer than 20 rows: training and validating on the full dataset !!!")
+        return df, df
+    return train_test_split(df, test_size=0.2, random_state=seed)
+
+
+def run(csv_path, output, cache_dir=DEFAULT_CACHE_DIR, batch_size=1024, learning_rate=None, max_epochs=50,
+        num_workers=None, seed=42, tensorboard=False):
+    """ Runs every stage and writes the model to `output`; returns the run summary (also saved as training_run.json). """
+    import torch
+
+    num_workers = default_num_workers() if num_workers is None else num_workers
+    learning_rate = learning_rate or default_learning_rate(batch_size)
+    torch.set_num_threads(api._available_cpus())
+    _allow_checkpoint_globals()
+    timer = StageTimer()
+    total_start = time.perf_counter()
+
+    with timer.stage("hash"):
+        source_hash = file_sha256(csv_path)
+    with timer.stage("load"):
+        df, cache_hit = load_dataset(csv_path, cache_dir, source_hash)
+    print(f"--- {len(df):,} rows ({'cached dataset' if cache_hit else 'parsed + cleaned, now cached'}) ---")
+    with timer.stage("split"):
+        train_df, val_df = split_dataset(df, seed)
+
+    work_dir = tempfile.mkdtemp(prefix="train_model_")
+    try:
+        tabular_model = build_model(batch_size, learning_rate, max_epochs, num_workers, seed, work_dir, tensorboard)
+        with timer.stage("prepare"):
+            datamodule = tabular_model.prepare_dataloader(train=train_df, validation=val_df, seed=seed)
+            model = tabular_model.prepare_model(datamodule)
+        with timer.stage("train"):
+            tabular_model.train(model, datamodule)
+        with timer.stage("evaluate"):
+            metrics = evaluate(tabular_model, val_df)
+        with timer.stage("save"):
+            _serving_config(tabular_model)
+            if os.path.exists(output): shutil.rmtree(output)
+            tabular_model.save_model(output)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    epochs = tabular_model.trainer.current_epoch if getattr(tabular_model, "trainer", None) is not None else None
+    summary = {
+        "source": os.path.abspath(csv_path), "source_sha256": source_hash, "preprocess_version": PREPROCESS_VERSION,
+        "cache_hit": cache_hit, "rows": int(len(df)), "train_rows": int(len(train_df)), "epochs": epochs,
+        "settings": {"batch_size": batch_size, "learning_rate": learning_rate, "max_epochs": max_epochs,
+                     "num_workers": num_workers, "seed": seed, "threads": torch.get_num_threads()},
+        "stage_seconds": timer.seconds, "total_seconds": round(time.perf_counter() - total_start, 3),
+        "metrics": metrics, "finished_at": time.time(),
+    }
+    with open(os.path.join(output, "training_run.json"), "w") as f: json.dump(summary, f, indent=2)
+    print(f"--- Model saved to {output} in {summary['total_seconds']:.1f}s: "
+          + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timer.seconds.items()) + " ---")
+    print(f"--- Validation RMSE {metrics['val_rmse']:,.0f}, MAE {metrics['val_mae']:,.0f}, MAPE {metrics['val_mape']:.1%} ---")
+    return summary
+
+
+def write_synthetic_csv(path, n_rows):
+    """ Synthetic cars in the layout of the notebook's CSV (Text dimensions, "N Speed" gear boxes, a few missing
+    lengths and sub-MIN_PRICE listings). Returns the raw frame written. """
+    from synthetic_data import synthetic_cars
+
+    raw = synthetic_cars(n_rows).drop(columns=["ID", "oem", "model", "variant", "image_url", "length_mm", "width_mm",
+                                               "height_mm", "wheel_base_mm", "kerb_weight_kg", "max_torque_rpm"])
+    raw["Gear Box"] = raw["Gear Box"].astype(str) + " Speed"
+    raw.loc[raw.sample(frac=0.05, random_state=1).index, "Length"] = None  # imputed
+    raw.loc[:9, "listed_price"] = 5000  # below MIN_PRICE: dropped
+    raw.to_csv(path, index=False)
+    return raw
+
+
+def self_test(n_rows=3000):
+    """ Synthetic CSV in the notebook's layout, trained twice (the second run must hit the cache), then loaded the
+    way app.py loads MODEL_PATH and scored. """
+    from synthetic_data import synthetic_requests
+
+    work_dir = tempfile.mkdtemp(prefix="train_model_test_")
+    csv_path = os.path.join(work_dir, "cars.csv")
+    raw = write_synthetic_csv(csv_path, n_rows)
+    cache_dir = os.path.join(work_dir, "cache")
+
+    output = os.path.join(work_dir, "saved_car_model_log_test")
+    first = run(csv_path, output, cache_dir, max_epochs=2)
+    second = run(csv_path, output, cache_dir, max_epochs=2)
+    assert not first["cache_hit"] and second["cache_hit"], (first["cache_hit"], second["cache_hit"])
+    assert first["rows"] == second["rows"] == int((raw["listed_price"] > MIN_PRICE).sum()), first["rows"]
+
+    loaded = api._load_version("self-test", output)
+    validated = api.INPUT_SCHEMA.validate(synthetic_requests(20))
+    prices = api._predict_prices(validated, loaded)
+    assert np.isfinite(prices).all() and (prices > 0).all(), prices
+    shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"--- Self-test passed: load {first['stage_seconds']['load']:.2f}s parsed vs "
+          f"{second['stage_seconds']['load']:.2f}s cached; served {len(prices)} predictions from the saved model ---")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the car price model (model.ipynb) from the CSV dataset")
+    parser.add_argument("--csv", default="Car data to fed to the model.csv")
+    parser.add_argument("--output", default=None, help="model directory (default: saved_car_model_log_<timestamp>)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="preprocessed dataset cache (Parquet)")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--learning-rate", type=float, default=None, help="default: 1e-4 * sqrt(batch size / 32)")
+    parser.add_argument("--max-epochs", type=int, default=50)
+    parser.add_argument("--num-workers", type=int, default=None, help="DataLoader worker processes (default: cores - 1, max 4)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tensorboard", action="store_true", help="log the run to tensorboard (as the notebook did)")
+    parser.add_argument("--register", metavar="VERSION", default=None, help="also register the model in model_registry.py")
+    parser.add_argument("--promote", action="store_true", help="with --register: serve the new version")
+    parser.add_argument("--self-test", action="store_true", help="train twice on a synthetic CSV and load the result")
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        self_test()
+        return
+    output = args.output or f"saved_car_model_log_{time.strftime('%Y%m%d_%H%M%S')}"
+    summary = run(args.csv, output, args.cache_dir, args.batch_size, args.learning_rate, args.max_epochs,
+                  args.num_workers, args.seed, args.tensorboard)
+    if args.register:
+        import model_registry
+        manifest = model_registry.register(api.MODEL_REGISTRY_DIR, output, args.register,
+                                           notes=f"train_model.py on {os.path.basename(args.csv)}", metrics=summary["metrics"])
+        print(f"--- Registered {manifest['version']} in {api.MODEL_REGISTRY_DIR} ---")
+        if args.promote:
+            model_registry.promote(api.MODEL_REGISTRY_DIR, manifest["version"])
+            print(f"--- {manifest['version']} is now current ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# --- Gunicorn worker memory / throughput benchmark ---
+# Starts gunicorn (gunicorn.conf.py) with 1, 4, 16 workers, with and without PRELOAD_MODEL, waits until every
+# worker reports ready, then records per-worker memory (RSS, USS = private, PSS = fair share of shared pages)
+# and drives /predict with concurrent clients for a fixed time: requests/s, p50/p99 latency, errors.
+# Memory is sampled when idle and again after the load (the table shows the latter).
+# The rest of the app's configuration (MODEL_SERVING_MODE, DATABASE_URI, ...) is taken from the environment.
+#
+# Usage:
+#   python worker_benchmark.py                                    # 1 4 16 workers x preload / no-preload
+#   python worker_benchmark.py --workers 4 --modes preload --duration 20 --json workers.json
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import itertools
+import subprocess
+import threading
+
+import numpy as np
+import psutil
+import requests
+
+from synthetic_data import synthetic_requests
+
+PREDICT_PATH = "/predict"
+
+
+def _wait_until_ready(base_url, master, workers, timeout):
+    """ Polls /readyz until `workers` distinct worker pids answered 200. """
+    ready_pids = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if master.poll() is not None: raise RuntimeError(f"gunicorn exited with code {master.returncode}")
+        try:
+            response = requests.get(base_url + "/readyz", timeout=2)
+            if response.status_code == 200: ready_pids.add(response.json()["pid"])
+        except requests.RequestException:
+            pass
+        if len(ready_pids) >= workers: return
+        time.sleep(0.05 if ready_pids else 0.5)
+    raise RuntimeError(f"only {len(ready_pids)}/{workers} workers ready after {timeout}s")
+
+
+def _memory(master_pid):
+    """ MB per process: master + each worker (rss, uss, pss) and the total PSS (real footprint of the server). """
+    master = psutil.Process(master_pid)
+    def info(process):
+        mem = process.memory_full_info()
+        return {"rss_mb": mem.rss / 2**20, "uss_mb": mem.uss / 2**20, "pss_mb": getattr(mem, "pss", mem.uss) / 2**20}
+    workers = [info(child) for child in master.children()]
+    master_info = info(master)
+    return {
+        "master": master_info,
+        "worker_rss_mb": float(np.mean([w["rss_mb"] for w in workers])),
+        "worker_uss_mb": float(np.mean([w["uss_mb"] for w in workers])),
+        "worker_pss_mb": float(np.mean([w["pss_mb"] for w in workers])),
+        "total_pss_mb": master_info["pss_mb"] + sum(w["pss_mb"] for w in workers),
+    }
+
+
+def _drive(base_url, bodies, clients, duration):
+    """ `clients` threads POST /predict back to back for `duration` seconds. """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    body_iter = itertools.cycle(bodies)
+
+    def client():
+        session = requests.Session()
+        local = []
+        local_errors = 0
+        while time.monotonic() < stop_at:
+            with lock: body = next(body_iter)
+            start = time.perf_counter()
+            try:
+                ok = session.post(base_url + PREDICT_PATH, json=body, timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            local.append(time.perf_counter() - start)
+            if not ok: local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.monotonic()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.monotonic() - started
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": int(len(latencies)),
+        "errors": errors[0],
+        "rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+    }
+
+
+def run(workers, preload, port, clients, duration, ready_timeout, bodies):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PRELOAD_MODEL="1" if preload else "0",
+               BIND=f"127.0.0.1:{port}", PREDICTION_CACHE_SIZE=os.getenv("PREDICTION_CACHE_SIZE", "0"))
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.monotonic()
+    master = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_until_ready(base_url, master, workers, ready_timeout)
+        result = {"workers": workers, "preload": preload, "ready_s": time.monotonic() - started}
+        result["memory_idle"] = _memory(master.pid)
+        result.update(_drive(base_url, bodies, clients or 2 * workers, duration))
+        # Serving dirties some shared pages (refcounts, allocator): the footprint after load is the one that counts
+        result.update(_memory(master.pid))
+        return result
+    finally:
+        master.send_signal(signal.SIGTERM)
+        try:
+            master.wait(30)
+        except subprocess.TimeoutExpired:
+            master.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RSS per worker and /predict throughput for N gunicorn workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--modes", nargs="+", choices=["preload", "no-preload"], default=["preload", "no-preload"])
+    parser.add_argument("--clients", type=int, default=0, help="concurrent clients; default 2 x workers")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of load per configuration")
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+
+    bodies = synthetic_requests(2000)
+    results = []
+    print(f"  {'workers':>7} {'mode':<11}{'ready s':>8}{'RSS/wkr':>9}{'USS/wkr':>9}{'PSS/wkr':>9}{'PSS tot':>9}"
+          f"{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>7}")
+    for workers, mode in itertools.product(args.workers, args.modes):
+        try:
+            r = run(workers, mode == "preload", args.port, args.clients, args.duration, args.ready_timeout, bodies)
+        except Exception as e:
+            print(f"!!! {workers} workers / {mode} failed: {e} !!!")
+            continue
+        results.append(r)
+        print(f"  {workers:>7} {mode:<11}{r['ready_s']:>8.1f}{r['worker_rss_mb']:>9.0f}{r['worker_uss_mb']:>9.0f}"
+              f"{r['worker_pss_mb']:>9.0f}{r['total_pss_mb']:>9.0f}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"{r['errors']:>7}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cpus": os.cpu_count(), "results": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()